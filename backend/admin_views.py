@@ -9,6 +9,9 @@ import io
 import base64
 import matplotlib.pyplot as plt
 from django.contrib.admin.views.decorators import staff_member_required
+from llm import metrics, routing
+
+from . import circuit_breaker
 
 # This is your existing view for the index page
 from django.contrib import admin
@@ -41,6 +44,7 @@ def my_admin_index(request, extra_context=None):
     extra_context['total_users'] = total_users
     extra_context['active_users'] = active_users
     extra_context['passive_users'] = passive_users
+    extra_context['breakers'] = circuit_breaker.status()
     
     # Call the original admin index view with our new context
     return admin.site.index(request, extra_context)
@@ -82,4 +86,20 @@ def user_graph_view(request):
         'graph_data': graph_data,
         **admin.site.each_context(request), # Adds default admin context
     }
-    return render(request, 'admin/user_graph.html', context)
\ No newline at end of file
+    return render(request, 'admin/user_graph.html', context)
+
+
+@staff_member_required
+def llm_usage_view(request):
+    """
+    LLM calls made by this server process, per task and model: outcomes,
+    latency percentiles, tokens and estimated cost (see llm.metrics), and
+    the model each task is currently routed to (llm.routing).
+    """
+    context = {
+        'title': 'LLM Usage',
+        'rows': metrics.snapshot(),
+        'routes': routing.status(),
+        **admin.site.each_context(request),
+    }
+    return render(request, 'admin/llm_usage.html', context)
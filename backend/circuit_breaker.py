@@ -0,0 +1,200 @@
+"""
+Circuit breakers for the services this project depends on (Gemini, Drive).
+
+Every call to a service is recorded in its breaker. When at least
+CIRCUIT_MIN_CALLS calls were made in the last CIRCUIT_WINDOW seconds and
+CIRCUIT_FAILURE_RATE of them failed, the breaker opens: calls fail at once
+with CircuitOpenError for CIRCUIT_OPEN_SECONDS instead of waiting for
+the service to time out. After that it is half-open and lets
+CIRCUIT_HALF_OPEN_PROBES calls through; if they succeed it closes, if one
+fails it opens again.
+
+    @protect('drive')
+    def upload_file_to_drive(...): ...
+
+    with call('drive'):
+        ...
+
+    check('drive')   # in a view: 503 + Retry-After while the breaker is open
+
+CircuitOpenError is a DRF APIException, so a view that lets it through
+answers 503 with a Retry-After header. Each process has its own breakers.
+"""
+import functools
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+# Shown on the admin index even before their first call.
+SERVICES = ('drive', 'gemini')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_code = 'service_unavailable'
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name.capitalize()} is unavailable right now. Please try again in {math.ceil(retry_after)}s.")
+        self.name = name
+        self.retry_after = retry_after
+        # DRF's exception handler turns `wait` into the Retry-After header.
+        self.wait = math.ceil(retry_after)
+
+
+class CircuitBreaker:
+    def __init__(self, name):
+        self.name = name
+        self.state = CLOSED
+        self.opened_at = None
+        self.probes = 0          # half-open calls in flight
+        self.calls = deque()     # (time, succeeded) within the window
+        self._lock = threading.Lock()
+
+    def _retry_after(self, now):
+        return max(0.0, self.opened_at + settings.CIRCUIT_OPEN_SECONDS - now)
+
+    def allow(self):
+        """
+        Raises CircuitOpenError if the call may not go ahead. Returns True
+        if it is a half-open probe (pass it back to record()).
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN:
+                if self._retry_after(now) > 0:
+                    raise CircuitOpenError(self.name, self._retry_after(now))
+                self.state = HALF_OPEN
+                self.probes = 0
+            if self.state == HALF_OPEN:
+                if self.probes >= settings.CIRCUIT_HALF_OPEN_PROBES:
+                    raise CircuitOpenError(self.name, 1)
+                self.probes += 1
+                return True
+            return False
+
+    def check(self):
+        """Raises CircuitOpenError while open, without taking a probe slot."""
+        with self._lock:
+            if self.state == OPEN:
+                retry_after = self._retry_after(time.monotonic())
+                if retry_after > 0:
+                    raise CircuitOpenError(self.name, retry_after)
+
+    def record(self, succeeded, probe=False):
+        """
+        Records the result of an allowed call. `succeeded` is None for calls
+        that say nothing about the service (e.g. rejected as invalid).
+        """
+        now = time.monotonic()
+        with self._lock:
+            if probe and self.state == HALF_OPEN:
+                self.probes -= 1
+                if succeeded is False:
+                    self._open(now)
+                elif succeeded:
+                    print(f"Circuit breaker '{self.name}' closed")
+                    self.state = CLOSED
+                    self.calls.clear()
+                return
+            if succeeded is None or self.state != CLOSED:
+                return
+
+            self.calls.append((now, succeeded))
+            while self.calls and self.calls[0][0] < now - settings.CIRCUIT_WINDOW:
+                self.calls.popleft()
+            failures = sum(1 for _, ok in self.calls if not ok)
+            if len(self.calls) >= settings.CIRCUIT_MIN_CALLS and failures / len(self.calls) >= settings.CIRCUIT_FAILURE_RATE:
+                self._open(now)
+
+    def _open(self, now):
+        print(f"Circuit breaker '{self.name}' opened for {settings.CIRCUIT_OPEN_SECONDS}s")
+        self.state = OPEN
+        self.opened_at = now
+        self.calls.clear()
+
+    def status(self):
+        now = time.monotonic()
+        with self._lock:
+            calls = [ok for at, ok in self.calls if at >= now - settings.CIRCUIT_WINDOW]
+            retry_after = self._retry_after(now) if self.state == OPEN else None
+            return {
+                'name': self.name,
+                'state': HALF_OPEN if self.state == OPEN and not retry_after else self.state,
+                'calls': len(calls),
+                'failures': calls.count(False),
+                'retry_after': None if not retry_after else math.ceil(retry_after),
+            }
+
+
+_breakers = {}
+_lock = threading.Lock()
+
+
+def get(name):
+    with _lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def check(name):
+    get(name).check()
+
+
+@contextmanager
+def call(name):
+    """Sends the calls in a `with` block through breaker `name`; an exception counts as a failure."""
+    breaker = get(name)
+    probe = breaker.allow()
+    try:
+        yield
+    except Exception:
+        breaker.record(False, probe)
+        raise
+    breaker.record(True, probe)
+
+
+def protect(name, failed=lambda result: result is None):
+    """
+    Decorator that sends calls through breaker `name`. Exceptions count as
+    failures, and so do results for which `failed(result)` is true (the
+    Drive helpers return None when the call failed).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            breaker = get(name)
+            probe = breaker.allow()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                breaker.record(False, probe)
+                raise
+            breaker.record(not (failed and failed(result)), probe)
+            return result
+        return wrapper
+    return decorator
+
+
+def retry_after_headers(error):
+    """The Retry-After header for a 503 caused by `error`, if it says when to try again."""
+    retry_after = getattr(error, 'retry_after', None)
+    return {'Retry-After': str(math.ceil(retry_after))} if retry_after else None
+
+
+def status():
+    for name in SERVICES:
+        get(name)
+    with _lock:
+        breakers = list(_breakers.values())
+    return [breaker.status() for breaker in sorted(breakers, key=lambda b: b.name)]
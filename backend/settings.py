@@ -66,7 +66,9 @@ INSTALLED_APPS = [
     'topic_analysis',
     'quiz',
     'timetable',
-    'reports'
+    'reports',
+    'jobs',
+    'llm',
 ]
 
 
@@ -81,7 +83,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    
+    'llm.deadline.DeadlineMiddleware',
 ]
 
 
@@ -175,4 +177,186 @@ EMAIL_PORT =int(os.environ.get('EMAIL_PORT'))
 EMAIL_USE_TLS = True
 EMAIL_HOST_USER =os.environ.get('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')
-DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
\ No newline at end of file
+DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+
+
+# Background jobs
+# Jobs are stored in the database and run by `python manage.py run_worker`.
+
+JOB_WORKER_CONCURRENCY = int(os.environ.get('JOB_WORKER_CONCURRENCY', 4))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 2))      # seconds
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+JOB_RETRY_BACKOFF = float(os.environ.get('JOB_RETRY_BACKOFF', 30))     # seconds, doubled per attempt
+JOB_LOCK_TIMEOUT = int(os.environ.get('JOB_LOCK_TIMEOUT', 1800))       # seconds before a running job is considered stale
+
+
+# Local PDF cache shared by analysis and quiz generation (materials.utils.blob_cache)
+
+PDF_CACHE_DIR = os.environ.get('PDF_CACHE_DIR', str(BASE_DIR / 'var' / 'pdf_cache'))
+PDF_CACHE_MAX_BYTES = int(os.environ.get('PDF_CACHE_MAX_BYTES', 2 * 1024 ** 3))  # 2 GB
+PDF_CACHE_STAGED_MAX_AGE = int(os.environ.get('PDF_CACHE_STAGED_MAX_AGE', 6 * 3600))  # seconds before an unfinished upload's file is deleted
+
+
+# PDF text extraction (materials.utils.pdf_text)
+# Pages that come back empty or garbled from PDF_TEXT_BACKEND are retried with PDF_TEXT_FALLBACK_BACKEND.
+# Documents with at least PDF_PARALLEL_MIN_PAGES pages are split across a pool of worker processes.
+
+PDF_TEXT_BACKEND = os.environ.get('PDF_TEXT_BACKEND', 'pypdfium2')
+PDF_TEXT_FALLBACK_BACKEND = os.environ.get('PDF_TEXT_FALLBACK_BACKEND', 'pdfplumber')
+
+PDF_EXTRACTION_WORKERS = int(os.environ.get('PDF_EXTRACTION_WORKERS', min(4, os.cpu_count() or 1)))
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', 40))
+
+# Files of PDF_STREAM_THRESHOLD_BYTES or more are extracted page by page in the background job.
+# Streaming extraction aborts if the process grows beyond PDF_STREAM_MAX_RSS_MB (0 disables the check).
+PDF_STREAM_THRESHOLD_BYTES = int(os.environ.get('PDF_STREAM_THRESHOLD_BYTES', 50 * 1024 ** 2))  # 50 MB
+PDF_STREAM_MAX_RSS_MB = int(os.environ.get('PDF_STREAM_MAX_RSS_MB', 1024))
+
+
+# Resumable uploads to Google Drive (materials.utils.resumable_upload)
+# Chunks must be a multiple of 256 KiB; a failed chunk is retried from the last byte Drive acknowledged.
+
+DRIVE_UPLOAD_URL = os.environ.get('DRIVE_UPLOAD_URL', 'https://www.googleapis.com/upload/drive/v3/files')
+DRIVE_UPLOAD_CHUNK_SIZE = int(os.environ.get('DRIVE_UPLOAD_CHUNK_SIZE', 8 * 1024 ** 2))  # 8 MiB
+DRIVE_UPLOAD_MAX_RETRIES = int(os.environ.get('DRIVE_UPLOAD_MAX_RETRIES', 5))
+DRIVE_UPLOAD_TIMEOUT = int(os.environ.get('DRIVE_UPLOAD_TIMEOUT', 60))  # seconds per request
+
+# DRIVE_BACKEND = 'fake' keeps files on local disk under FAKE_DRIVE_DIR (materials.utils.fake_drive),
+# each call taking FAKE_DRIVE_LATENCY seconds; for local runs and benchmark_pipeline.
+DRIVE_BACKEND = os.environ.get('DRIVE_BACKEND', 'google')
+FAKE_DRIVE_DIR = os.environ.get('FAKE_DRIVE_DIR', str(BASE_DIR / 'var' / 'fake_drive'))
+FAKE_DRIVE_LATENCY = float(os.environ.get('FAKE_DRIVE_LATENCY', 0))  # seconds
+
+# Bulk uploads (materials.views.BulkUploadMaterialView)
+
+BULK_UPLOAD_MAX_FILES = int(os.environ.get('BULK_UPLOAD_MAX_FILES', 30))
+BULK_UPLOAD_CONCURRENCY = int(os.environ.get('BULK_UPLOAD_CONCURRENCY', 4))  # parallel Drive transfers
+
+
+# LLM gateway (llm.gateway) - every Gemini call goes through it
+# Requests are limited to LLM_MAX_CONCURRENCY in flight and to the account's quota
+# (LLM_REQUESTS_PER_MINUTE / LLM_TOKENS_PER_MINUTE). Interactive requests are served before background ones.
+
+GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
+GEMINI_MODEL = os.environ.get('GEMINI_MODEL', 'models/gemini-pro-latest')
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'gemini')  # 'fake' answers locally (llm.fake), for tests and load runs
+
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 4))
+LLM_REQUESTS_PER_MINUTE = int(os.environ.get('LLM_REQUESTS_PER_MINUTE', 60))
+LLM_TOKENS_PER_MINUTE = int(os.environ.get('LLM_TOKENS_PER_MINUTE', 1_000_000))
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 4))
+LLM_RETRY_BACKOFF = float(os.environ.get('LLM_RETRY_BACKOFF', 1))      # seconds, doubled per attempt
+LLM_RETRY_MAX_DELAY = float(os.environ.get('LLM_RETRY_MAX_DELAY', 30))  # seconds
+LLM_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT', 120))    # max wait for a slot before giving up
+
+# Deadline (llm.deadline) for the LLM calls of one HTTP request: queue wait, request timeouts
+# and retries all stop once it has passed. Background jobs are only limited by the route timeouts.
+LLM_REQUEST_DEADLINE = float(os.environ.get('LLM_REQUEST_DEADLINE', 120))  # seconds
+
+# Identical requests are answered from the llm_cachedresponse table for LLM_CACHE_TTL seconds.
+LLM_CACHE_ENABLED = os.environ.get('LLM_CACHE_ENABLED', 'True') == 'True'
+LLM_CACHE_TTL = int(os.environ.get('LLM_CACHE_TTL', 7 * 24 * 3600))                # seconds
+LLM_CACHE_MAX_BYTES = int(os.environ.get('LLM_CACHE_MAX_BYTES', 100 * 1024 ** 2))  # 100 MB
+
+# JSON answers (llm.json_stream): follow-up requests for items missing from a cut-off answer
+LLM_JSON_FOLLOW_UPS = int(os.environ.get('LLM_JSON_FOLLOW_UPS', 2))
+
+# Call statistics (llm.metrics): cost estimate in USD per million (input, output) tokens,
+# and the bearer token a scraper uses for api/llm/metrics/ (staff only when unset).
+LLM_TOKEN_PRICES = {
+    'models/gemini-pro-latest': (1.25, 10.0),
+    'models/gemini-flash-latest': (0.30, 2.50),
+    'models/gemini-flash-lite-latest': (0.10, 0.40),
+}
+LLM_METRICS_TOKEN = os.environ.get('LLM_METRICS_TOKEN', '')
+
+# Model per task (llm.routing). The fallback takes over while the primary's p95 latency over the
+# last LLM_ROUTE_WINDOW seconds is above latency_budget, or for LLM_ROUTE_COOLDOWN seconds after it
+# failed. timeout (seconds) limits each request. With hedge on, a request whose answer has not started
+# after the model's recent p95 is sent a second time and the first answer wins (idempotent tasks only).
+# Other tasks use GEMINI_MODEL.
+LLM_ROUTES = {
+    'analysis': {
+        'primary': os.environ.get('LLM_ANALYSIS_MODEL', 'models/gemini-pro-latest'),
+        'fallback': 'models/gemini-flash-latest',
+        'latency_budget': 90,
+        'timeout': 300,
+    },
+    'quiz': {
+        'primary': os.environ.get('LLM_QUIZ_MODEL', 'models/gemini-flash-latest'),
+        'fallback': 'models/gemini-flash-lite-latest',
+        'latency_budget': 15,
+        'timeout': 45,
+        'hedge': True,
+    },
+    'plan': {
+        'primary': os.environ.get('LLM_PLAN_MODEL', 'models/gemini-pro-latest'),
+        'fallback': 'models/gemini-flash-latest',
+        'latency_budget': 30,
+        'timeout': 90,
+        'hedge': True,
+    },
+    'plan-update': {
+        'primary': os.environ.get('LLM_PLAN_UPDATE_MODEL', 'models/gemini-flash-latest'),
+        'fallback': 'models/gemini-flash-lite-latest',
+        'latency_budget': 20,
+        'timeout': 60,
+        'hedge': True,
+    },
+}
+LLM_ROUTE_WINDOW = int(os.environ.get('LLM_ROUTE_WINDOW', 300))         # seconds
+LLM_ROUTE_MIN_SAMPLES = int(os.environ.get('LLM_ROUTE_MIN_SAMPLES', 5))  # calls needed before p95 counts
+LLM_ROUTE_COOLDOWN = int(os.environ.get('LLM_ROUTE_COOLDOWN', 60))      # seconds
+
+# Local fake LLM (LLM_BACKEND = 'fake'): answers after LLM_FAKE_LATENCY seconds (+/- the jitter)
+# plus one second per LLM_FAKE_TOKENS_PER_SECOND response tokens; a share LLM_FAKE_SLOW_RATE of the
+# calls takes LLM_FAKE_SLOW_LATENCY instead, to try deadlines and hedging. The answers are valid
+# topics, questions and plan days derived from the prompt, with about LLM_FAKE_ITEM_TOKENS tokens
+# of text per item. LLM_FAKE_SEED makes the latencies repeatable.
+LLM_FAKE_LATENCY = float(os.environ.get('LLM_FAKE_LATENCY', 0.5))            # seconds
+LLM_FAKE_LATENCY_JITTER = float(os.environ.get('LLM_FAKE_LATENCY_JITTER', 0.2))
+LLM_FAKE_SLOW_RATE = float(os.environ.get('LLM_FAKE_SLOW_RATE', 0))          # 0-1
+LLM_FAKE_SLOW_LATENCY = float(os.environ.get('LLM_FAKE_SLOW_LATENCY', 30))   # seconds
+LLM_FAKE_TOKENS_PER_SECOND = float(os.environ.get('LLM_FAKE_TOKENS_PER_SECOND', 0))  # 0: no per-token time
+LLM_FAKE_ITEM_TOKENS = int(os.environ.get('LLM_FAKE_ITEM_TOKENS', 40))
+LLM_FAKE_TOPICS = int(os.environ.get('LLM_FAKE_TOPICS', 6))                  # topics per analyzed text
+LLM_FAKE_SEED = int(os.environ.get('LLM_FAKE_SEED', 0))
+
+
+# Circuit breakers (backend.circuit_breaker) for Gemini and Google Drive. A breaker opens when
+# CIRCUIT_FAILURE_RATE of at least CIRCUIT_MIN_CALLS calls in the last CIRCUIT_WINDOW seconds failed;
+# requests then get 503 + Retry-After for CIRCUIT_OPEN_SECONDS, after which CIRCUIT_HALF_OPEN_PROBES
+# trial calls decide whether it closes again.
+CIRCUIT_WINDOW = int(os.environ.get('CIRCUIT_WINDOW', 60))                 # seconds
+CIRCUIT_MIN_CALLS = int(os.environ.get('CIRCUIT_MIN_CALLS', 5))
+CIRCUIT_FAILURE_RATE = float(os.environ.get('CIRCUIT_FAILURE_RATE', 0.5))  # 0-1
+CIRCUIT_OPEN_SECONDS = int(os.environ.get('CIRCUIT_OPEN_SECONDS', 30))
+CIRCUIT_HALF_OPEN_PROBES = int(os.environ.get('CIRCUIT_HALF_OPEN_PROBES', 1))
+
+
+# Topic analysis (topic_analysis.analysis_service)
+# Texts longer than ANALYSIS_CHUNK_TOKENS are split along page/heading boundaries,
+# analyzed ANALYSIS_PARALLEL_CHUNKS at a time and the topics merged.
+
+ANALYSIS_CHUNK_TOKENS = int(os.environ.get('ANALYSIS_CHUNK_TOKENS', 30000))
+ANALYSIS_PARALLEL_CHUNKS = int(os.environ.get('ANALYSIS_PARALLEL_CHUNKS', 4))
+
+
+# Quiz generation (quiz.views): context taken from the topic's pages plus a margin
+
+QUIZ_CONTEXT_MARGIN_PAGES = int(os.environ.get('QUIZ_CONTEXT_MARGIN_PAGES', 1))
+QUIZ_CONTEXT_MAX_CHARS = int(os.environ.get('QUIZ_CONTEXT_MAX_CHARS', 12000))
+QUIZ_CONTEXT_PASSAGES = int(os.environ.get('QUIZ_CONTEXT_PASSAGES', 12))  # for topics without a page span
+
+
+# Retrieval index (materials.utils.retrieval): BM25 over passages of about RETRIEVAL_PASSAGE_CHARS
+
+RETRIEVAL_INDEX_DIR = os.environ.get('RETRIEVAL_INDEX_DIR', str(BASE_DIR / 'var' / 'retrieval'))
+RETRIEVAL_PASSAGE_CHARS = int(os.environ.get('RETRIEVAL_PASSAGE_CHARS', 1000))
+
+
+# Search across materials (materials.utils.vector_index): hashed TF-IDF vectors per passage
+
+SEARCH_VECTOR_DIM = int(os.environ.get('SEARCH_VECTOR_DIM', 1024))       # hashed features per passage
+SEARCH_MAX_RESULTS = int(os.environ.get('SEARCH_MAX_RESULTS', 50))
+SEARCH_SNIPPET_CHARS = int(os.environ.get('SEARCH_SNIPPET_CHARS', 300))
@@ -0,0 +1,136 @@
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from materials.models import Material
+from materials.tests import FakeBackendsMixin
+from topic_analysis.models import Topic
+
+from . import circuit_breaker
+from .circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitOpenError
+
+
+class Clock:
+    """Stands in for time.monotonic() in the breaker module."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@override_settings(CIRCUIT_WINDOW=60, CIRCUIT_MIN_CALLS=4, CIRCUIT_FAILURE_RATE=0.5,
+                   CIRCUIT_OPEN_SECONDS=30, CIRCUIT_HALF_OPEN_PROBES=1)
+class CircuitBreakerTests(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch('backend.circuit_breaker.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = circuit_breaker.CircuitBreaker('drive')
+
+    def trip(self):
+        for succeeded in (True, False, True, False):
+            self.breaker.record(succeeded)
+
+    def test_closed_open_half_open_closed(self):
+        self.breaker.record(False)
+        self.breaker.record(False)
+        self.assertEqual(self.breaker.state, CLOSED)  # too few calls to judge
+
+        self.breaker.record(True)
+        self.breaker.record(False)
+        self.assertEqual(self.breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError) as raised:
+            self.breaker.allow()
+        self.assertEqual(raised.exception.wait, 30)
+
+        self.clock.now += 30
+        self.assertEqual(self.breaker.status()['state'], HALF_OPEN)
+        probe = self.breaker.allow()
+        self.assertTrue(probe)
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.allow()  # only one probe at a time
+
+        self.breaker.record(True, probe)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertFalse(self.breaker.allow())
+
+    def test_a_failed_probe_opens_it_again(self):
+        self.trip()
+        self.clock.now += 31
+        probe = self.breaker.allow()
+        self.breaker.record(False, probe)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.status()['retry_after'], 30)
+
+    def test_old_and_neutral_calls_do_not_count(self):
+        self.breaker.record(False)
+        self.breaker.record(False)
+        self.clock.now += 61
+        self.breaker.record(None)  # e.g. a rejected request: says nothing about the service
+        self.breaker.record(False)
+        self.breaker.record(True)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual(self.breaker.status()['calls'], 2)
+
+    def test_protect_counts_none_results_and_exceptions_as_failures(self):
+        circuit_breaker._breakers.clear()
+        self.addCleanup(circuit_breaker._breakers.clear)
+        results = iter([None, ConnectionError("down"), 'ok', None])
+
+        @circuit_breaker.protect('drive')
+        def upload():
+            result = next(results)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        upload()
+        with self.assertRaises(ConnectionError):
+            upload()
+        upload()
+        upload()
+        with self.assertRaises(CircuitOpenError):
+            upload()
+        self.assertEqual(circuit_breaker.get('drive').state, OPEN)
+
+
+@override_settings(CIRCUIT_MIN_CALLS=1, CIRCUIT_FAILURE_RATE=0.5, CIRCUIT_OPEN_SECONDS=30)
+class RetryAfterTests(FakeBackendsMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.login()
+
+    def open(self, name):
+        for _ in range(3):
+            circuit_breaker.get(name).record(False)
+        self.assertEqual(circuit_breaker.get(name).state, OPEN)
+
+    def assertRetryAfter(self, response):
+        self.assertEqual(response.status_code, 503, getattr(response, 'data', None))
+        self.assertTrue(0 < int(response['Retry-After']) <= 30)
+
+    def test_upload_while_drive_is_down(self):
+        self.open('drive')
+        self.assertRetryAfter(self.upload())
+        self.assertFalse(Material.objects.exists())
+
+    def test_delete_while_drive_is_down(self):
+        material_id = self.upload().data['material_id']
+        self.open('drive')
+        self.assertRetryAfter(self.client.delete(f'/api/upload/delete/{material_id}/'))
+        self.assertTrue(Material.objects.filter(id=material_id).exists())
+
+    def test_quiz_while_gemini_is_down(self):
+        material = Material.objects.get(id=self.upload().data['material_id'])
+        topic = Topic.objects.create(
+            material=material, topic_name='Sorting', difficulty_score=5, difficulty_class='medium',
+            summary='About sorting.', sequence_number=1, start_page=1, end_page=1,
+        )
+        self.open('gemini')
+        self.assertRetryAfter(self.client.post(f'/api/quiz/generate/{topic.id}/'))
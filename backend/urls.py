@@ -39,6 +39,7 @@ urlpatterns = [
     
     # 2. Your other custom admin pages MUST come second
     path('admin/user-graph/', admin_views.user_graph_view, name='user_graph'),
+    path('admin/llm-usage/', admin_views.llm_usage_view, name='llm_usage'),
     
     # 3. The default admin site (which includes the 404 catch-all) MUST come last
     path('admin/', admin.site.urls), 
@@ -50,4 +51,6 @@ urlpatterns = [
     path('api/timetable/', include('timetable.urls')),
     path('api/quiz/', include('quiz.urls')),
     path('api/reports/', include('reports.urls')),
+    path('api/jobs/', include('jobs.urls')),
+    path('api/llm/', include('llm.urls')),
 ]
\ No newline at end of file
@@ -0,0 +1,15 @@
+from django.contrib import admin
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """
+    Configures the admin interface for the background job queue.
+    """
+    list_display = ('id', 'kind', 'status', 'stage', 'attempts', 'max_attempts', 'run_after', 'created_at')
+    list_filter = ('status', 'kind')
+    search_fields = ('kind', 'last_error')
+    ordering = ('-created_at',)
+    list_per_page = 25
+    readonly_fields = ('locked_by', 'locked_at', 'created_at', 'updated_at', 'finished_at')
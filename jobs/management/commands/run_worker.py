@@ -0,0 +1,93 @@
+import os
+import signal
+import socket
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connection
+
+from jobs.queue import claim_next, requeue_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = "Runs background jobs from the database queue with a pool of worker threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=settings.JOB_WORKER_CONCURRENCY,
+            help="Number of jobs processed in parallel.",
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=settings.JOB_POLL_INTERVAL,
+            help="Seconds to wait before polling an empty queue again.",
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help="Exit once the queue is empty instead of polling forever.",
+        )
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options['concurrency'])
+        poll_interval = options['poll_interval']
+        once = options['once']
+        stop = threading.Event()
+
+        def shutdown(signum, frame):
+            self.stdout.write("Shutting down after the current jobs finish...")
+            stop.set()
+
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+
+        requeued, failed = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s).")
+        if failed:
+            self.stdout.write(f"Failed {failed} stale job(s) with no attempts left.")
+
+        host = f"{socket.gethostname()}:{os.getpid()}"
+        threads = [
+            threading.Thread(
+                target=self.work,
+                args=(f"{host}:{n}", stop, poll_interval, once),
+                daemon=True,
+            )
+            for n in range(concurrency)
+        ]
+        self.stdout.write(f"Starting {concurrency} worker thread(s).")
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=1)
+
+    def work(self, worker_id, stop, poll_interval, once):
+        try:
+            while not stop.is_set():
+                close_old_connections()
+                try:
+                    job = claim_next(worker_id)
+                except DatabaseError as e:
+                    # Keep the thread alive through transient database errors.
+                    self.stderr.write(f"[{worker_id}] Could not claim a job: {e}")
+                    stop.wait(poll_interval)
+                    continue
+                if job is None:
+                    if once:
+                        break
+                    stop.wait(poll_interval)
+                    continue
+
+                self.stdout.write(f"[{worker_id}] Running job {job.id} ({job.kind}).")
+                succeeded = run_job(job)
+                self.stdout.write(
+                    f"[{worker_id}] Job {job.id} {'succeeded' if succeeded else 'failed'}."
+                )
+        finally:
+            connection.close()
@@ -0,0 +1,155 @@
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+# kind -> callable(job)
+_handlers = {}
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying the job cannot succeed."""
+
+
+def register(kind):
+    """
+    Decorator that registers a handler for a job kind.
+
+    Handlers receive the `Job` instance and should raise on failure; any
+    exception other than `PermanentJobError` is retried with backoff.
+    """
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, payload=None, user=None, max_attempts=None):
+    """
+    Stores a new job and returns it. The job runs once a worker claims it.
+    """
+    if kind not in _handlers:
+        raise ValueError(f"No job handler registered for '{kind}'.")
+
+    return Job.objects.create(
+        kind=kind,
+        payload=payload or {},
+        created_by=user if user is not None and user.is_authenticated else None,
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+    )
+
+
+def enqueue_many(kind, payloads, user=None, max_attempts=None):
+    """
+    Stores one job per payload with a single INSERT and returns them in order.
+    """
+    if kind not in _handlers:
+        raise ValueError(f"No job handler registered for '{kind}'.")
+
+    created_by = user if user is not None and user.is_authenticated else None
+    return Job.objects.bulk_create([
+        Job(
+            kind=kind,
+            payload=payload or {},
+            created_by=created_by,
+            max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+        )
+        for payload in payloads
+    ])
+
+
+def claim_next(worker_id):
+    """
+    Atomically claims the oldest runnable job for this worker.
+    Returns None when the queue is empty.
+    """
+    with transaction.atomic():
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.STATUS_QUEUED, run_after__lte=timezone.now())
+            .order_by('run_after', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+
+        job.status = Job.STATUS_RUNNING
+        job.attempts += 1
+        job.locked_by = worker_id
+        job.locked_at = timezone.now()
+        job.save(update_fields=['status', 'attempts', 'locked_by', 'locked_at', 'updated_at'])
+    return job
+
+
+def requeue_stale_jobs():
+    """
+    Puts back jobs whose worker died mid-run (lock older than JOB_LOCK_TIMEOUT).
+    Jobs that already used up their attempts are failed instead, so a job
+    that keeps killing its worker (e.g. out of memory) is not run forever.
+    Returns (number of jobs requeued, number failed).
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.STATUS_RUNNING,
+        locked_at__lt=now - timedelta(seconds=settings.JOB_LOCK_TIMEOUT)
+    )
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.STATUS_FAILED,
+        locked_by='',
+        locked_at=None,
+        finished_at=now,
+        last_error="The worker stopped while running the job's last attempt (lock timed out).",
+    )
+    requeued = stale.filter(attempts__lt=F('max_attempts')).update(
+        status=Job.STATUS_QUEUED, locked_by='', locked_at=None, run_after=now
+    )
+    return requeued, failed
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter: base, 2*base, 4*base, ... (+/- 20%)."""
+    delay = settings.JOB_RETRY_BACKOFF * (2 ** max(attempts - 1, 0))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def run_job(job):
+    """
+    Runs a claimed job and records the outcome. Failed attempts are
+    rescheduled until `max_attempts` is reached.
+    """
+    handler = _handlers.get(job.kind)
+    try:
+        if handler is None:
+            raise PermanentJobError(f"No job handler registered for '{job.kind}'.")
+        handler(job)
+    except Exception as e:
+        error = f"[stage: {job.stage or 'n/a'}] {e}\n{traceback.format_exc()}"
+        retryable = not isinstance(e, PermanentJobError)
+
+        if retryable and job.attempts < job.max_attempts:
+            job.status = Job.STATUS_QUEUED
+            job.run_after = timezone.now() + timedelta(seconds=retry_delay(job.attempts))
+            print(f"Job {job.id} failed at stage '{job.stage}', retrying (attempt {job.attempts}/{job.max_attempts}): {e}")
+        else:
+            job.status = Job.STATUS_FAILED
+            job.finished_at = timezone.now()
+            print(f"Job {job.id} failed permanently at stage '{job.stage}': {e}")
+
+        job.last_error = error
+        job.locked_by = ''
+        job.locked_at = None
+        job.save()
+        return False
+
+    job.status = Job.STATUS_SUCCEEDED
+    job.finished_at = timezone.now()
+    job.locked_by = ''
+    job.locked_at = None
+    job.save()
+    return True
@@ -0,0 +1,135 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from materials.tests import FakeBackendsMixin
+from materials.utils.synthetic_pdf import make_pdf
+from quiz.models import QuizQuestion
+from timetable.models import StudyPlan
+from topic_analysis.models import Topic
+
+from . import queue
+from .models import Job
+from .queue import PermanentJobError, claim_next, requeue_stale_jobs, run_job
+
+
+def _fail(job):
+    raise RuntimeError("boom")
+
+
+def _fail_permanently(job):
+    raise PermanentJobError("bad input")
+
+
+@override_settings(JOB_RETRY_BACKOFF=10, JOB_LOCK_TIMEOUT=60)
+class QueueTests(TestCase):
+
+    def setUp(self):
+        handlers = {'ok': lambda job: None, 'fail': _fail, 'permanent': _fail_permanently}
+        patcher = mock.patch.dict(queue._handlers, handlers)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_claim_next_takes_the_oldest_runnable_job(self):
+        later = Job.objects.create(kind='ok', run_after=timezone.now() + timedelta(hours=1))
+        first = Job.objects.create(kind='ok')
+        second = Job.objects.create(kind='ok')
+
+        job = claim_next('worker-1')
+        self.assertEqual(job.id, first.id)
+        self.assertEqual((job.status, job.attempts, job.locked_by), (Job.STATUS_RUNNING, 1, 'worker-1'))
+        self.assertEqual(claim_next('worker-2').id, second.id)
+        self.assertIsNone(claim_next('worker-3'))  # `later` is not due yet
+        later.refresh_from_db()
+        self.assertEqual(later.status, Job.STATUS_QUEUED)
+
+    def test_run_job_records_success(self):
+        Job.objects.create(kind='ok')
+        job = claim_next('worker')
+        self.assertTrue(run_job(job))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_SUCCEEDED)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(job.locked_by, '')
+
+    def test_failed_attempts_are_retried_with_backoff(self):
+        Job.objects.create(kind='fail', max_attempts=2)
+        job = claim_next('worker')
+        before = timezone.now()
+        self.assertFalse(run_job(job))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_QUEUED)
+        self.assertIn("boom", job.last_error)
+        # First retry after JOB_RETRY_BACKOFF seconds, +/- 20% jitter
+        delay = (job.run_after - before).total_seconds()
+        self.assertTrue(7.9 <= delay <= 12.1, delay)
+
+        Job.objects.filter(id=job.id).update(run_after=timezone.now())
+        job = claim_next('worker')
+        self.assertEqual(job.attempts, 2)
+        self.assertFalse(run_job(job))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_FAILED)  # no attempts left
+
+    def test_retry_delay_doubles_per_attempt(self):
+        with mock.patch('jobs.queue.random.uniform', return_value=1.0):
+            self.assertEqual([queue.retry_delay(n) for n in (1, 2, 3)], [10, 20, 40])
+
+    def test_permanent_errors_are_not_retried(self):
+        Job.objects.create(kind='permanent', max_attempts=3)
+        job = claim_next('worker')
+        self.assertFalse(run_job(job))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_FAILED, 1))
+
+    def test_stale_jobs_are_requeued_or_failed(self):
+        stale = timezone.now() - timedelta(seconds=120)
+        retry = Job.objects.create(kind='ok', status=Job.STATUS_RUNNING, attempts=1, max_attempts=3, locked_by='dead', locked_at=stale)
+        exhausted = Job.objects.create(kind='ok', status=Job.STATUS_RUNNING, attempts=3, max_attempts=3, locked_by='dead', locked_at=stale)
+        running = Job.objects.create(kind='ok', status=Job.STATUS_RUNNING, attempts=1, locked_by='alive', locked_at=timezone.now())
+
+        self.assertEqual(requeue_stale_jobs(), (1, 1))
+        for job in (retry, exhausted, running):
+            job.refresh_from_db()
+        self.assertEqual((retry.status, retry.locked_by), (Job.STATUS_QUEUED, ''))
+        self.assertEqual(exhausted.status, Job.STATUS_FAILED)
+        self.assertIsNotNone(exhausted.finished_at)
+        self.assertEqual((running.status, running.locked_by), (Job.STATUS_RUNNING, 'alive'))
+
+
+class PipelineTests(FakeBackendsMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.login()
+
+    def test_upload_analysis_quiz_and_plan(self):
+        pdf = SimpleUploadedFile('notes.pdf', make_pdf(6, seed=1), 'application/pdf')
+        response = self.client.post('/api/upload/', {'file': pdf, 'subject': 'Algorithms'}, format='multipart')
+        self.assertEqual(response.status_code, 202, response.data)
+        material_id = response.data['material_id']
+
+        job = claim_next('test')
+        self.assertEqual(job.id, response.data['job_id'])
+        self.assertTrue(run_job(job), job.last_error)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_SUCCEEDED)
+        topic = Topic.objects.filter(material_id=material_id).order_by('sequence_number').first()
+        self.assertIsNotNone(topic)
+
+        response = self.client.post(f'/api/quiz/generate/{topic.id}/')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(QuizQuestion.objects.filter(topic=topic).count(), response.data['questions_created'])
+
+        response = self.client.post(
+            '/api/timetable/generate-plan/',
+            {'material_ids': [material_id], 'totalDays': 3, 'hoursPerDay': 2},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual([day['day'] for day in response.data['study_plan']], [1, 2, 3])
+        plan = StudyPlan.objects.get(request__user=self.user)
+        self.assertEqual(set(plan.time_slot_tasks.values_list('day', flat=True)), {1, 2, 3})
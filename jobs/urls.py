@@ -0,0 +1,7 @@
+# jobs/urls.py
+from django.urls import path
+from .views import JobStatusView
+
+urlpatterns = [
+    path('<int:job_id>/', JobStatusView.as_view(), name='job-status'),
+]
@@ -0,0 +1,34 @@
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.permissions import IsAuthenticated
+from rest_framework import status
+
+from .models import Job
+
+
+class JobStatusView(APIView):
+    """
+    Returns the current state of a background job started by the user.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id, *args, **kwargs):
+        try:
+            job = Job.objects.get(id=job_id)
+        except Job.DoesNotExist:
+            return Response({'error': 'Job not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        if job.created_by_id != request.user.id and not request.user.is_staff:
+            return Response({'error': 'Job not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            'id': job.id,
+            'kind': job.kind,
+            'status': job.status,
+            'stage': job.stage,
+            'attempts': job.attempts,
+            'max_attempts': job.max_attempts,
+            'last_error': job.last_error.splitlines()[0] if job.last_error else None,
+            'created_at': job.created_at,
+            'finished_at': job.finished_at,
+        }, status=status.HTTP_200_OK)
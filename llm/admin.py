@@ -0,0 +1,15 @@
+from django.contrib import admin
+from .models import CachedResponse
+
+
+@admin.register(CachedResponse)
+class CachedResponseAdmin(admin.ModelAdmin):
+    """
+    Configures the admin interface for cached LLM responses.
+    """
+    list_display = ('key', 'model', 'size_bytes', 'hits', 'created_at', 'last_used_at', 'expires_at')
+    list_filter = ('model',)
+    search_fields = ('key', 'response')
+    ordering = ('-last_used_at',)
+    list_per_page = 25
+    readonly_fields = ('key', 'model', 'size_bytes', 'hits', 'created_at', 'last_used_at')
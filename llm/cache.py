@@ -0,0 +1,119 @@
+"""
+Database cache of LLM responses.
+
+Responses are keyed by the SHA-256 of the model name, the prompt with its
+whitespace normalized, and the generation config, so the same request is
+answered from the database instead of Gemini. Entries expire after
+LLM_CACHE_TTL seconds, and the table is kept under LLM_CACHE_MAX_BYTES by
+deleting the least recently used entries.
+"""
+import hashlib
+import json
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import CachedResponse
+
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'bytes_saved': 0}
+
+
+def _count(key, amount=1):
+    with _lock:
+        _stats[key] += amount
+
+
+def normalize_prompt(prompt):
+    """Collapses whitespace, so re-indenting a prompt template keeps its entries."""
+    return " ".join(prompt.split())
+
+
+def make_key(model, prompt, generation_config=None):
+    payload = json.dumps(
+        {'model': model, 'prompt': normalize_prompt(prompt), 'config': generation_config or {}},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def get(key):
+    """Returns the cached response text, or None on a miss."""
+    now = timezone.now()
+    entry = CachedResponse.objects.filter(key=key, expires_at__gt=now).only('id', 'response', 'size_bytes').first()
+    if entry is None:
+        _count('misses')
+        return None
+
+    CachedResponse.objects.filter(id=entry.id).update(hits=F('hits') + 1, last_used_at=now)
+    _count('hits')
+    _count('bytes_saved', entry.size_bytes)
+    return entry.response
+
+
+def put(key, model, response, ttl=None):
+    """Stores a response, then evicts entries if the cache is over its size cap."""
+    now = timezone.now()
+    ttl = settings.LLM_CACHE_TTL if ttl is None else ttl
+    CachedResponse.objects.update_or_create(
+        key=key,
+        defaults={
+            'model': model,
+            'response': response,
+            'size_bytes': len(response.encode('utf-8')),
+            'last_used_at': now,
+            'expires_at': now + timedelta(seconds=ttl),
+        },
+    )
+    _count('stores')
+    _evict()
+
+
+def forget(key):
+    """Drops an entry, e.g. when the cached response turned out to be unusable."""
+    CachedResponse.objects.filter(key=key).delete()
+
+
+def _evict():
+    expired, _ = CachedResponse.objects.filter(expires_at__lte=timezone.now()).delete()
+    evicted = expired
+
+    total = CachedResponse.objects.aggregate(total=Sum('size_bytes'))['total'] or 0
+    if total > settings.LLM_CACHE_MAX_BYTES:
+        doomed = []
+        for entry_id, size in CachedResponse.objects.order_by('last_used_at').values_list('id', 'size_bytes').iterator():
+            if total <= settings.LLM_CACHE_MAX_BYTES:
+                break
+            doomed.append(entry_id)
+            total -= size
+        evicted += CachedResponse.objects.filter(id__in=doomed).delete()[0]
+
+    if evicted:
+        _count('evictions', evicted)
+
+
+def stats():
+    """
+    Returns the in-process hit/miss counters and the size of the cache.
+    `lifetime_hits`/`lifetime_bytes_saved` cover every process, from the table.
+    """
+    with _lock:
+        data = dict(_stats)
+    lookups = data['hits'] + data['misses']
+    data['hit_ratio'] = round(data['hits'] / lookups, 3) if lookups else 0.0
+
+    totals = CachedResponse.objects.aggregate(
+        bytes=Sum('size_bytes'),
+        lifetime_hits=Sum('hits'),
+        lifetime_bytes_saved=Sum(F('hits') * F('size_bytes')),
+    )
+    data['entries'] = CachedResponse.objects.count()
+    data['bytes'] = totals['bytes'] or 0
+    data['max_bytes'] = settings.LLM_CACHE_MAX_BYTES
+    data['lifetime_hits'] = totals['lifetime_hits'] or 0
+    data['lifetime_bytes_saved'] = totals['lifetime_bytes_saved'] or 0
+    return data
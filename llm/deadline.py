@@ -0,0 +1,59 @@
+"""
+How long LLM calls may still take.
+
+A deadline is kept in a context variable, so it follows the request from
+the view into the gateway without being passed around:
+
+    with deadline(30):
+        generate(prompt, task='quiz')   # gives up once the 30 s are used
+
+Nested deadlines can only shorten the outer one. DeadlineMiddleware gives
+every HTTP request LLM_REQUEST_DEADLINE seconds; the gateway limits its
+queue wait, request timeouts and retries to what is left.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+_deadline = contextvars.ContextVar('llm_deadline', default=None)
+
+
+@contextmanager
+def deadline(seconds):
+    if seconds is None:
+        yield
+        return
+    end = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(end if current is None else min(current, end))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left before the current deadline, or None if there is none."""
+    end = _deadline.get()
+    return None if end is None else end - time.monotonic()
+
+
+def limit(seconds):
+    """`seconds` (None for no limit) cut down to the time remaining."""
+    left = remaining()
+    if left is None:
+        return seconds
+    return left if seconds is None else min(seconds, left)
+
+
+class DeadlineMiddleware:
+    """Limits the LLM calls of each request to LLM_REQUEST_DEADLINE seconds."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with deadline(settings.LLM_REQUEST_DEADLINE):
+            return self.get_response(request)
@@ -0,0 +1,218 @@
+"""
+A local stand-in for Gemini (LLM_BACKEND = 'fake'), for trying deadlines,
+hedging and fallbacks and for benchmarks, without the API.
+
+It answers after LLM_FAKE_LATENCY seconds (+/- LLM_FAKE_LATENCY_JITTER),
+plus the time to produce the response at LLM_FAKE_TOKENS_PER_SECOND; a
+share LLM_FAKE_SLOW_RATE of the calls takes LLM_FAKE_SLOW_LATENCY
+instead. Like the real client it gives up with DeadlineExceeded when the
+request's timeout is shorter than that.
+
+The answer comes from `responder(model, prompt)`. The default, answer(),
+recognizes this project's prompts and returns valid topics, quiz
+questions or study plan days made up from the prompt: the same prompt
+always gets the same answer. Tests can replace it:
+
+    fake.responder = lambda model, prompt: '[{"day": 1, ...}]'
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+from django.conf import settings
+from google.api_core import exceptions as google_exceptions
+
+CHUNK_CHARS = 200  # characters per streamed chunk
+CHARS_PER_TOKEN = 4
+WORDS_PER_TOKEN = 0.75
+
+# Used when the prompt has too few words of its own.
+WORDS = (
+    "algorithm array cache compiler complexity data function graph hash heap index "
+    "kernel latency matrix memory network pointer process query queue recursion "
+    "search stack thread transaction tree vector"
+).split()
+
+_models = {}
+_lock = threading.Lock()
+_rng = None
+
+
+def _latency_rng():
+    global _rng
+    with _lock:
+        if _rng is None:
+            _rng = random.Random(settings.LLM_FAKE_SEED)
+        return _rng
+
+
+def latency():
+    rng = _latency_rng()
+    if settings.LLM_FAKE_SLOW_RATE and rng.random() < settings.LLM_FAKE_SLOW_RATE:
+        return settings.LLM_FAKE_SLOW_LATENCY
+    jitter = settings.LLM_FAKE_LATENCY_JITTER
+    return max(0.0, settings.LLM_FAKE_LATENCY + rng.uniform(-jitter, jitter))
+
+
+def _tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _vocabulary(text):
+    words = sorted(set(re.findall(r'[a-z]{4,}', text.lower())))
+    return words if len(words) >= 10 else WORDS
+
+
+def _filler(rng, words):
+    count = max(3, int(settings.LLM_FAKE_ITEM_TOKENS * WORDS_PER_TOKEN))
+    return ' '.join(rng.choice(words) for _ in range(count)).capitalize() + '.'
+
+
+def _topics(rng, prompt):
+    match = re.search(r'\n\s*---\n(.*)\n\s*---', prompt, re.DOTALL)
+    text = match.group(1) if match else prompt
+    words = _vocabulary(text)
+    pages = [int(n) for n in re.findall(r'\[Page (\d+)\]', text)] or [1]
+    count = max(1, min(settings.LLM_FAKE_TOPICS, len(pages)))
+    per_topic = len(pages) / count
+
+    topics, names = [], set()
+    for i in range(count):
+        name = f"{rng.choice(words).title()} {rng.choice(words).title()}"
+        if name in names:
+            name = f"{name} {i + 1}"
+        names.add(name)
+        score = round(rng.uniform(1, 10), 2)
+        topics.append({
+            'topic_name': name,
+            'difficulty_score': score,
+            'difficulty_class': 'easy' if score < 4 else 'medium' if score < 7 else 'hard',
+            'summary': _filler(rng, words),
+            'sequence_number': i + 1,
+            'start_page': pages[int(i * per_topic)],
+            'end_page': pages[int((i + 1) * per_topic) - 1],
+        })
+    return topics
+
+
+def _questions(rng, prompt):
+    wanted = re.findall(r'Return ONLY (\d+)', prompt) or re.findall(r'Generate (\d+) multiple choice', prompt)
+    count = int(wanted[-1]) if wanted else 5
+    match = re.search(r'topic "([^"]+)"', prompt)
+    topic = match.group(1) if match else 'the material'
+    words = _vocabulary(prompt)
+    return [
+        {
+            'question_text': f"Question {i + 1} on {topic}: {_filler(rng, words)}",
+            'option_a': rng.choice(words),
+            'option_b': rng.choice(words),
+            'option_c': rng.choice(words),
+            'option_d': rng.choice(words),
+            'correct_option': rng.choice('ABCD'),
+        }
+        for i in range(count)
+    ]
+
+
+def _plan_days(rng, prompt):
+    missing = re.search(r'Return ONLY the plan for day\(s\) ([\d, ]+)', prompt)
+    if missing:
+        days = [int(n) for n in re.findall(r'\d+', missing.group(1))]
+    else:
+        match = re.search(r'(\d+)-day study plan', prompt)
+        days = list(range(1, int(match.group(1)) + 1 if match else 8))
+    match = re.search(r'(\d+(?:\.\d+)?) hours? (?:of study )?per day', prompt)
+    hours = float(match.group(1)) if match else 2.0
+
+    slots, subject = [], 'General'
+    for line in prompt.splitlines():
+        line = line.strip()
+        if line.startswith('Subject:'):
+            subject = line[len('Subject:'):].strip() or subject
+        elif line.startswith('- ') and '(Difficulty:' in line:
+            slots.append((subject, line[2:line.index('(Difficulty:')].strip()))
+    slots = slots or [(subject, 'Revision')]
+
+    words = _vocabulary(prompt)
+    per_day = 2 if hours >= 2 else 1
+    plan, next_slot = [], 0
+    for day in days:
+        tasks = []
+        for _ in range(per_day):
+            subject, topic = slots[next_slot % len(slots)]
+            next_slot += 1
+            tasks.append({
+                'duration': f"{hours / per_day:g} hours",
+                'subject': subject,
+                'topics': topic,
+                'notes': _filler(rng, words),
+            })
+        plan.append({'day': day, 'tasks': tasks})
+    return plan
+
+
+def answer(model, prompt):
+    """A valid answer to one of this project's JSON prompts, made up from the prompt alone."""
+    rng = random.Random(hashlib.sha256(prompt.encode()).digest())
+    if '"question_text"' in prompt:
+        return json.dumps(_questions(rng, prompt))
+    if '"study_plan"' in prompt:
+        return json.dumps({'study_plan': _plan_days(rng, prompt)})
+    if '"topic_name"' in prompt:
+        return json.dumps(_topics(rng, prompt))
+    return '[]'
+
+
+responder = answer
+
+
+class FakeResponse:
+    def __init__(self, prompt, text, delays):
+        self.text = text
+        self._chunks = [text[i:i + CHUNK_CHARS] for i in range(0, len(text), CHUNK_CHARS)] or ['']
+        self._delays = delays
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=_tokens(prompt),
+            candidates_token_count=_tokens(text),
+            total_token_count=_tokens(prompt) + _tokens(text),
+        )
+
+    def __iter__(self):
+        for chunk, delay in zip(self._chunks, self._delays):
+            time.sleep(delay)
+            yield SimpleNamespace(text=chunk)
+
+
+class FakeModel:
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def generate_content(self, prompt, generation_config=None, stream=False, request_options=None):
+        text = responder(self.model_name, prompt)
+        seconds = latency()
+        if settings.LLM_FAKE_TOKENS_PER_SECOND:
+            seconds += _tokens(text) / settings.LLM_FAKE_TOKENS_PER_SECOND
+        timeout = (request_options or {}).get('timeout')
+        if timeout is not None and seconds > timeout:
+            time.sleep(timeout)
+            raise google_exceptions.DeadlineExceeded(f"{self.model_name} (fake) did not answer within {timeout:.1f}s")
+
+        if not stream:
+            time.sleep(seconds)
+            return FakeResponse(prompt, text, [0.0])
+        # Half of the time passes before the first chunk, the rest is spread over the others.
+        chunks = max(1, -(-len(text) // CHUNK_CHARS))
+        first = seconds / 2 if chunks > 1 else seconds
+        rest = (seconds - first) / (chunks - 1) if chunks > 1 else 0.0
+        return FakeResponse(prompt, text, [first] + [rest] * (chunks - 1))
+
+
+def get_model(name):
+    with _lock:
+        if name not in _models:
+            _models[name] = FakeModel(name)
+        return _models[name]
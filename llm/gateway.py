@@ -0,0 +1,520 @@
+"""
+The one way this project talks to Gemini.
+
+    from llm.gateway import generate, INTERACTIVE
+    text = generate(prompt, priority=INTERACTIVE)
+
+For JSON answers use llm.json_stream, which streams the response and
+parses it as it arrives.
+
+All calls share a process-wide client and go through a scheduler that
+keeps at most LLM_MAX_CONCURRENCY requests in flight and stays within the
+account's requests/tokens per minute. When callers have to wait, waiting
+INTERACTIVE requests (a user is looking at a spinner) are let through
+before BACKGROUND ones (analysis jobs). Rate limits and transient server
+errors are retried with exponential backoff and jitter; what is left is
+raised as LLMError. Responses are cached (llm.cache) unless the caller
+passes cache=False. Every call is recorded in llm.metrics under the
+caller's `task`, which also picks the model (llm.routing). While Gemini
+keeps failing, the 'gemini' circuit breaker (backend.circuit_breaker)
+fails calls at once with LLMUnavailableError.
+"""
+import heapq
+import itertools
+import random
+import threading
+import time
+
+import google.generativeai as genai
+from django.conf import settings
+from django.db import DatabaseError
+from google.api_core import exceptions as google_exceptions
+
+from backend import circuit_breaker
+
+from . import cache as response_cache
+from . import deadline, fake, metrics, routing
+from .hedging import Hedged
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Transient failures worth another attempt.
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.Aborted,
+    google_exceptions.Unknown,
+)
+
+# Rough token estimate for quota accounting before the real count is known.
+CHARS_PER_TOKEN = 4
+
+
+class LLMError(Exception):
+    """
+    The LLM could not produce a response. `retryable` is True when the same
+    request may well succeed later (rate limited, service unavailable).
+    """
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class LLMBusyError(LLMError):
+    """No scheduler slot freed up in time; another model would not help."""
+
+
+class LLMDeadlineError(LLMError):
+    """The request's deadline (llm.deadline) ran out before an answer came."""
+
+
+class LLMUnavailableError(LLMError):
+    """Gemini's circuit breaker is open; `retry_after` is when to try again (seconds)."""
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _TokenBucket:
+    """Refills `rate_per_minute` units per minute, up to one minute's worth."""
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.rate = rate_per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` units are available (0 if they are now)."""
+        self._refill()
+        # A single request larger than the bucket only has to wait for a full bucket.
+        amount = min(amount, self.capacity)
+        return 0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.tokens -= amount
+
+    def give_back(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class _Scheduler:
+    """
+    Admits requests in (priority, arrival) order once a concurrency slot
+    and enough request/token quota are free.
+    """
+
+    def __init__(self, max_concurrency, requests_per_minute, tokens_per_minute):
+        self.max_concurrency = max_concurrency
+        self.requests = _TokenBucket(requests_per_minute)
+        self.tokens = _TokenBucket(tokens_per_minute)
+        self.active = 0
+        self._waiting = []
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+
+    def acquire(self, priority, tokens, timeout):
+        deadline = time.monotonic() + timeout
+        entry = (priority, next(self._order))
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    wait = self._wait_time(entry, tokens)
+                    if wait == 0:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise LLMBusyError("The AI service is busy. Please try again shortly.")
+                    self._condition.wait(min(wait, remaining))
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                # The next waiter may be able to go now (or has become the head).
+                self._condition.notify_all()
+
+            self.active += 1
+            self.requests.take(1)
+            self.tokens.take(tokens)
+
+    def try_acquire(self, tokens):
+        """Takes a slot only if one is free right now and nobody is waiting for it."""
+        with self._condition:
+            if self._waiting or self.active >= self.max_concurrency:
+                return False
+            if self.requests.wait_time(1) or self.tokens.wait_time(tokens):
+                return False
+            self.active += 1
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            return True
+
+    def _wait_time(self, entry, tokens):
+        """0 if `entry` may go now, otherwise how long to sleep before checking again."""
+        if self._waiting[0] != entry or self.active >= self.max_concurrency:
+            return 1.0  # woken by notify_all when something changes
+        return max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+    def release(self, estimated_tokens, used_tokens):
+        with self._condition:
+            self.active -= 1
+            if used_tokens is not None:
+                # Settle the estimate against what the API actually counted.
+                difference = estimated_tokens - used_tokens
+                if difference > 0:
+                    self.tokens.give_back(difference)
+                else:
+                    self.tokens.take(-difference)
+            self._condition.notify_all()
+
+
+_scheduler = None
+_models = {}
+_setup_lock = threading.Lock()
+
+
+def _get_scheduler():
+    global _scheduler
+    with _setup_lock:
+        if _scheduler is None:
+            _scheduler = _Scheduler(
+                settings.LLM_MAX_CONCURRENCY,
+                settings.LLM_REQUESTS_PER_MINUTE,
+                settings.LLM_TOKENS_PER_MINUTE,
+            )
+        return _scheduler
+
+
+def get_model(name=None):
+    """Returns the process-wide client for `name` (GEMINI_MODEL by default)."""
+    name = name or settings.GEMINI_MODEL
+    if settings.LLM_BACKEND == 'fake':
+        return fake.get_model(name)
+    with _setup_lock:
+        if not _models:
+            if not settings.GEMINI_API_KEY:
+                print("⚠️ Warning: GEMINI_API_KEY not set.")
+            genai.configure(api_key=settings.GEMINI_API_KEY)
+        if name not in _models:
+            _models[name] = genai.GenerativeModel(name)
+        return _models[name]
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def retry_delay(attempt):
+    """Exponential backoff with full jitter, capped at LLM_RETRY_MAX_DELAY."""
+    delay = min(settings.LLM_RETRY_MAX_DELAY, settings.LLM_RETRY_BACKOFF * (2 ** attempt))
+    return random.uniform(0, delay)
+
+
+def _used_tokens(response):
+    usage = getattr(response, 'usage_metadata', None)
+    return getattr(usage, 'total_token_count', None) or None
+
+
+def _cache_key(prompt, model, generation_config):
+    return response_cache.make_key(model or settings.GEMINI_MODEL, prompt, generation_config)
+
+
+def forget(prompt, model=None, generation_config=None, task='other'):
+    """Drops the cached response for a request, e.g. after it failed to parse."""
+    try:
+        response_cache.forget(_cache_key(prompt, model or routing.get_route(task).primary, generation_config))
+    except DatabaseError as e:
+        print(f"Could not drop cached LLM response: {e}")
+
+
+def _cache_get(key):
+    try:
+        return response_cache.get(key)
+    except DatabaseError as e:
+        print(f"LLM cache lookup failed: {e}")
+        return None
+
+
+def _cache_put(key, model, text):
+    try:
+        response_cache.put(key, model or settings.GEMINI_MODEL, text)
+    except DatabaseError as e:
+        print(f"Could not cache LLM response: {e}")
+
+
+def generate(prompt, priority=BACKGROUND, model=None, max_retries=None, generation_config=None, cache=True, task='other'):
+    """
+    Sends `prompt` to Gemini and returns the response text.
+
+    The model is chosen by the task's route (llm.routing) unless `model` is
+    given; if the chosen model fails, the other one of the route is tried.
+    A cached response for the same requested model (the route's primary
+    unless `model` is given), prompt and generation config is returned
+    without calling the API (when LLM_CACHE_ENABLED and `cache`).
+    `task` also names the caller in the call statistics (llm.metrics).
+    Raises LLMError when the request is rejected, the retries are used up,
+    no slot frees up within LLM_QUEUE_TIMEOUT, the deadline (llm.deadline)
+    runs out or the circuit breaker is open.
+    """
+    return ''.join(_answer(prompt, priority, model, max_retries, generation_config, cache, task, stream=False))
+
+
+def generate_stream(prompt, priority=BACKGROUND, model=None, max_retries=None, generation_config=None, cache=True, task='other'):
+    """
+    Like generate(), but yields the response text in pieces as Gemini
+    produces them (a cached response comes as a single piece).
+
+    Failures before the first piece are retried (or sent to the fallback
+    model) as usual. If the request fails midway, the stream ends early and
+    the caller sees a truncated response, which is not cached.
+    """
+    yield from _answer(prompt, priority, model, max_retries, generation_config, cache, task, stream=True)
+
+
+def _answer(prompt, priority, model, max_retries, generation_config, cache, task, stream):
+    """The cached answer, else the answer of the first of the route's models that gives one."""
+    models = routing.candidates(task, model)
+    use_cache = cache and settings.LLM_CACHE_ENABLED
+    # Keyed by the requested model, whichever of the route's models answers.
+    requested = model or models[0][1].primary
+    key = _cache_key(prompt, requested, generation_config)
+    if use_cache:
+        cached = _cache_get(key)
+        if cached is not None:
+            metrics.record(task, requested, 'cache_hit')
+            yield cached
+            return
+
+    breaker = circuit_breaker.get('gemini')
+    try:
+        probe = breaker.allow()
+    except circuit_breaker.CircuitOpenError as e:
+        metrics.record(task, models[0][0], 'circuit_open')
+        raise LLMUnavailableError(str(e), e.retry_after) from e
+
+    parts = []
+    succeeded = None  # says nothing about Gemini unless set below
+    try:
+        for i, (name, route) in enumerate(models):
+            last = i == len(models) - 1
+            try:
+                # With a fallback to go to, a failing model gets no retries.
+                complete = yield from _attempts(
+                    prompt, priority, name, route, max_retries if last else 0, generation_config, task, stream, parts
+                )
+                break
+            except (LLMBusyError, LLMDeadlineError):
+                raise
+            except LLMError as e:
+                # _attempts only raises before anything was received.
+                if last or not e.retryable:
+                    raise
+                print(f"{name} failed for {task} ({e}), falling back to {models[i + 1][0]}")
+        succeeded = complete
+    except LLMError as e:
+        if e.retryable and not isinstance(e, (LLMBusyError, LLMDeadlineError)):
+            succeeded = False
+        raise
+    finally:
+        breaker.record(succeeded, probe)
+
+    text = ''.join(parts)
+    if use_cache and complete and text.strip():
+        _cache_put(key, name, text)
+
+
+class _Call:
+    """
+    Records one generate call, retries included, in llm.metrics when the
+    `with` block ends. The outcome follows from how it ended: 'ok' (or
+    'truncated' for a stream cut short), 'busy' if it failed waiting for a
+    scheduler slot, 'deadline' if the deadline ran out, 'rejected' for
+    errors not worth retrying, else 'error'.
+    The model's latency (of the last attempt) or failure also goes to
+    llm.routing.
+    """
+
+    def __init__(self, task, model, prompt):
+        self.task = task
+        self.model = model
+        self.prompt = prompt
+        self.start = time.monotonic()
+        self.first_token = None
+        self.retries = 0
+        self.attempt_start = self.start
+        self.outcome = 'ok'
+        self.response = None
+        self.text = ''
+
+    def __enter__(self):
+        return self
+
+    def attempt_started(self):
+        self.attempt_start = time.monotonic()
+
+    def received(self, text):
+        if self.first_token is None:
+            self.first_token = time.monotonic() - self.start
+        self.text += text
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is GeneratorExit:
+            outcome = 'truncated'  # the caller stopped reading
+        elif exc is None:
+            outcome = self.outcome
+        elif isinstance(exc, LLMBusyError):
+            outcome = 'busy'
+        elif isinstance(exc, LLMDeadlineError):
+            outcome = 'deadline'  # the caller ran out of time; not the model's fault
+        elif isinstance(exc, LLMError) and not exc.retryable:
+            outcome = 'rejected'
+        else:
+            outcome = 'error'
+
+        end = time.monotonic()
+        if outcome == 'ok':
+            routing.observe(self.model, end - self.attempt_start)
+        elif outcome in ('error', 'truncated'):
+            routing.observe(self.model, failed=True)
+
+        prompt_tokens = response_tokens = None
+        if outcome in ('ok', 'truncated'):
+            usage = getattr(self.response, 'usage_metadata', None)
+            prompt_tokens = getattr(usage, 'prompt_token_count', None) or estimate_tokens(self.prompt)
+            response_tokens = getattr(usage, 'candidates_token_count', None) or estimate_tokens(self.text)
+        metrics.record(
+            self.task, self.model, outcome,
+            latency=end - self.start,
+            first_token=self.first_token,
+            prompt_tokens=prompt_tokens,
+            response_tokens=response_tokens,
+            retries=self.retries,
+        )
+        return False
+
+
+def _request_options(timeout):
+    return {'timeout': timeout} if timeout else None
+
+
+def _hedge_after(model, route, timeout):
+    """
+    Seconds to wait for the first piece of the answer before sending a
+    hedged duplicate: the model's recent p95, for routes with hedging on.
+    """
+    if not route.hedge:
+        return None
+    p95 = routing.recent_p95(model)
+    if p95 is None or (timeout is not None and p95 >= timeout):
+        return None
+    return p95
+
+
+def _attempts(prompt, priority, model, route, max_retries, generation_config, task, stream, parts):
+    """
+    Sends the request to `model`, retrying transient failures, and yields
+    the answer's pieces (also appended to `parts`). Returns False if a
+    stream was cut short. The queue wait, each request's timeout and the
+    retries all stay within the current deadline.
+    """
+    client = get_model(model)
+    scheduler = _get_scheduler()
+    max_retries = settings.LLM_MAX_RETRIES if max_retries is None else max_retries
+    estimated = estimate_tokens(prompt) * 2  # prompt + a response of similar size
+
+    def release(index, response):
+        # Each request gives its slot back when it has ended, even after
+        # losing the race: until then it is still using the connection.
+        scheduler.release(estimated, _used_tokens(response))
+
+    with _Call(task, model, prompt) as call:
+        attempt = 0
+        while True:
+            queue_timeout = deadline.limit(settings.LLM_QUEUE_TIMEOUT)
+            if queue_timeout <= 0:
+                raise LLMDeadlineError("The AI did not answer in time. Please try again.")
+            scheduler.acquire(priority, estimated, queue_timeout)
+            call.attempt_started()
+            pieces = None   # once started, the answer releases the slot (see release)
+            try:
+                timeout = deadline.limit(route.timeout)
+                if timeout is not None and timeout <= 0:
+                    raise LLMDeadlineError("The AI did not answer in time. Please try again.")
+                answer = Hedged(
+                    lambda: client.generate_content(
+                        prompt, generation_config=generation_config, stream=stream,
+                        request_options=_request_options(timeout),
+                    ),
+                    hedge_after=_hedge_after(model, route, timeout),
+                    stream=stream,
+                    may_hedge=lambda: scheduler.try_acquire(estimated),
+                    on_finish=release,
+                )
+                pieces = iter(answer)
+                for chunk in pieces:
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        continue  # blocked, or a final chunk that only carries the finish reason
+                    call.received(text)
+                    parts.append(text)
+                    yield text
+                call.response = answer.response
+                if not parts:
+                    raise LLMError("The AI returned no usable text.", retryable=False)
+                return True
+            except RETRYABLE_ERRORS as e:
+                if parts:
+                    print(f"LLM stream interrupted ({e.__class__.__name__}), returning what was received")
+                    call.outcome = 'truncated'
+                    return False
+                left = deadline.remaining()
+                if left is not None and left <= 0:
+                    raise LLMDeadlineError("The AI did not answer in time. Please try again.") from e
+                error = e
+            except google_exceptions.GoogleAPICallError as e:
+                if parts:
+                    print(f"LLM stream interrupted ({e.__class__.__name__}), returning what was received")
+                    call.outcome = 'truncated'
+                    return False
+                raise LLMError(f"The AI request was rejected: {e}", retryable=False) from e
+            except LLMError:
+                raise
+            except Exception as e:
+                # Anything the client did not turn into an API error (a dropped
+                # connection, a malformed response) is treated as transient too,
+                # so it is retried and counted by the metrics and the breaker.
+                if parts:
+                    print(f"LLM stream interrupted ({e.__class__.__name__}), returning what was received")
+                    call.outcome = 'truncated'
+                    return False
+                error = LLMError(f"The AI request failed ({e.__class__.__name__}): {e}", retryable=True)
+                error.__cause__ = e
+            finally:
+                if pieces is None:
+                    scheduler.release(estimated, None)
+                else:
+                    pieces.close()  # a request still running in its own thread releases its slot when it ends
+
+            attempt += 1
+            if attempt > max_retries:
+                raise LLMError(f"The AI service is unavailable after {attempt} attempts: {error}") from error
+            delay = retry_delay(attempt)
+            left = deadline.remaining()
+            if left is not None and delay >= left:
+                raise LLMDeadlineError(f"The AI did not answer in time: {error}") from error
+            call.retries = attempt
+            print(f"LLM request failed ({error.__class__.__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
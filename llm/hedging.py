@@ -0,0 +1,98 @@
+"""
+Hedged requests: when an answer is slow to start, send the same request a
+second time and use whichever answer starts first.
+
+    answer = Hedged(lambda: client.generate_content(prompt, stream=True), hedge_after=p95)
+    for chunk in answer:
+        ...
+
+The second request is sent only if nothing has arrived `hedge_after`
+seconds after the first, and only if `may_hedge()` allows it (the gateway
+checks for a free scheduler slot). The slower request cannot be cancelled
+once sent; it is left to finish (or time out) in its thread and its
+answer is discarded. Only use this for requests that are safe to repeat.
+"""
+import queue
+import threading
+
+_DONE = object()
+
+
+class Hedged:
+    def __init__(self, start, hedge_after=None, stream=True, may_hedge=None, on_finish=None):
+        """
+        `start()` sends the request and returns the response (an iterable of
+        chunks if `stream`). `on_finish(index, response)` is called when
+        request `index` (0 or 1) has ended, whichever way, with its
+        response (None if it failed).
+        """
+        self.start = start
+        self.hedge_after = hedge_after
+        self.stream = stream
+        self.may_hedge = may_hedge
+        self.on_finish = on_finish
+        self.response = None    # the response that won
+        self.hedged = False     # whether the second request was sent
+        self._pieces = queue.Queue()
+        self._abandoned = [threading.Event(), threading.Event()]
+
+    def _run(self, index):
+        response = None
+        try:
+            response = self.start()
+            for chunk in (response if self.stream else [response]):
+                if self._abandoned[index].is_set():
+                    return
+                self._pieces.put((index, chunk, response))
+            self._pieces.put((index, _DONE, response))
+        except Exception as e:
+            response = None
+            self._pieces.put((index, e, None))
+        finally:
+            if self.on_finish:
+                self.on_finish(index, response)
+
+    def _launch(self, index):
+        threading.Thread(target=self._run, args=(index,), daemon=True).start()
+
+    def __iter__(self):
+        if self.hedge_after is None:
+            # Nothing to race: iterate in the caller's thread.
+            try:
+                self.response = self.start()
+                yield from (self.response if self.stream else [self.response])
+            finally:
+                if self.on_finish:
+                    self.on_finish(0, self.response)
+            return
+
+        self._launch(0)
+        running, winner = 1, None
+        while True:
+            wait = self.hedge_after if winner is None and not self.hedged else None
+            try:
+                index, piece, response = self._pieces.get(timeout=wait)
+            except queue.Empty:
+                if self.may_hedge is None or self.may_hedge():
+                    print(f"LLM answer slower than {self.hedge_after:.1f}s, sending a hedged request")
+                    self.hedged = True
+                    running += 1
+                    self._launch(1)
+                else:
+                    self.hedged = True  # no slot for a second request; just keep waiting
+                continue
+
+            if winner is not None and index != winner:
+                continue
+            if isinstance(piece, Exception):
+                running -= 1
+                if winner is None and running:
+                    continue  # the other request may still answer
+                raise piece
+            if winner is None:
+                winner = index
+                self._abandoned[1 - index].set()
+                self.response = response
+            if piece is _DONE:
+                return
+            yield piece
@@ -0,0 +1,258 @@
+"""
+JSON answers from the LLM.
+
+Prompts that ask for a list (topics, questions, study plan days) go through
+generate_items(): the request is sent in JSON mode and streamed, and the
+items of the first JSON array in the answer are parsed one by one as they
+arrive, so callers can save them straight away. Items that are broken are
+repaired where possible (markdown fences, trailing commas, raw newlines in
+strings) and dropped otherwise. When the answer was cut off or items are
+missing, only those are asked for again:
+
+    def missing(items, complete):
+        if len(items) < 10:
+            return f"{prompt}\n\nReturn only {10 - len(items)} more questions."
+
+    questions = generate_items(prompt, INTERACTIVE, missing_prompt=missing, on_items=save)
+"""
+import json
+import re
+
+from django.conf import settings
+
+from .gateway import BACKGROUND, forget, generate_stream
+
+# Asks Gemini for a bare JSON document (no prose or markdown around it).
+JSON_MODE = {'response_mime_type': 'application/json'}
+
+FENCE_RE = re.compile(r'^\s*```(?:json)?\s*|\s*```\s*$', re.IGNORECASE)
+
+
+def strip_fences(text):
+    return FENCE_RE.sub('', text)
+
+
+def _close(text):
+    """
+    Single pass over `text` that drops trailing commas, escapes raw newlines
+    inside strings and, if the text was cut off, drops the unfinished value
+    and closes whatever is still open. Returns (repaired text, offsets of
+    the commas between values).
+    """
+    out, stack, commas, strings = [], [], [], []   # stack: (closing bracket, offset in out)
+    in_string = escape = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+            elif ch == '\n':
+                ch = '\\n'
+            out.append(ch)
+            continue
+        if ch == '"':
+            in_string = True
+            strings.append(len(out))
+        elif ch in '{[':
+            stack.append(('}' if ch == '{' else ']', len(out)))
+        elif ch in '}]':
+            while out and (out[-1].isspace() or out[-1] == ','):
+                out.pop()
+            if stack:
+                stack.pop()
+        elif ch == ',':
+            commas.append(i)
+        out.append(ch)
+
+    if in_string or stack:
+        stack = _drop_unfinished(out, stack, strings, in_string)
+    out.extend(bracket for bracket, _ in reversed(stack))
+    return ''.join(out), commas
+
+
+def _drop_unfinished(out, stack, strings, in_string):
+    """
+    Removes from `out` (in place) the value that was being written when the
+    text was cut off: the outermost unfinished object below the top level
+    or, failing that, the last string or number. Returns the containers
+    that are still open.
+    """
+    objects = [start for bracket, start in stack[1:] if bracket == '}']
+    if objects:
+        cut = objects[0]
+    elif in_string:
+        cut = strings[-1]
+    else:
+        cut = len(out)
+        while cut and (out[cut - 1].isalnum() or out[cut - 1] in '+-.'):
+            cut -= 1
+    del out[cut:]
+
+    while out and (out[-1].isspace() or out[-1] == ','):
+        out.pop()
+    if out and out[-1] == ':':
+        # A key whose value was dropped (or never written): drop the key too.
+        out.pop()
+        while out and out[-1].isspace():
+            out.pop()
+        del out[max((start for start in strings if start < len(out)), default=len(out)):]
+        while out and (out[-1].isspace() or out[-1] == ','):
+            out.pop()
+    return [(bracket, start) for bracket, start in stack if start < len(out)]
+
+
+def repair(text):
+    """
+    Parses `text` as JSON, fixing what the LLM commonly gets wrong: fences
+    and prose around the JSON, trailing commas, raw newlines in strings
+    and a truncated end (the unfinished last value, or the unfinished
+    object it belongs to, is dropped).
+    Raises json.JSONDecodeError if it still cannot be parsed.
+    """
+    text = strip_fences(text)
+    start = min((i for i in (text.find('{'), text.find('[')) if i >= 0), default=0)
+    text = text[start:]
+
+    repaired, commas = _close(text)
+    try:
+        return json.loads(repaired)
+    except json.JSONDecodeError as error:
+        first_error = error
+    # Cut back to the last few value boundaries: the tail may be a half-written value.
+    for comma in reversed(commas[-3:]):
+        try:
+            return json.loads(_close(text[:comma])[0])
+        except json.JSONDecodeError:
+            continue
+    raise first_error
+
+
+class ItemParser:
+    """
+    Incremental parser for the items of the first JSON array in a text fed
+    to it in pieces. feed() returns the items completed by each piece.
+    `complete` is True once the array has been closed; `dropped` counts
+    items that could not be parsed even after repair.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.array_depth = None   # depth inside the items array
+        self.item_start = None
+        self.complete = False
+        self.dropped = 0
+
+    def feed(self, text):
+        self.buffer += text
+        items = []
+        while self.pos < len(self.buffer) and not self.complete:
+            ch = self.buffer[self.pos]
+            at_items = self.depth == self.array_depth
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    if at_items:
+                        self._emit(self.pos + 1, items)
+            elif ch == '"':
+                if at_items and self.item_start is None:
+                    self.item_start = self.pos
+                self.in_string = True
+            elif ch in '{[':
+                if self.array_depth is None and ch == '[':
+                    self.array_depth = self.depth + 1
+                elif at_items and self.item_start is None:
+                    self.item_start = self.pos
+                self.depth += 1
+            elif ch in '}]':
+                self.depth -= 1
+                if self.array_depth is not None:
+                    if self.depth == self.array_depth:
+                        self._emit(self.pos + 1, items)
+                    elif self.depth < self.array_depth:
+                        self._emit(self.pos, items)  # a bare value right before ']'
+                        self.complete = True
+            elif at_items:
+                if ch == ',':
+                    self._emit(self.pos, items)
+                elif not ch.isspace() and self.item_start is None:
+                    self.item_start = self.pos
+            self.pos += 1
+        return items
+
+    def _emit(self, end, items):
+        if self.item_start is None:
+            return
+        raw = self.buffer[self.item_start:end]
+        self.item_start = None
+        try:
+            items.append(json.loads(raw))
+        except json.JSONDecodeError:
+            try:
+                items.append(repair(raw))
+            except json.JSONDecodeError:
+                print(f"Dropping unparseable item from LLM response: {raw[:200]}")
+                self.dropped += 1
+
+
+def stream_batches(prompt, priority=BACKGROUND, cache=True, task='other'):
+    """
+    Yields the items of the JSON array in the LLM's answer as they arrive,
+    as lists of the items completed by each streamed piece.
+    Returns (via StopIteration) the ItemParser, for `complete`/`dropped`.
+    """
+    parser = ItemParser()
+    for piece in generate_stream(prompt, priority=priority, generation_config=JSON_MODE, cache=cache, task=task):
+        batch = parser.feed(piece)
+        if batch:
+            yield batch
+    if parser.dropped or not parser.complete:
+        # Don't answer the next identical request from a broken response.
+        forget(prompt, generation_config=JSON_MODE, task=task)
+    return parser
+
+
+def generate_items(prompt, priority=BACKGROUND, missing_prompt=None, on_items=None, cache=True, max_follow_ups=None, task='other'):
+    """
+    Returns the list of items the LLM answered `prompt` with, calling
+    `on_items(items)` with the items of each streamed piece as soon as they
+    have been parsed (so they can be validated and saved together).
+
+    After each answer, `missing_prompt(items, complete)` (if given) may
+    return a prompt asking only for what is still missing (`complete` is
+    False when the answer was cut off or had broken items); it is sent
+    up to LLM_JSON_FOLLOW_UPS times.
+    Raises LLMError if the LLM cannot be reached.
+    """
+    max_follow_ups = settings.LLM_JSON_FOLLOW_UPS if max_follow_ups is None else max_follow_ups
+    items = []
+    for attempt in range(max_follow_ups + 1):
+        stream = stream_batches(prompt, priority, cache, task)
+        while True:
+            try:
+                batch = next(stream)
+            except StopIteration as stop:
+                parser = stop.value
+                break
+            items.extend(batch)
+            if on_items:
+                on_items(batch)
+
+        complete = parser.complete and not parser.dropped
+        if missing_prompt is None or attempt == max_follow_ups:
+            break
+        prompt = missing_prompt(items, complete)
+        if not prompt:
+            break
+        print(f"LLM answer incomplete ({len(items)} items, {parser.dropped} dropped), asking for the rest")
+    return items
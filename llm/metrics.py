@@ -0,0 +1,168 @@
+"""
+In-process statistics about the LLM calls made by this process.
+
+The gateway records every call to Gemini: the task it was made for
+(analysis, quiz, plan, plan-update), the model, wall time, time to first
+token, prompt and response tokens, estimated cost, retries and the
+outcome. Calls are aggregated per (task, model) into fixed-bucket
+histograms, so memory stays constant however many calls are made.
+
+snapshot() is shown on the admin "LLM usage" page and render() serves the
+same numbers in the Prometheus text format (api/llm/metrics/). Each worker
+process keeps its own numbers; scrape every process.
+"""
+import bisect
+import threading
+from collections import Counter
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)           # seconds
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000)
+COST_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)   # USD
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, q):
+        """Estimate of the q-th percentile (0-100), interpolated within its bucket."""
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def cumulative(self):
+        total, result = 0, []
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class _Series:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.first_token = Histogram(LATENCY_BUCKETS)
+        self.prompt_tokens = Histogram(TOKEN_BUCKETS)
+        self.response_tokens = Histogram(TOKEN_BUCKETS)
+        self.cost = Histogram(COST_BUCKETS)
+        self.retries = 0
+        self.outcomes = Counter()
+
+
+_series = {}
+_lock = threading.Lock()
+
+
+def cost(model, prompt_tokens, response_tokens):
+    """Estimated USD cost from LLM_TOKEN_PRICES (per million input/output tokens)."""
+    prices = settings.LLM_TOKEN_PRICES.get(model)
+    if not prices:
+        return 0.0
+    return (prompt_tokens * prices[0] + response_tokens * prices[1]) / 1_000_000
+
+
+def record(task, model, outcome, latency=None, first_token=None, prompt_tokens=None, response_tokens=None, retries=0):
+    """
+    Adds one call to the statistics of (task, model). `outcome` is one of
+    'ok', 'cache_hit', 'circuit_open', 'truncated', 'busy', 'deadline',
+    'rejected' or 'error'.
+    """
+    with _lock:
+        series = _series.setdefault((task, model), _Series())
+        series.outcomes[outcome] += 1
+        series.retries += retries
+        if outcome in ('cache_hit', 'circuit_open'):
+            return
+        if latency is not None:
+            series.latency.observe(latency)
+        if first_token is not None:
+            series.first_token.observe(first_token)
+        if prompt_tokens is not None and response_tokens is not None:
+            series.prompt_tokens.observe(prompt_tokens)
+            series.response_tokens.observe(response_tokens)
+            series.cost.observe(cost(model, prompt_tokens, response_tokens))
+
+
+def reset():
+    with _lock:
+        _series.clear()
+
+
+def _rounded(value, digits=3):
+    return None if value is None else round(value, digits)
+
+
+def snapshot():
+    """Per (task, model) totals and percentiles, as a list of dicts."""
+    with _lock:
+        rows = []
+        for (task, model), s in sorted(_series.items()):
+            rows.append({
+                'task': task,
+                'model': model,
+                'calls': sum(s.outcomes.values()),
+                'outcomes': dict(s.outcomes),
+                'retries': s.retries,
+                'latency_p50': _rounded(s.latency.percentile(50)),
+                'latency_p95': _rounded(s.latency.percentile(95)),
+                'latency_p99': _rounded(s.latency.percentile(99)),
+                'first_token_p50': _rounded(s.first_token.percentile(50)),
+                'first_token_p95': _rounded(s.first_token.percentile(95)),
+                'prompt_tokens': int(s.prompt_tokens.sum),
+                'response_tokens': int(s.response_tokens.sum),
+                'cost_usd': round(s.cost.sum, 4),
+            })
+        return rows
+
+
+def render():
+    """The statistics in the Prometheus text exposition format."""
+    lines = []
+
+    def histogram(name, help_text, attribute):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for (task, model), s in sorted(_series.items()):
+            h = getattr(s, attribute)
+            labels = f'task="{task}",model="{model}"'
+            for bound, total in h.cumulative():
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+            lines.append(f'{name}_sum{{{labels}}} {h.sum}')
+            lines.append(f'{name}_count{{{labels}}} {h.count}')
+
+    with _lock:
+        histogram('llm_request_duration_seconds', 'Wall time of LLM calls, including retries.', 'latency')
+        histogram('llm_time_to_first_token_seconds', 'Time until the first piece of the answer arrived.', 'first_token')
+        histogram('llm_prompt_tokens', 'Prompt tokens per LLM call.', 'prompt_tokens')
+        histogram('llm_response_tokens', 'Response tokens per LLM call.', 'response_tokens')
+        histogram('llm_cost_usd', 'Estimated cost per LLM call (LLM_TOKEN_PRICES).', 'cost')
+
+        lines.append("# HELP llm_calls_total LLM calls by outcome.")
+        lines.append("# TYPE llm_calls_total counter")
+        for (task, model), s in sorted(_series.items()):
+            for outcome, count in sorted(s.outcomes.items()):
+                lines.append(f'llm_calls_total{{task="{task}",model="{model}",outcome="{outcome}"}} {count}')
+
+        lines.append("# HELP llm_retries_total Retried LLM requests.")
+        lines.append("# TYPE llm_retries_total counter")
+        for (task, model), s in sorted(_series.items()):
+            lines.append(f'llm_retries_total{{task="{task}",model="{model}"}} {s.retries}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,19 @@
+from django.db import models
+
+
+class CachedResponse(models.Model):
+    """
+    A stored LLM response, keyed by a hash of model + normalized prompt +
+    generation config (see llm.cache).
+    """
+    key = models.CharField(max_length=64, unique=True)
+    model = models.CharField(max_length=100)
+    response = models.TextField()
+    size_bytes = models.PositiveIntegerField()
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(db_index=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.model} {self.key[:12]} ({self.size_bytes} bytes, {self.hits} hits)"
@@ -0,0 +1,113 @@
+"""
+Which Gemini model answers which task.
+
+LLM_ROUTES maps a task (the `task` passed to the gateway: analysis, quiz,
+plan, plan-update) to a primary and a fallback model, the p95 latency the
+primary is allowed (seconds) and a timeout for each request. The primary
+is used while it is healthy: its p95 over the calls of the last
+LLM_ROUTE_WINDOW seconds is within the budget and it has not failed in the
+last LLM_ROUTE_COOLDOWN seconds. Otherwise the fallback is tried first.
+Routes with `hedge` on send a duplicate request when the answer is slower
+to start than the model's recent p95 (llm.hedging).
+Tasks without a route use GEMINI_MODEL alone.
+"""
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+from django.conf import settings
+
+# Latency samples kept per model; the window is also limited by LLM_ROUTE_WINDOW.
+MAX_SAMPLES = 500
+
+
+@dataclass
+class Route:
+    primary: str
+    fallback: Optional[str] = None
+    latency_budget: Optional[float] = None
+    timeout: Optional[float] = None
+    hedge: bool = False
+
+
+_samples = {}       # model -> deque of (time, seconds)
+_last_error = {}    # model -> time
+_lock = threading.Lock()
+
+
+def get_route(task):
+    config = settings.LLM_ROUTES.get(task)
+    if not config:
+        return Route(settings.GEMINI_MODEL)
+    return Route(
+        config.get('primary') or settings.GEMINI_MODEL,
+        config.get('fallback'),
+        config.get('latency_budget'),
+        config.get('timeout'),
+        config.get('hedge', False),
+    )
+
+
+def observe(model, seconds=None, failed=False):
+    """Records a finished request to `model`: its latency, or that it failed."""
+    now = time.monotonic()
+    with _lock:
+        if failed:
+            _last_error[model] = now
+        elif seconds is not None:
+            _samples.setdefault(model, deque(maxlen=MAX_SAMPLES)).append((now, seconds))
+
+
+def recent_p95(model):
+    """p95 latency of `model` over the last LLM_ROUTE_WINDOW seconds (None if too few calls)."""
+    since = time.monotonic() - settings.LLM_ROUTE_WINDOW
+    with _lock:
+        latencies = sorted(seconds for at, seconds in _samples.get(model, ()) if at >= since)
+    if len(latencies) < settings.LLM_ROUTE_MIN_SAMPLES:
+        return None
+    return latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+
+
+def is_healthy(model, latency_budget=None):
+    with _lock:
+        failed_at = _last_error.get(model)
+    if failed_at is not None and time.monotonic() - failed_at < settings.LLM_ROUTE_COOLDOWN:
+        return False
+    p95 = recent_p95(model)
+    return latency_budget is None or p95 is None or p95 <= latency_budget
+
+
+def candidates(task, model=None):
+    """
+    [(model, route), ...] to try for `task`, best first. An explicit
+    `model` is used on its own.
+    """
+    route = get_route(task)
+    if model:
+        return [(model, route)]
+    if not route.fallback:
+        return [(route.primary, route)]
+    if is_healthy(route.primary, route.latency_budget):
+        return [(route.primary, route), (route.fallback, route)]
+    return [(route.fallback, route), (route.primary, route)]
+
+
+def status():
+    """Per route: the models, the primary's recent p95 and which model is in use."""
+    rows = []
+    for task in sorted(settings.LLM_ROUTES):
+        route = get_route(task)
+        p95 = recent_p95(route.primary)
+        rows.append({
+            'task': task,
+            'primary': route.primary,
+            'fallback': route.fallback,
+            'latency_budget': route.latency_budget,
+            'timeout': route.timeout,
+            'hedge': route.hedge,
+            'primary_p95': None if p95 is None else round(p95, 3),
+            'active': candidates(task)[0][0],
+        })
+    return rows
@@ -0,0 +1,384 @@
+import json
+import threading
+import time
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from google.api_core import exceptions as google_exceptions
+
+from backend import circuit_breaker
+
+from . import cache as response_cache
+from . import fake, gateway, json_stream, metrics, routing
+from .deadline import deadline
+from .models import CachedResponse
+
+ROUTES = {
+    'quiz': {'primary': 'primary-model', 'fallback': 'fallback-model', 'latency_budget': 1, 'timeout': 5},
+}
+
+
+@override_settings(
+    LLM_BACKEND='fake',
+    LLM_CACHE_ENABLED=False,
+    LLM_FAKE_LATENCY=0,
+    LLM_FAKE_LATENCY_JITTER=0,
+    LLM_FAKE_SLOW_RATE=0,
+    LLM_FAKE_TOKENS_PER_SECOND=0,
+    LLM_RETRY_BACKOFF=0,
+    LLM_ROUTES=ROUTES,
+)
+class GatewayTestCase(TestCase):
+    """Runs against llm.fake with fresh routing, metrics, scheduler and breaker state."""
+
+    def setUp(self):
+        super().setUp()
+        routing._samples.clear()
+        routing._last_error.clear()
+        metrics.reset()
+        circuit_breaker._breakers.clear()
+        gateway._scheduler = None
+        self.addCleanup(setattr, gateway, '_scheduler', None)
+        self.addCleanup(setattr, fake, 'responder', fake.answer)
+        self.calls = []
+
+    def respond(self, answers):
+        """Answers per model: a string, or an exception to raise."""
+        def responder(model, prompt):
+            self.calls.append(model)
+            answer = answers[model]
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+        fake.responder = responder
+
+
+@override_settings(LLM_CACHE_ENABLED=True)
+class ResponseCacheTests(GatewayTestCase):
+
+    def test_answer_is_cached_under_the_primary_even_when_the_fallback_gives_it(self):
+        self.respond({
+            'primary-model': google_exceptions.ServiceUnavailable("down"),
+            'fallback-model': '["from the fallback"]',
+        })
+        self.assertEqual(gateway.generate("prompt", task='quiz'), '["from the fallback"]')
+        self.assertEqual(self.calls, ['primary-model', 'fallback-model'])
+
+        entry = CachedResponse.objects.get()
+        self.assertEqual(entry.key, response_cache.make_key('primary-model', "prompt"))
+        self.assertEqual(entry.model, 'fallback-model')
+
+        # The primary is cooling down now, so the route starts with the fallback; same key.
+        self.assertEqual(gateway.generate("prompt", task='quiz'), '["from the fallback"]')
+        self.assertEqual(len(self.calls), 2)
+
+    def test_forget_drops_the_entry(self):
+        self.respond({'primary-model': '["answer"]'})
+        gateway.generate("prompt", task='quiz')
+        gateway.forget("prompt", task='quiz')
+        self.assertFalse(CachedResponse.objects.exists())
+
+    def test_whitespace_changes_share_an_entry(self):
+        self.respond({'primary-model': '["answer"]'})
+        gateway.generate("a  prompt\n", task='quiz')
+        gateway.generate(" a prompt", task='quiz')
+        self.assertEqual(self.calls, ['primary-model'])
+
+    def test_cache_can_be_bypassed(self):
+        self.respond({'primary-model': '["answer"]'})
+        gateway.generate("prompt", task='quiz')
+        gateway.generate("prompt", task='quiz', cache=False)
+        self.assertEqual(len(self.calls), 2)
+
+
+class JsonRepairTests(TestCase):
+
+    def test_code_fences_and_prose_are_stripped(self):
+        self.assertEqual(json_stream.repair('```json\n[{"a": 1}]\n```'), [{'a': 1}])
+        self.assertEqual(json_stream.repair('Here you go:\n{"a": [1, 2]}'), {'a': [1, 2]})
+
+    def test_trailing_commas_are_dropped(self):
+        self.assertEqual(json_stream.repair('[{"a": 1,}, {"b": [2, 3,],},]'), [{'a': 1}, {'b': [2, 3]}])
+
+    def test_raw_newlines_in_strings_are_escaped(self):
+        self.assertEqual(json_stream.repair('[{"a": "two\nlines"}]'), [{'a': 'two\nlines'}])
+
+    def test_a_cut_off_string_is_dropped(self):
+        self.assertEqual(json_stream.repair('["first", "sec'), ['first'])
+        self.assertEqual(json_stream.repair('{"a": "done", "b": "unfini'), {'a': 'done'})
+
+    def test_a_cut_off_number_is_dropped(self):
+        self.assertEqual(json_stream.repair('[1, 2, 3'), [1, 2])
+        self.assertEqual(json_stream.repair('{"a": 1, "b": 2.'), {'a': 1})
+
+    def test_a_cut_off_item_is_dropped_whole(self):
+        self.assertEqual(
+            json_stream.repair('[{"q": "one", "n": 1}, {"q": "two", "n": 2'),
+            [{'q': 'one', 'n': 1}],
+        )
+
+    def test_unrepairable_text_raises(self):
+        with self.assertRaises(json.JSONDecodeError):
+            json_stream.repair('not json at all')
+
+
+class ItemParserTests(TestCase):
+
+    def feed(self, text, piece=7):
+        parser = json_stream.ItemParser()
+        items = []
+        for i in range(0, len(text), piece):
+            items.extend(parser.feed(text[i:i + piece]))
+        return parser, items
+
+    def test_items_are_parsed_as_they_arrive(self):
+        parser = json_stream.ItemParser()
+        self.assertEqual(parser.feed('[{"a": 1}, {"b"'), [{'a': 1}])
+        self.assertEqual(parser.feed(': 2}]'), [{'b': 2}])
+        self.assertTrue(parser.complete)
+
+    def test_fenced_answer(self):
+        parser, items = self.feed('```json\n[{"a": 1}, {"a": 2}]\n```')
+        self.assertEqual(items, [{'a': 1}, {'a': 2}])
+        self.assertTrue(parser.complete)
+
+    def test_study_plan_wrapper(self):
+        text = '{"study_plan": [{"day": 1, "tasks": [{"subject": "S"}]}, {"day": 2, "tasks": []}]}'
+        parser, items = self.feed(text)
+        self.assertEqual([item['day'] for item in items], [1, 2])
+        self.assertEqual(items[0]['tasks'], [{'subject': 'S'}])
+        self.assertTrue(parser.complete)
+
+    def test_trailing_comma_and_bare_values(self):
+        parser, items = self.feed('["a", 2, true,]')
+        self.assertEqual(items, ['a', 2, True])
+        self.assertTrue(parser.complete)
+
+    def test_cut_off_answer_is_incomplete(self):
+        parser, items = self.feed('[{"a": 1}, {"a": 2}, {"a": "thr')
+        self.assertEqual(items, [{'a': 1}, {'a': 2}])
+        self.assertFalse(parser.complete)
+
+    def test_broken_items_are_repaired_or_counted(self):
+        parser, items = self.feed('[{"a": "x\ny"}, {"a": oops}, {"a": 3}]')
+        self.assertEqual(items, [{'a': 'x\ny'}, {'a': 3}])
+        self.assertEqual(parser.dropped, 1)
+
+
+class GenerateItemsTests(GatewayTestCase):
+
+    def test_only_missing_items_are_asked_for_again(self):
+        answers = iter(['[{"n": 1}, {"n": 2}, {"n": 3', '[{"n": 3}]'])
+        prompts = []
+
+        def responder(model, prompt):
+            prompts.append(prompt)
+            return next(answers)
+        fake.responder = responder
+
+        def missing(items, complete):
+            if not complete:
+                return f"more after {len(items)}"
+
+        batches = []
+        items = json_stream.generate_items("prompt", missing_prompt=missing, on_items=batches.append)
+        self.assertEqual(items, [{'n': 1}, {'n': 2}, {'n': 3}])
+        self.assertEqual(prompts, ["prompt", "more after 2"])
+        self.assertEqual(sum(batches, []), items)
+
+
+class MetricsTests(GatewayTestCase):
+
+    def row(self, task, model):
+        return next(r for r in metrics.snapshot() if (r['task'], r['model']) == (task, model))
+
+    def test_histogram_percentiles_and_buckets(self):
+        histogram = metrics.Histogram((1, 2, 4))
+        for value in (0.5, 1.5, 1.5, 3, 10):
+            histogram.observe(value)
+        self.assertEqual(histogram.cumulative(), [(1, 1), (2, 3), (4, 4), ('+Inf', 5)])
+        self.assertEqual(histogram.percentile(50), 1.75)
+        self.assertEqual(histogram.sum, 16.5)
+        self.assertIsNone(metrics.Histogram((1,)).percentile(50))
+
+    @override_settings(LLM_TOKEN_PRICES={'primary-model': (1.0, 2.0)})
+    def test_a_call_records_tokens_and_cost(self):
+        self.respond({'primary-model': '["answer"]'})
+        gateway.generate("x" * 400, task='quiz')
+        row = self.row('quiz', 'primary-model')
+        self.assertEqual((row['calls'], row['outcomes']), (1, {'ok': 1}))
+        self.assertEqual(row['prompt_tokens'], 101)  # llm.fake counts 4 characters a token
+        self.assertEqual(row['response_tokens'], 3)
+        self.assertEqual(row['cost_usd'], round((101 * 1.0 + 3 * 2.0) / 1_000_000, 4))
+        self.assertIsNotNone(row['latency_p50'])
+        self.assertEqual(metrics.cost('unpriced-model', 1000, 1000), 0.0)
+
+    def test_retries_and_failures_are_counted(self):
+        answers = iter([google_exceptions.ServiceUnavailable("busy"), '["answer"]'])
+
+        def responder(model, prompt):
+            answer = next(answers)
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+        fake.responder = responder
+        gateway.generate("prompt", model='solo-model', task='other')
+        self.assertEqual(self.row('other', 'solo-model')['retries'], 1)
+
+        self.respond({'solo-model': google_exceptions.InvalidArgument("bad request")})
+        with self.assertRaises(gateway.LLMError):
+            gateway.generate("prompt", model='solo-model', task='other')
+        self.assertEqual(self.row('other', 'solo-model')['outcomes'], {'ok': 1, 'rejected': 1})
+
+    @override_settings(LLM_METRICS_TOKEN='secret')
+    def test_prometheus_endpoint_needs_the_token(self):
+        metrics.record('quiz', 'primary-model', 'ok', latency=0.3, prompt_tokens=10, response_tokens=5)
+        self.assertEqual(self.client.get('/api/llm/metrics/').status_code, 403)
+
+        response = self.client.get('/api/llm/metrics/', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('llm_request_duration_seconds_bucket{task="quiz",model="primary-model",le="0.5"} 1', body)
+        self.assertIn('llm_calls_total{task="quiz",model="primary-model",outcome="ok"} 1', body)
+
+
+@override_settings(LLM_ROUTE_MIN_SAMPLES=3, LLM_ROUTE_WINDOW=60, LLM_ROUTE_COOLDOWN=60)
+class RoutingTests(GatewayTestCase):
+
+    def active(self):
+        return [name for name, _ in routing.candidates('quiz')]
+
+    def test_tasks_without_a_route_use_the_default_model(self):
+        with override_settings(GEMINI_MODEL='default-model'):
+            self.assertEqual([name for name, _ in routing.candidates('other')], ['default-model'])
+        self.assertEqual([name for name, _ in routing.candidates('quiz', 'chosen')], ['chosen'])
+
+    def test_a_slow_primary_moves_behind_the_fallback(self):
+        self.assertEqual(self.active(), ['primary-model', 'fallback-model'])
+        for _ in range(3):
+            routing.observe('primary-model', 0.5)
+        self.assertEqual(self.active(), ['primary-model', 'fallback-model'])
+        for _ in range(3):
+            routing.observe('primary-model', 3)  # over the 1 s budget
+        self.assertEqual(self.active(), ['fallback-model', 'primary-model'])
+        self.assertEqual(routing.status()[0]['active'], 'fallback-model')
+
+    def test_a_failed_primary_cools_down(self):
+        routing.observe('primary-model', failed=True)
+        self.assertEqual(self.active(), ['fallback-model', 'primary-model'])
+        with override_settings(LLM_ROUTE_COOLDOWN=0):
+            self.assertEqual(self.active(), ['primary-model', 'fallback-model'])
+
+    def test_transient_errors_fall_back_but_rejections_do_not(self):
+        self.respond({
+            'primary-model': google_exceptions.ServiceUnavailable("down"),
+            'fallback-model': '["fallback"]',
+        })
+        self.assertEqual(gateway.generate("prompt", task='quiz'), '["fallback"]')
+        self.assertEqual(self.calls, ['primary-model', 'fallback-model'])  # no retries before falling back
+
+        routing._last_error.clear()
+        self.calls.clear()
+        self.respond({'primary-model': google_exceptions.InvalidArgument("bad prompt"), 'fallback-model': '[]'})
+        with self.assertRaises(gateway.LLMError) as raised:
+            gateway.generate("prompt", task='quiz')
+        self.assertFalse(raised.exception.retryable)
+        self.assertEqual(self.calls, ['primary-model'])
+
+
+HEDGED_ROUTES = {
+    'quiz': {'primary': 'primary-model', 'timeout': 5, 'hedge': True},
+}
+
+
+@override_settings(LLM_ROUTES=HEDGED_ROUTES, LLM_ROUTE_MIN_SAMPLES=3)
+class DeadlineAndHedgingTests(GatewayTestCase):
+
+    def wait_until_idle(self):
+        scheduler = gateway._get_scheduler()
+        for _ in range(100):
+            if scheduler.active == 0:
+                return
+            time.sleep(0.02)
+        self.fail(f"{scheduler.active} scheduler slots were never released")
+
+    def test_an_expired_deadline_raises_before_any_call(self):
+        self.respond({'primary-model': '["answer"]'})
+        with deadline(0):
+            with self.assertRaises(gateway.LLMDeadlineError):
+                gateway.generate("prompt", task='quiz')
+        self.assertEqual(self.calls, [])
+        self.assertEqual(gateway._get_scheduler().active, 0)
+
+    @override_settings(LLM_FAKE_LATENCY=2)
+    def test_a_deadline_shorter_than_the_answer_stops_waiting(self):
+        self.respond({'primary-model': '["answer"]'})
+        started = time.monotonic()
+        with deadline(0.2):
+            with self.assertRaises(gateway.LLMDeadlineError):
+                gateway.generate("prompt", task='quiz')
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(len(self.calls), 1)  # no retry once the time is up
+
+    def test_a_slow_answer_is_hedged_and_the_faster_one_wins(self):
+        for _ in range(3):
+            routing.observe('primary-model', 0.05)  # p95: hedge after 50 ms
+        slow_may_finish = threading.Event()
+        self.addCleanup(slow_may_finish.set)
+
+        def responder(model, prompt):
+            self.calls.append(model)
+            if len(self.calls) == 1:
+                slow_may_finish.wait(5)
+                return '["slow"]'
+            return '["fast"]'
+        fake.responder = responder
+
+        self.assertEqual(gateway.generate("prompt", task='quiz'), '["fast"]')  # one answer, not both
+        self.assertEqual(len(self.calls), 2)
+
+        # The slow request still holds its slot until it has actually ended.
+        self.assertEqual(gateway._get_scheduler().active, 1)
+        slow_may_finish.set()
+        self.wait_until_idle()
+
+    def test_no_hedge_without_a_free_slot(self):
+        for _ in range(3):
+            routing.observe('primary-model', 0.05)
+        self.respond({'primary-model': '["answer"]'})
+        with override_settings(LLM_FAKE_LATENCY=0.2), mock.patch.object(gateway._Scheduler, 'try_acquire', return_value=False):
+            self.assertEqual(gateway.generate("prompt", task='quiz'), '["answer"]')
+        self.assertEqual(len(self.calls), 1)
+        self.wait_until_idle()
+
+
+@override_settings(LLM_FAKE_LATENCY=0.5, LLM_FAKE_LATENCY_JITTER=0, LLM_FAKE_SLOW_RATE=0, LLM_FAKE_TOKENS_PER_SECOND=0)
+class FakeModelTests(TestCase):
+
+    def test_answers_match_the_prompt(self):
+        questions = json.loads(fake.answer('m', 'Generate 3 multiple choice questions on topic "Heaps". '
+                                                 'Fields: "question_text", "correct_option".'))
+        self.assertEqual(len(questions), 3)
+        self.assertTrue(all(q['correct_option'] in 'ABCD' for q in questions))
+        self.assertIn('Heaps', questions[0]['question_text'])
+
+        topics = json.loads(fake.answer('m', 'List topics as "topic_name".\n---\n[Page 4]\nx\n[Page 5]\ny\n---'))
+        for t in topics:
+            self.assertTrue(4 <= t['start_page'] <= t['end_page'] <= 5)
+
+        plan = json.loads(fake.answer('m', 'Make a 3-day study plan, 2 hours per day, as "study_plan".'))
+        self.assertEqual([day['day'] for day in plan['study_plan']], [1, 2, 3])
+        self.assertEqual(fake.answer('m', 'anything else'), '[]')
+
+    def test_the_same_prompt_gets_the_same_answer(self):
+        prompt = 'Generate 2 multiple choice questions, "question_text".'
+        self.assertEqual(fake.answer('a', prompt), fake.answer('b', prompt))
+
+    def test_gives_up_when_the_timeout_is_shorter_than_the_latency(self):
+        model = fake.get_model('fake-model')
+        with mock.patch('llm.fake.time.sleep') as sleep:
+            with self.assertRaises(google_exceptions.DeadlineExceeded):
+                model.generate_content('prompt', request_options={'timeout': 0.1})
+            sleep.assert_called_once_with(0.1)
+            response = model.generate_content('prompt', request_options={'timeout': 1})
+        self.assertEqual(response.text, '[]')
@@ -0,0 +1,8 @@
+# llm/urls.py
+from django.urls import path
+from .views import LLMCacheStatsView, metrics_view
+
+urlpatterns = [
+    path('cache-stats/', LLMCacheStatsView.as_view(), name='llm-cache-stats'),
+    path('metrics/', metrics_view, name='llm-metrics'),
+]
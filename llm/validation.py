@@ -0,0 +1,58 @@
+"""
+Checking the items of an LLM answer against a pydantic schema.
+
+    from llm.validation import ItemValidator
+    TOPICS = ItemValidator(TopicSchema, 'topic')
+
+    topics, rejects = TOPICS.validate(items)
+
+The whole list goes through one pass of a TypeAdapter built once per
+schema. Items that do not fit are left out and returned as rejects (and
+printed), instead of failing the list: the caller keeps the good items
+and can ask the LLM again for the missing ones.
+"""
+from dataclasses import dataclass
+from typing import Annotated, Any
+
+from pydantic import TypeAdapter, ValidationError, WrapValidator
+
+
+@dataclass
+class Reject:
+    index: int
+    item: Any
+    errors: list
+
+
+class _Rejected:
+    def __init__(self, errors):
+        self.errors = errors
+
+
+def _keep_or_reject(value, handler):
+    try:
+        return handler(value)
+    except ValidationError as e:
+        return _Rejected(e.errors(include_url=False, include_input=False))
+
+
+class ItemValidator:
+    def __init__(self, schema, name='item'):
+        self.schema = schema
+        self.name = name
+        self._adapter = TypeAdapter(list[Annotated[schema, WrapValidator(_keep_or_reject)]])
+
+    def validate(self, items):
+        """Returns ([schema instance, ...], [Reject, ...])."""
+        if not isinstance(items, list):
+            items = [items]
+        valid, rejects = [], []
+        for index, result in enumerate(self._adapter.validate_python(items)):
+            if isinstance(result, _Rejected):
+                rejects.append(Reject(index, items[index], result.errors))
+            else:
+                valid.append(result)
+        for reject in rejects:
+            problems = '; '.join(f"{'.'.join(map(str, e['loc'])) or 'item'}: {e['msg']}" for e in reject.errors)
+            print(f"Rejected {self.name} #{reject.index} from LLM ({problems}): {str(reject.item)[:200]}")
+        return valid, rejects
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.permissions import IsAdminUser
+from rest_framework import status
+
+from . import cache, metrics
+
+
+class LLMCacheStatsView(APIView):
+    """
+    Reports the hit ratio and bytes saved by the LLM response cache (staff only).
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(cache.stats(), status=status.HTTP_200_OK)
+
+
+def metrics_view(request):
+    """
+    LLM call statistics in the Prometheus text format. Scrapers send
+    "Authorization: Bearer <LLM_METRICS_TOKEN>"; without a token set, only
+    staff users (logged in to the admin) can read it.
+    """
+    token = settings.LLM_METRICS_TOKEN
+    if token:
+        allowed = request.headers.get('Authorization') == f"Bearer {token}"
+    else:
+        allowed = request.user.is_authenticated and request.user.is_staff
+    if not allowed:
+        return HttpResponse('Forbidden\n', status=403, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
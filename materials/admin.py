@@ -1,6 +1,7 @@
 from django.contrib import admin
-from .models import Material,MaterialAccess
+from .models import Material,MaterialAccess,MaterialText
 # Register your models here.
 admin.site.register(Material)
 admin.site.register(MaterialAccess)
+admin.site.register(MaterialText)
   # Add your models here to register them with the admin site
\ No newline at end of file
@@ -0,0 +1,135 @@
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from materials.utils.pdf_text import EXTRACTORS, extract_pages, get_extractor
+from materials.utils.synthetic_pdf import make_pdf
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _measure_backend(path, backend):
+    """Runs in a fresh process so that peak RSS belongs to this backend only."""
+    extractor = get_extractor(backend)
+    start_rss = _peak_rss_mb()
+    start = time.perf_counter()
+    page_count = extractor.page_count(path)
+    pages = extractor.extract(path, range(1, page_count + 1))
+    elapsed = time.perf_counter() - start
+    return elapsed, page_count, sum(len(text) for text in pages), start_rss, _peak_rss_mb()
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks PDF text extraction on synthetic documents: pages/sec and peak "
+        "RSS per backend, and serial vs parallel extraction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--suite',
+            choices=['backends', 'parallel', 'all'],
+            default='all',
+            help="Which comparison to run.",
+        )
+        parser.add_argument(
+            '--pages',
+            type=int,
+            nargs='+',
+            default=[200, 400, 600],
+            help="Page counts of the generated PDFs.",
+        )
+        parser.add_argument(
+            '--backends',
+            nargs='+',
+            default=list(EXTRACTORS),
+            help="Extraction backends to compare.",
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            nargs='+',
+            default=[2, 4],
+            help="Worker counts to compare against serial extraction.",
+        )
+        parser.add_argument('--repeat', type=int, default=1, help="Runs per configuration (best time is kept).")
+
+    def handle(self, *args, **options):
+        paths = {}
+        try:
+            for page_count in options['pages']:
+                with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
+                    tmp.write(make_pdf(page_count))
+                paths[page_count] = tmp.name
+
+            if options['suite'] in ('backends', 'all'):
+                self.backend_suite(paths, options['backends'])
+            if options['suite'] in ('parallel', 'all'):
+                self.parallel_suite(paths, options['workers'], options['repeat'])
+        finally:
+            for path in paths.values():
+                os.remove(path)
+
+    def backend_suite(self, paths, backends):
+        header = f"{'pages':>6} {'backend':>12} {'seconds':>9} {'pages/s':>9} {'chars':>10} {'peak RSS':>10} {'+RSS':>8}"
+        self.stdout.write("\nBackends (one fresh process per run)")
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+
+        context = multiprocessing.get_context('spawn')
+        for page_count, path in paths.items():
+            for backend in backends:
+                with context.Pool(1) as pool:
+                    elapsed, pages, chars, start_rss, peak_rss = pool.apply(_measure_backend, (path, backend))
+                rss = f"{peak_rss:>8.1f}MB {peak_rss - start_rss:>6.1f}MB" if peak_rss is not None else f"{'n/a':>10} {'n/a':>8}"
+                self.stdout.write(
+                    f"{pages:>6} {backend:>12} {elapsed:>9.2f} {pages / elapsed:>9.1f} {chars:>10} {rss}"
+                )
+
+    def parallel_suite(self, paths, worker_counts, repeat):
+        header = f"{'pages':>6} {'workers':>8} {'seconds':>9} {'pages/s':>9} {'speedup':>8}"
+        self.stdout.write("\nSerial vs parallel (default backend)")
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+
+        for page_count, path in paths.items():
+            baseline, expected = self.measure(path, 1, repeat)
+            self.report(page_count, 1, baseline, baseline)
+
+            for workers in worker_counts:
+                # Warm the pool up so process start-up is not counted.
+                extract_pages(path, workers=workers)
+                elapsed, pages = self.measure(path, workers, repeat)
+                if pages != expected:
+                    self.stderr.write(f"Output mismatch with {workers} workers!")
+                self.report(page_count, workers, elapsed, baseline)
+
+    def measure(self, path, workers, repeat):
+        best, pages = None, None
+        for _ in range(max(1, repeat)):
+            start = time.perf_counter()
+            pages = extract_pages(path, workers=workers).pages
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, pages
+
+    def report(self, page_count, workers, elapsed, baseline):
+        label = 'serial' if workers == 1 else str(workers)
+        self.stdout.write(
+            f"{page_count:>6} {label:>8} {elapsed:>9.2f} {page_count / elapsed:>9.1f} {baseline / elapsed:>7.2f}x"
+        )
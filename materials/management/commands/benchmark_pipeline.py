@@ -0,0 +1,193 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import F
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from jobs.models import Job
+from jobs.queue import run_job
+from llm import metrics
+from materials.utils.synthetic_pdf import make_pdf
+from topic_analysis.models import Topic
+
+STAGES = ('upload', 'analysis', 'quiz', 'plan')
+
+
+class RequestFailed(Exception):
+    def __init__(self, response):
+        # Responses rejected by Django itself (e.g. DisallowedHost) have no `data`.
+        super().__init__(f"{response.status_code} {getattr(response, 'data', response.content[:200])}")
+
+
+def percentile(values, q):
+    """The q-th percentile (0-100) of `values`, nearest rank."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs upload -> analysis -> quiz -> plan for synthetic users and PDFs through the "
+        "real views and job handler, and reports throughput and p50/p95/p99 latency per "
+        "stage. Uses the fake Gemini and Drive backends unless --live is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help="Synthetic users.")
+        parser.add_argument('--pdfs', type=int, default=2, help="PDFs uploaded per user.")
+        parser.add_argument('--pages', type=int, default=20, help="Pages per generated PDF.")
+        parser.add_argument('--concurrency', type=int, default=4, help="Users running their pipeline at the same time.")
+        parser.add_argument('--days', type=int, default=7, help="Length of each study plan.")
+        parser.add_argument('--live', action='store_true', help="Use the configured Gemini and Drive backends.")
+        parser.add_argument('--keep', action='store_true', help="Keep the users and materials afterwards.")
+
+    def handle(self, *args, **options):
+        # APIClient sends its requests to the host 'testserver'.
+        overrides = {'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver']}
+        if not options['live']:
+            overrides.update(LLM_BACKEND='fake', DRIVE_BACKEND='fake')
+        self.run_id = uuid.uuid4().hex[:8]
+        self.options = options
+        self.timings = {stage: [] for stage in STAGES}   # (start, end, ok)
+        self.jobs = {}                                     # material id -> analysis job id
+        self.errors = []
+        self._lock = threading.Lock()
+
+        with override_settings(**overrides):
+            users = [
+                User.objects.create_user(username=f"bench-{self.run_id}-{n}", password=uuid.uuid4().hex)
+                for n in range(options['users'])
+            ]
+            metrics.reset()
+            start = time.perf_counter()
+            try:
+                with ThreadPoolExecutor(max_workers=max(1, options['concurrency'])) as pool:
+                    list(pool.map(self.run_user, enumerate(users)))
+                elapsed = time.perf_counter() - start
+                self.report(elapsed)
+            finally:
+                if not options['keep']:
+                    self.clean_up(users)
+
+    def timed(self, stage, func, *args):
+        """Runs one operation of `stage`; returns its result, or None if it failed."""
+        started = time.perf_counter()
+        try:
+            result = func(*args)
+        except Exception as e:
+            result = None
+            with self._lock:
+                self.errors.append(f"{stage}: {e}")
+        with self._lock:
+            self.timings[stage].append((started, time.perf_counter(), result is not None))
+        return result
+
+    def run_user(self, numbered_user):
+        number, user = numbered_user
+        client = APIClient()
+        client.force_authenticate(user)
+        try:
+            materials = []
+            for n in range(self.options['pdfs']):
+                seed = int(self.run_id, 16) + number * self.options['pdfs'] + n  # distinct PDFs, no dedupe
+                material_id = self.timed('upload', self.upload, client, number, n, seed)
+                if material_id and self.timed('analysis', self.analyze, material_id):
+                    materials.append(material_id)
+
+            for material_id in materials:
+                topic = Topic.objects.filter(material_id=material_id).order_by('sequence_number').first()
+                if topic is not None:
+                    self.timed('quiz', self.quiz, client, topic.id)
+            if materials:
+                self.timed('plan', self.plan, client, materials)
+        finally:
+            connection.close()
+
+    def upload(self, client, number, n, seed):
+        pdf = SimpleUploadedFile(f"bench-{number}-{n}.pdf", make_pdf(self.options['pages'], seed=seed), 'application/pdf')
+        response = client.post('/api/upload/', {'file': pdf, 'subject': f"Subject {n + 1}"}, format='multipart')
+        if response.status_code != 202:
+            raise RequestFailed(response)
+        with self._lock:
+            self.jobs[response.data['material_id']] = response.data['job_id']
+        return response.data['material_id']
+
+    def analyze(self, material_id):
+        # Claimed and run here instead of by `run_worker`, so the time is the analysis alone.
+        job_id = self.jobs[material_id]
+        Job.objects.filter(id=job_id, status=Job.STATUS_QUEUED).update(
+            status=Job.STATUS_RUNNING,
+            attempts=F('attempts') + 1,
+            locked_by=f"benchmark-{self.run_id}",
+            locked_at=timezone.now(),
+        )
+        job = Job.objects.get(id=job_id)
+        if not run_job(job):
+            raise RuntimeError(job.last_error.splitlines()[0])
+        return True
+
+    def quiz(self, client, topic_id):
+        response = client.post(f'/api/quiz/generate/{topic_id}/')
+        if response.status_code != 200:
+            raise RequestFailed(response)
+        return True
+
+    def plan(self, client, material_ids):
+        response = client.post(
+            '/api/timetable/generate-plan/',
+            {'material_ids': material_ids, 'totalDays': self.options['days'], 'hoursPerDay': 2},
+            format='json',
+        )
+        if response.status_code != 200:
+            raise RequestFailed(response)
+        return True
+
+    def report(self, elapsed):
+        o = self.options
+        self.stdout.write(
+            f"\n{o['users']} users x {o['pdfs']} PDFs of {o['pages']} pages, "
+            f"concurrency {o['concurrency']}: {elapsed:.2f}s"
+        )
+        header = f"{'stage':>9} {'ops':>5} {'errors':>6} {'ops/s':>8} {'p50 (s)':>8} {'p95 (s)':>8} {'p99 (s)':>8}"
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+        for stage in STAGES:
+            timings = self.timings[stage]
+            if not timings:
+                self.stdout.write(f"{stage:>9} {0:>5}")
+                continue
+            latencies = [end - start for start, end, _ in timings]
+            span = max(end for _, end, _ in timings) - min(start for start, _, _ in timings)
+            failed = sum(1 for *_, ok in timings if not ok)
+            self.stdout.write(
+                f"{stage:>9} {len(timings):>5} {failed:>6} {len(timings) / span if span else 0:>8.2f} "
+                f"{percentile(latencies, 50):>8.3f} {percentile(latencies, 95):>8.3f} {percentile(latencies, 99):>8.3f}"
+            )
+
+        rows = metrics.snapshot()
+        if rows:
+            calls = sum(row['calls'] for row in rows)
+            prompt_tokens = sum(row['prompt_tokens'] for row in rows)
+            response_tokens = sum(row['response_tokens'] for row in rows)
+            self.stdout.write(f"\nLLM: {calls} calls, {prompt_tokens} prompt / {response_tokens} response tokens")
+        for error in self.errors[:10]:
+            self.stderr.write(error)
+        if len(self.errors) > 10:
+            self.stderr.write(f"... and {len(self.errors) - 10} more errors")
+
+    def clean_up(self, users):
+        for user in users:
+            client = APIClient()
+            client.force_authenticate(user)
+            for material_id in user.materialaccess_set.values_list('material_id', flat=True):
+                client.delete(f'/api/upload/delete/{material_id}/')
+            user.delete()
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.24 on 2026-10-18 11:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0002_material_download_url_material_subject_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterialText',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_count', models.PositiveIntegerField()),
+                ('char_count', models.PositiveIntegerField(default=0)),
+                ('extracted_at', models.DateTimeField(auto_now=True)),
+                ('material', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='text', to='materials.material')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MaterialTextPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_number', models.PositiveIntegerField(help_text='1-based page number in the PDF.')),
+                ('content', models.BinaryField(help_text='zlib-compressed UTF-8 text of the page.')),
+                ('content_sha256', models.CharField(help_text='SHA-256 of the uncompressed page text.', max_length=64)),
+                ('char_count', models.PositiveIntegerField(default=0)),
+                ('material_text', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='materials.materialtext')),
+            ],
+            options={
+                'ordering': ['page_number'],
+                'unique_together': {('material_text', 'page_number')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.24 on 2026-10-18 11:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0003_materialtext_materialtextpage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='materialtext',
+            name='backend',
+            field=models.CharField(blank=True, help_text="Extraction backend(s) used, e.g. 'pypdfium2' or 'pypdfium2+pdfplumber'.", max_length=50),
+        ),
+        migrations.AddField(
+            model_name='materialtext',
+            name='fallback_page_count',
+            field=models.PositiveIntegerField(default=0, help_text='Pages that had to be re-extracted with the fallback backend.'),
+        ),
+    ]
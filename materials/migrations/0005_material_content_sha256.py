@@ -0,0 +1,18 @@
+# Generated by Django 4.2.24 on 2026-10-18 11:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0004_materialtext_backend_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='material',
+            name='content_sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
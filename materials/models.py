@@ -7,11 +7,20 @@ class Material(models.Model):
     drive_file_id = models.CharField(max_length=255, unique=True)
     view_url = models.URLField(max_length=500, blank=True, null=True)
     download_url = models.URLField(max_length=500, blank=True, null=True)
+    # SHA-256 of the PDF, so a file someone already uploaded is shared instead of uploaded again
+    content_sha256 = models.CharField(max_length=64, blank=True, db_index=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"{self.title} ({self.subject})"
 
+    @classmethod
+    def find_by_content(cls, sha256):
+        """The earliest material with exactly this content, or None."""
+        if not sha256:
+            return None
+        return cls.objects.filter(content_sha256=sha256).order_by('id').first()
+
 
 class MaterialAccess(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -23,3 +32,42 @@ class MaterialAccess(models.Model):
 
     def __str__(self):
         return f"{self.user.username} → {self.material.title}"
+
+
+class MaterialText(models.Model):
+    """
+    The extracted text of a Material, stored once so that pdfplumber only
+    has to run over the PDF a single time. The text itself lives in
+    MaterialTextPage rows, one per PDF page.
+    """
+    material = models.OneToOneField(Material, on_delete=models.CASCADE, related_name='text')
+    page_count = models.PositiveIntegerField()
+    char_count = models.PositiveIntegerField(default=0)
+    backend = models.CharField(
+        max_length=50,
+        blank=True,
+        help_text="Extraction backend(s) used, e.g. 'pypdfium2' or 'pypdfium2+pdfplumber'."
+    )
+    fallback_page_count = models.PositiveIntegerField(
+        default=0,
+        help_text="Pages that had to be re-extracted with the fallback backend."
+    )
+    extracted_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Text of {self.material.title} ({self.page_count} pages)"
+
+
+class MaterialTextPage(models.Model):
+    material_text = models.ForeignKey(MaterialText, on_delete=models.CASCADE, related_name='pages')
+    page_number = models.PositiveIntegerField(help_text="1-based page number in the PDF.")
+    content = models.BinaryField(help_text="zlib-compressed UTF-8 text of the page.")
+    content_sha256 = models.CharField(max_length=64, help_text="SHA-256 of the uncompressed page text.")
+    char_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['page_number']
+        unique_together = ('material_text', 'page_number')
+
+    def __str__(self):
+        return f"Page {self.page_number} of {self.material_text.material.title}"
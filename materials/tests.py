@@ -1,3 +1,597 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from backend import circuit_breaker
+from jobs.models import Job
+from jobs.queue import claim_next, run_job
+from topic_analysis.models import Topic
+
+from .models import Material, MaterialAccess, MaterialText, MaterialTextPage
+from .upload_handlers import DriveUploadHandler, _DriveSender
+from .utils import blob_cache, drive_api, fake_drive, pdf_text, retrieval, text_store, vector_index
+from .utils.fake_drive_server import FakeDriveServer
+from .utils.pdf_text import ExtractedText, extract_pages
+from .utils.resumable_upload import ResumableUpload
+from .utils.synthetic_pdf import make_pdf
+
+
+class FakeBackendsMixin:
+    """Runs the test against the fake Gemini and Drive, with its own cache and index directories."""
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        overrides = override_settings(
+            LLM_BACKEND='fake',
+            LLM_CACHE_ENABLED=False,
+            LLM_FAKE_LATENCY=0,
+            LLM_FAKE_LATENCY_JITTER=0,
+            LLM_FAKE_TOKENS_PER_SECOND=0,
+            DRIVE_BACKEND='fake',
+            FAKE_DRIVE_LATENCY=0,
+            FAKE_DRIVE_DIR=f"{self.tmp}/drive",
+            PDF_CACHE_DIR=f"{self.tmp}/pdf_cache",
+            RETRIEVAL_INDEX_DIR=f"{self.tmp}/retrieval",
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        # Breakers are per process; start every test with closed ones.
+        circuit_breaker._breakers.clear()
+
+    def login(self, username='student'):
+        self.user = User.objects.create_user(username=username, password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        return self.user
+
+    def upload(self, name='notes.pdf', pages=4, seed=1, **extra):
+        pdf = SimpleUploadedFile(name, make_pdf(pages, seed=seed), 'application/pdf')
+        return self.client.post('/api/upload/', {'file': pdf, 'subject': 'Algorithms'}, format='multipart', **extra)
+
+
+class UploadAnalysisTests(FakeBackendsMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.login()
+
+    def test_upload_stores_the_text_and_the_pdf_locally(self):
+        response = self.upload(pages=3)
+        self.assertEqual(response.status_code, 202, response.data)
+        material = Material.objects.get(id=response.data['material_id'])
+
+        material_text = MaterialText.objects.get(material=material)
+        self.assertEqual(material_text.page_count, 3)
+        self.assertIn("Chapter", text_store.read_text(material))
+        self.assertIsNotNone(blob_cache.lookup(material.drive_file_id))
+
+    def test_analysis_uses_the_uploaded_text_without_downloading_the_pdf(self):
+        response = self.upload(pages=3)
+        job = claim_next('test')
+        with mock.patch.object(blob_cache, 'fetch', side_effect=AssertionError("PDF fetched again")):
+            self.assertTrue(run_job(job), job.last_error)
+        self.assertTrue(Topic.objects.filter(material_id=response.data['material_id']).exists())
+
+
+class DeduplicationTests(FakeBackendsMixin, TestCase):
+
+    def drive_files(self):
+        return sorted(os.listdir(f"{self.tmp}/drive"))
+
+    def test_duplicate_upload_reuses_the_material_without_a_drive_file(self):
+        self.login('alice')
+        first = self.upload(seed=7)
+        self.assertEqual(first.status_code, 202, first.data)
+        stored = self.drive_files()
+
+        self.login('bob')
+        with mock.patch.object(fake_drive.ResumableUpload, 'finish', autospec=True,
+                               side_effect=fake_drive.ResumableUpload.finish) as finish, \
+                mock.patch.object(_DriveSender, 'close', autospec=True) as close:
+            second = self.upload(seed=7)
+        self.assertEqual(second.status_code, 200, second.data)
+        self.assertTrue(second.data['duplicate'])
+        self.assertEqual(second.data['material_id'], first.data['material_id'])
+        close.assert_not_called()  # aborted, never completed
+        finish.assert_not_called()
+        self.assertEqual(self.drive_files(), stored)  # no new file, no leftover .part
+        self.assertEqual(Material.objects.count(), 1)
+        self.assertTrue(MaterialAccess.objects.filter(user=self.user, material_id=first.data['material_id']).exists())
+
+    def test_client_hash_skips_the_drive_upload(self):
+        self.login('alice')
+        first = self.upload(seed=7)
+        material = Material.objects.get(id=first.data['material_id'])
+
+        self.login('bob')
+        with mock.patch.object(fake_drive, 'ResumableUpload', side_effect=AssertionError("streamed to Drive")):
+            second = self.upload(seed=7, HTTP_X_CONTENT_SHA256=material.content_sha256)
+        self.assertEqual(second.status_code, 200, second.data)
+        self.assertTrue(second.data['duplicate'])
+
+
+class BulkUploadTests(FakeBackendsMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.login()
+
+    def pdf(self, name, seed):
+        return SimpleUploadedFile(name, make_pdf(2, seed=seed), 'application/pdf')
+
+    def bulk_upload(self, *files):
+        return self.client.post('/api/upload/bulk/', {'files': list(files), 'subject': 'Algorithms'}, format='multipart')
+
+    def test_results_follow_request_order_and_repeats_share_a_material(self):
+        response = self.bulk_upload(self.pdf('a.pdf', 1), self.pdf('b.pdf', 2), self.pdf('a-again.pdf', 1))
+        self.assertEqual(response.status_code, 202, response.data)
+        results = response.data['results']
+        self.assertEqual([r['file'] for r in results], ['a.pdf', 'b.pdf', 'a-again.pdf'])
+        self.assertEqual([r['status'] for r in results], ['uploaded', 'uploaded', 'duplicate'])
+        self.assertEqual(results[0]['material_id'], results[2]['material_id'])
+        self.assertIsNone(results[2]['job_id'])
+        self.assertEqual(Material.objects.count(), 2)
+        self.assertEqual(Job.objects.filter(kind='analyze_material').count(), 2)
+        self.assertEqual(MaterialAccess.objects.filter(user=self.user).count(), 2)
+
+    def test_existing_content_is_not_uploaded_again(self):
+        self.bulk_upload(self.pdf('a.pdf', 1))
+        with mock.patch('materials.views.upload_file_to_drive') as upload:
+            response = self.bulk_upload(self.pdf('copy.pdf', 1))
+        upload.assert_not_called()
+        self.assertEqual(response.data['results'][0]['status'], 'duplicate')
+
+    @override_settings(BULK_UPLOAD_CONCURRENCY=2)
+    def test_transfers_run_concurrently_up_to_the_limit(self):
+        real_upload = fake_drive.upload
+        lock = threading.Lock()
+        in_flight = []
+        peak = []
+
+        def slow_upload(source, filename):
+            with lock:
+                in_flight.append(filename)
+                peak.append(len(in_flight))
+            time.sleep(0.05)
+            with lock:
+                in_flight.remove(filename)
+            return real_upload(source, filename)
+
+        with mock.patch.object(fake_drive, 'upload', side_effect=slow_upload):
+            response = self.bulk_upload(*[self.pdf(f"{i}.pdf", i) for i in range(5)])
+        self.assertEqual(response.status_code, 202, response.data)
+        self.assertEqual(max(peak), 2)
+
+    def test_a_failed_file_is_reported_without_failing_the_others(self):
+        real_upload = fake_drive.upload
+
+        def upload(source, filename):
+            return None if filename == 'bad.pdf' else real_upload(source, filename)
+
+        with mock.patch.object(fake_drive, 'upload', side_effect=upload):
+            response = self.bulk_upload(self.pdf('good.pdf', 1), self.pdf('bad.pdf', 2))
+        self.assertEqual(response.status_code, 207, response.data)
+        self.assertEqual([r['status'] for r in response.data['results']], ['uploaded', 'failed'])
+        self.assertEqual(Material.objects.count(), 1)
+
+    @override_settings(BULK_UPLOAD_MAX_FILES=2)
+    def test_too_many_files_are_rejected(self):
+        response = self.bulk_upload(*[self.pdf(f"{i}.pdf", i) for i in range(3)])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Material.objects.exists())
+
+
+class BlobCacheTests(FakeBackendsMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()  # the hit/miss counters
+
+    def age(self, path, seconds):
+        then = time.time() - seconds
+        os.utime(path, (then, then))
+
+    @override_settings(PDF_CACHE_MAX_BYTES=250)
+    def test_least_recently_used_files_are_evicted_over_the_cap(self):
+        a = blob_cache.put('a', b'a' * 100)
+        b = blob_cache.put('b', b'b' * 100)
+        self.age(a, 30)
+        self.age(b, 20)
+        self.assertEqual(blob_cache.lookup('a'), a)  # a hit makes `a` the most recent
+
+        blob_cache.put('c', b'c' * 100)
+        self.assertIsNone(blob_cache.lookup('b'))
+        self.assertIsNotNone(blob_cache.lookup('a'))
+        self.assertIsNotNone(blob_cache.lookup('c'))
+        self.assertEqual(blob_cache.stats()['evictions'], 1)
+
+    @override_settings(PDF_CACHE_MAX_BYTES=250, PDF_CACHE_STAGED_MAX_AGE=60)
+    def test_staged_uploads_count_toward_the_cap(self):
+        writer = blob_cache.CacheWriter()
+        writer.write(b's' * 100)
+        writer.open_staged().close()  # flushes the staged bytes
+        blob_cache.put('a', b'a' * 100)
+        self.assertEqual(blob_cache.stats()['bytes'], 200)
+
+        blob_cache.put('b', b'b' * 100)
+        self.assertIsNone(blob_cache.lookup('a'))
+
+        self.age(writer.tmp_path, 120)  # abandoned: deleted on the next eviction pass
+        blob_cache.put('c', b'c' * 100)
+        self.assertFalse(os.path.exists(writer.tmp_path))
+        self.assertEqual(blob_cache.stats()['staged_files'], 0)
+
+    def test_fetch_counts_hits_and_misses(self):
+        drive_file = fake_drive.upload(io.BytesIO(b'%PDF-1.4 remote'), 'remote.pdf')
+        material = Material.objects.create(title='remote.pdf', subject='S', drive_file_id=drive_file['id'])
+
+        path = blob_cache.fetch(material)   # miss: downloaded from (fake) Drive
+        self.assertEqual(path.read_bytes(), b'%PDF-1.4 remote')
+        self.assertEqual(blob_cache.fetch(material), path)
+        stats = blob_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_ratio']), (1, 1, 0.5))
+
+    def test_new_content_replaces_the_old_copy_and_invalidate_removes_it(self):
+        old = blob_cache.put('a', b'old')
+        new = blob_cache.put('a', b'new')
+        self.assertNotEqual(old, new)
+        self.assertFalse(old.exists())
+        self.assertEqual(blob_cache.lookup('a'), new)
+
+        blob_cache.invalidate('a')
+        self.assertIsNone(blob_cache.lookup('a'))
+        self.assertEqual(blob_cache.stats()['files'], 0)
+
+
+class TextStoreTests(FakeBackendsMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.material = Material.objects.create(title='notes.pdf', subject='S', drive_file_id='drive-1')
+
+    def save(self, pages):
+        return text_store.save_pages(self.material, ExtractedText(pages=pages, backend='pypdfium2'))
+
+    def test_pages_are_stored_compressed_and_read_back_by_range(self):
+        pages = ["first page " * 50, "", "third page", "fourth page"]
+        material_text = self.save(pages)
+        self.assertEqual((material_text.page_count, material_text.char_count), (4, sum(map(len, pages))))
+
+        row = MaterialTextPage.objects.get(material_text=material_text, page_number=1)
+        self.assertLess(len(bytes(row.content)), len(pages[0]))
+        self.assertEqual(zlib.decompress(bytes(row.content)).decode(), pages[0])
+
+        self.assertEqual(text_store.read_pages(self.material, 3, 4), [(3, "third page"), (4, "fourth page")])
+        self.assertEqual(text_store.read_pages(self.material, numbers=[1, 4])[1], (4, "fourth page"))
+        self.assertEqual(text_store.read_text(self.material, start=2), "third page\nfourth page")
+        self.assertEqual(text_store.page_hashes(self.material)[3], text_store.page_hash("third page"))
+
+    def test_saving_again_replaces_the_stored_text(self):
+        self.save(["old one", "old two"])
+        self.save(["new"])
+        self.assertEqual(text_store.read_pages(self.material), [(1, "new")])
+        self.assertEqual(MaterialText.objects.filter(material=self.material).count(), 1)
+
+    def test_ensure_pages_extracts_only_once(self):
+        blob_cache.put(self.material.drive_file_id, make_pdf(2, seed=3))
+        with mock.patch.object(text_store, 'extract_pages', wraps=text_store.extract_pages) as extract:
+            first = text_store.ensure_pages(self.material)
+            second = text_store.ensure_pages(self.material)
+        self.assertEqual(extract.call_count, 1)
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(first.page_count, 2)
+
+
+class ParallelExtractionTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.pdf = make_pdf(6, seed=5)
+
+    @override_settings(PDF_PARALLEL_MIN_PAGES=2)
+    def test_parallel_extraction_matches_a_single_process(self):
+        expected = extract_pages(self.pdf, workers=1)
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as f:
+            f.write(self.pdf)
+            f.flush()
+            from_path = extract_pages(f.name, workers=2)
+        from_bytes = extract_pages(self.pdf, workers=2)  # spilled to a temp file for the workers
+
+        self.assertEqual(len(expected.pages), 6)
+        self.assertEqual(from_path.pages, expected.pages)
+        self.assertEqual(from_bytes.pages, expected.pages)
+
+    @override_settings(PDF_PARALLEL_MIN_PAGES=100)
+    def test_small_documents_stay_in_process(self):
+        with mock.patch.object(pdf_text, '_extract_parallel') as parallel:
+            extract_pages(self.pdf, workers=4)
+        parallel.assert_not_called()
+
+
+class ExtractionBackendTests(TestCase):
+
+    def test_garbled_pages(self):
+        self.assertTrue(pdf_text.looks_garbled("   \n"))
+        self.assertTrue(pdf_text.looks_garbled("ab���"))
+        self.assertFalse(pdf_text.looks_garbled("Binary search trees\n"))
+
+    def test_backends_extract_the_same_text(self):
+        pdf = make_pdf(2, seed=7)
+        pdfium = extract_pages(pdf, workers=1, backend='pypdfium2', fallback='')
+        plumber = extract_pages(pdf, workers=1, backend='pdfplumber', fallback='')
+        self.assertEqual((pdfium.backend, plumber.backend), ('pypdfium2', 'pdfplumber'))
+        for a, b in zip(pdfium.pages, plumber.pages):
+            self.assertEqual(a.splitlines()[0].split(), b.splitlines()[0].split())  # the chapter heading
+
+    def test_only_garbled_pages_go_to_the_fallback(self):
+        pdf = make_pdf(3, seed=7)
+        real = pdf_text.EXTRACTORS['pypdfium2'].extract
+
+        def garble_page_two(source, numbers):
+            return ["�" * 20 if number == 2 else text for number, text in zip(numbers, real(source, numbers))]
+
+        with mock.patch.object(pdf_text.EXTRACTORS['pypdfium2'], 'extract', side_effect=garble_page_two), \
+                mock.patch.object(pdf_text.EXTRACTORS['pdfplumber'], 'extract', wraps=pdf_text.EXTRACTORS['pdfplumber'].extract) as fallback:
+            extracted = extract_pages(pdf, workers=1, backend='pypdfium2', fallback='pdfplumber')
+
+        self.assertEqual(list(fallback.call_args.args[1]), [2])
+        self.assertEqual(extracted.fallback_pages, [2])
+        self.assertEqual(extracted.backend, 'pypdfium2+pdfplumber')
+        self.assertIn("Chapter", extracted.pages[1])
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            pdf_text.get_extractor('nope')
+
+
+class StreamingExtractionTests(FakeBackendsMixin, TestCase):
+
+    def test_iter_pages_yields_the_same_pages_one_by_one(self):
+        pdf = make_pdf(4, seed=9)
+        streamed = list(pdf_text.iter_pages(pdf, max_rss_mb=0))
+        self.assertEqual([number for number, _, _ in streamed], [1, 2, 3, 4])
+        self.assertEqual([text for _, text, _ in streamed], extract_pages(pdf, workers=1).pages)
+
+    def test_extraction_stops_over_the_memory_ceiling(self):
+        with mock.patch.object(pdf_text, '_current_rss_mb', return_value=4096):
+            pages = pdf_text.iter_pages(make_pdf(3, seed=9), max_rss_mb=100)
+            with self.assertRaises(pdf_text.ExtractionMemoryError):
+                list(pages)
+
+    @override_settings(PDF_STREAM_THRESHOLD_BYTES=1)
+    def test_large_files_are_streamed_into_the_store(self):
+        material = Material.objects.create(title='big.pdf', subject='S', drive_file_id='drive-big')
+        blob_cache.put(material.drive_file_id, make_pdf(3, seed=9))
+        with mock.patch.object(text_store, 'extract_pages', side_effect=AssertionError("loaded whole")):
+            material_text = text_store.ensure_pages(material)
+        self.assertEqual(material_text.page_count, 3)
+        self.assertEqual(len(text_store.read_pages(material)), 3)
+
+
+class ResumableUploadTests(TestCase):
+    """Chunked uploads against the local fake of Drive's resumable endpoint."""
+
+    chunk_size = 256 * 1024
+
+    def setUp(self):
+        self.server = FakeDriveServer().start()
+        self.addCleanup(self.server.stop)
+        sleep = mock.patch('materials.utils.resumable_upload.time.sleep')
+        sleep.start()
+        self.addCleanup(sleep.stop)
+        circuit_breaker._breakers.clear()
+
+    def new_upload(self, **kwargs):
+        session = requests.Session()
+        session.trust_env = False  # no proxies for localhost
+        return ResumableUpload('notes.pdf', session=session, upload_url=self.server.upload_url,
+                               chunk_size=self.chunk_size, **kwargs)
+
+    def test_dropped_chunks_resume_from_the_acknowledged_offset(self):
+        self.server.drop_every = 2
+        data = os.urandom(self.chunk_size * 4 + 1000)
+        progress = []
+        upload = self.new_upload(on_progress=lambda done, total: progress.append(done))
+        upload.start()
+        for start in range(0, len(data), 100_000):
+            upload.write(data[start:start + 100_000])
+        metadata = upload.finish()
+
+        self.assertGreater(self.server.dropped, 0)
+        self.assertEqual(self.server.files[metadata['id']], data)
+        self.assertEqual(upload.offset, len(data))
+        self.assertEqual(upload.total, len(data))
+        self.assertEqual(progress, sorted(progress))
+
+    def test_empty_file(self):
+        upload = self.new_upload()
+        upload.start()
+        metadata = upload.finish()
+        self.assertEqual(self.server.files[metadata['id']], b'')
+
+    def test_cancelled_upload_is_not_completed(self):
+        sender = _DriveSender(self.new_upload())
+        for _ in range(3):
+            sender.put(os.urandom(self.chunk_size))
+        self.assertIsNone(sender.cancel())
+        self.assertIsNone(sender.error)
+        self.assertEqual(self.server.files, {})
+        self.assertEqual(self.server.sessions, {})  # the session was deleted
+
+    def test_interrupted_upload_deletes_a_file_already_created(self):
+        handler = DriveUploadHandler(mock.Mock(META={}, user=None))
+        handler.active = True
+        handler.writer = mock.Mock()
+        handler.sender = mock.Mock(**{'cancel.return_value': {'id': 'fake-9'}})
+        with mock.patch('materials.upload_handlers.delete_file_from_drive') as delete:
+            handler.upload_interrupted()
+        delete.assert_called_once_with('fake-9')
+        handler.writer.discard.assert_called_once()
+
+
+@override_settings(DRIVE_BACKEND='google')
+class DriveClientTests(TestCase):
+
+    def setUp(self):
+        circuit_breaker._breakers.clear()
+        self.addCleanup(drive_api._local.__dict__.clear)
+        drive_api._local.__dict__.clear()
+
+    def test_client_is_built_once_per_thread(self):
+        with mock.patch.object(drive_api, 'get_credentials'), \
+                mock.patch.object(drive_api, 'build', side_effect=lambda *a, **k: mock.Mock()) as build:
+            first = drive_api.get_drive_service()
+            self.assertIs(drive_api.get_drive_service(), first)
+
+            other = []
+            thread = threading.Thread(target=lambda: other.append(drive_api.get_drive_service()))
+            thread.start()
+            thread.join()
+        self.assertIsNot(other[0], first)
+        self.assertEqual(build.call_count, 2)
+
+    def test_credentials_are_refreshed_only_when_expired(self):
+        credentials = mock.Mock(valid=True)
+        with mock.patch.object(drive_api, '_credentials', credentials):
+            drive_api.get_credentials()
+            credentials.refresh.assert_not_called()
+            credentials.valid = False
+            drive_api.get_credentials()
+            credentials.refresh.assert_called_once()
+
+    def test_public_url_batches_the_permission_and_the_metadata_fetch(self):
+        service = mock.Mock()
+        batch = service.new_batch_http_request.return_value
+
+        def execute():
+            callback = service.new_batch_http_request.call_args.kwargs['callback']
+            callback('permission', {}, None)
+            callback('file', {'webViewLink': 'view', 'webContentLink': 'download'}, None)
+        batch.execute.side_effect = execute
+
+        with mock.patch.object(drive_api, 'get_drive_service', return_value=service):
+            urls = drive_api.generate_public_url('file-1')
+        self.assertEqual(urls, {'view_url': 'view', 'download_url': 'download'})
+        self.assertEqual(batch.add.call_count, 2)
+        batch.execute.assert_called_once()
+
+    def test_public_url_reuses_the_upload_metadata(self):
+        service = mock.Mock()
+        metadata = {'id': 'file-1', 'webViewLink': 'view', 'webContentLink': 'download'}
+        with mock.patch.object(drive_api, 'get_drive_service', return_value=service):
+            urls = drive_api.generate_public_url('file-1', metadata)
+        self.assertEqual(urls, {'view_url': 'view', 'download_url': 'download'})
+        service.permissions.return_value.create.return_value.execute.assert_called_once()
+        service.new_batch_http_request.assert_not_called()
+        service.files.return_value.get.assert_not_called()
+
+
+@override_settings(RETRIEVAL_PASSAGE_CHARS=200)
+class RetrievalTests(FakeBackendsMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.material = Material.objects.create(title='notes.pdf', subject='S', drive_file_id='drive-1')
+        filler = "general remarks about programming languages and their history\n"
+        self.pages = [
+            filler * 3,
+            "Binary search trees keep their keys sorted.\n\nA binary search halves the range each step.\n",
+            filler + "Heaps give the minimum in constant time.\n",
+            filler * 2 + "Hash tables map keys to buckets.\n",
+        ]
+        text_store.save_pages(self.material, ExtractedText(pages=self.pages, backend='pypdfium2'))
+
+    def test_passages_split_at_paragraphs_within_the_size(self):
+        text = ("x" * 60 + "\n") * 3 + "\n" + ("y" * 60 + "\n") * 3
+        spans = retrieval.split_passages(text, max_chars=200)
+        self.assertEqual(len(spans), 2)
+        self.assertTrue(text[slice(*spans[1])].lstrip().startswith('y'))
+        self.assertTrue(all(end - start <= 200 for start, end in spans))
+
+    def test_best_matching_passage_comes_first_with_its_text(self):
+        passages = retrieval.top_passages(self.material, "binary search", k=3)
+        self.assertEqual(passages[0].page, 2)
+        self.assertIn("binary search", passages[0].text.lower())
+        self.assertEqual([p.score for p in passages], sorted((p.score for p in passages), reverse=True))
+        self.assertTrue(all(p.score > 0 for p in passages))
+
+    def test_unmatched_and_stop_words_find_nothing(self):
+        self.assertEqual(retrieval.top_passages(self.material, "quantum chromodynamics"), [])
+        self.assertEqual(retrieval.top_passages(self.material, "the and with"), [])
+
+    def test_k_and_the_token_budget_limit_the_passages(self):
+        self.assertEqual(len(retrieval.top_passages(self.material, "keys remarks", k=1)), 1)
+        passages = retrieval.top_passages(self.material, "keys remarks", k=10, token_budget=20)
+        self.assertLessEqual(sum(len(p.text) // retrieval.CHARS_PER_TOKEN + 1 for p in passages), 20)
+
+    def test_missing_index_is_rebuilt_and_a_new_one_reloaded(self):
+        retrieval.delete_index(self.material.id)
+        self.assertEqual(retrieval.top_passages(self.material, "heaps", k=1)[0].page, 3)
+
+        self.pages[3] += "Heaps are also used for priority queues of heaps.\n"
+        text_store.save_pages(self.material, ExtractedText(pages=self.pages, backend='pypdfium2'))
+        self.assertEqual(retrieval.top_passages(self.material, "heaps", k=1)[0].page, 4)
+
+    def test_vector_search_returns_the_matching_passage(self):
+        hits = vector_index.search([self.material], "hash tables buckets", k=2)
+        self.assertEqual(hits[0].page, 4)
+        self.assertIn("Hash tables", hits[0].snippet)
+
+
+class FakeDriveTests(FakeBackendsMixin, TestCase):
+
+    def test_upload_download_and_delete(self):
+        metadata = fake_drive.upload(io.BytesIO(b'%PDF-1.4 data'), 'notes.pdf')
+        self.assertEqual(metadata['name'], 'notes.pdf')
+        self.assertEqual(b''.join(fake_drive.download(metadata['id'])), b'%PDF-1.4 data')
+        self.assertEqual(fake_drive.public_urls(metadata['id'])['view_url'], metadata['webViewLink'])
+
+        fake_drive.delete(metadata['id'])
+        self.assertIsNone(fake_drive.public_urls(metadata['id']))
+        with self.assertRaises(FileNotFoundError):
+            b''.join(fake_drive.download(metadata['id']))
+
+    def test_resumable_upload_finishes_or_leaves_nothing(self):
+        progress = []
+        upload = fake_drive.ResumableUpload('notes.pdf', on_progress=lambda done, total: progress.append(done))
+        upload.start()
+        upload.write(b'abc')
+        upload.write(b'def')
+        metadata = upload.finish()
+        self.assertEqual(b''.join(fake_drive.download(metadata['id'])), b'abcdef')
+        self.assertEqual(progress[-1], 6)
+
+        aborted = fake_drive.ResumableUpload('other.pdf')
+        aborted.start()
+        aborted.write(b'abc')
+        aborted.abort()
+        self.assertEqual(sorted(os.listdir(f"{self.tmp}/drive")), [f"{metadata['id']}.pdf"])
+
+
+class BenchmarkPipelineTests(FakeBackendsMixin, TransactionTestCase):
+    # The command runs each user's pipeline on a worker thread with its own connection.
+
+    @override_settings(ALLOWED_HOSTS=[])  # as in backend/settings.py; the test runner adds 'testserver'
+    def test_runs_every_stage_without_errors(self):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('benchmark_pipeline', users=1, pdfs=1, pages=3, days=2, concurrency=1, stdout=out, stderr=err)
+        self.assertEqual(err.getvalue(), '')
+        for stage in ('upload', 'analysis', 'quiz', 'plan'):
+            self.assertRegex(out.getvalue(), rf'{stage}\s+1\s+0\s')
+        self.assertFalse(User.objects.filter(username__startswith='bench-').exists())
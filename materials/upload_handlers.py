@@ -0,0 +1,248 @@
+"""
+Upload handler that streams a PDF to Google Drive while Django is still
+reading it from the request.
+
+Each chunk is written once to the local PDF cache (so extraction and quiz
+generation can use it) and handed to a background thread that feeds a
+resumable Drive upload. Nothing is written to an intermediate temp file
+and a network blip only resends the current chunk.
+
+The content is hashed on the way, and a file that matches an existing
+Material is not kept on Drive. A client that sends the hash up front in
+X-Content-SHA256 skips the Drive upload altogether when it matches.
+"""
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+
+from backend import circuit_breaker
+
+from .models import Material
+from .utils import blob_cache, fake_drive
+from .utils.drive_api import FILE_FIELDS, delete_file_from_drive, upload_file_to_drive
+from .utils.resumable_upload import ResumableUpload
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()    # all chunks were received: complete the upload
+_ABORT = object()   # the upload was cancelled: discard it on Drive
+
+
+def _delete_discarded(file_id):
+    try:
+        delete_file_from_drive(file_id)
+    except Exception as e:
+        logger.warning("Could not delete discarded upload %s from Drive: %s", file_id, e)
+
+
+def progress_key(user_id, upload_id):
+    return f"upload-progress:{user_id}:{upload_id}"
+
+
+class DriveUploadedFile(UploadedFile):
+    """
+    The uploaded file as seen by the view. Its content is the local (staged)
+    copy; the Drive result is available through drive_result(). If the
+    content matches an existing Material, that material is `duplicate_of`.
+    """
+
+    def __init__(self, writer, sender, name, content_type, size, charset, content_type_extra, duplicate_of=None):
+        super().__init__(writer.open_staged(), name, content_type, size, charset, content_type_extra)
+        self.writer = writer
+        self.sha256 = writer.sha256
+        self.duplicate_of = duplicate_of
+        self._sender = sender
+
+    def temporary_file_path(self):
+        return self.writer.tmp_path
+
+    def drive_result(self):
+        """
+        Waits for the Drive upload to finish. Returns the file metadata
+        (with 'id'), or raises the error that stopped the upload.
+        """
+        if self._sender is None:
+            # Nothing was streamed (the client's hash did not match after all).
+            return upload_file_to_drive(self.writer.tmp_path, self.name)
+        return self._sender.result()
+
+    def commit_to_cache(self, drive_file_id):
+        """Moves the staged copy into the PDF cache under its Drive id."""
+        self.file.close()
+        return self.writer.commit(drive_file_id)
+
+    def cancel_drive_upload(self):
+        """Stops the Drive upload, deleting the file if it was already created."""
+        if self._sender is None:
+            return
+        metadata = self._sender.cancel()
+        self._sender = None
+        if metadata:
+            _delete_discarded(metadata['id'])
+
+    def discard(self):
+        """Drops the local copy and whatever already reached Drive."""
+        self.file.close()
+        self.writer.discard()
+        self.cancel_drive_upload()
+
+
+class _DriveSender:
+    """Feeds queued chunks into a ResumableUpload on a background thread."""
+
+    def __init__(self, upload):
+        self.upload = upload
+        # Bounded, so a slow Drive connection applies back-pressure to the request.
+        self.chunks = queue.Queue(maxsize=8)
+        self.error = None
+        self._result = None
+        self._closed = False
+        self._done = threading.Event()
+        self._aborted = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        received_all = False
+        try:
+            with circuit_breaker.call('drive'):
+                self.upload.start()
+                while True:
+                    chunk = self.chunks.get()
+                    if chunk is _DONE or chunk is _ABORT:
+                        received_all = True
+                        break
+                    if not self._aborted.is_set():
+                        self.upload.write(chunk)
+                if self._aborted.is_set():
+                    self.upload.abort()
+                else:
+                    self._result = self.upload.finish()
+        except Exception as e:
+            self.error = e
+            self.upload.abort()
+            # Keep draining so the request thread never blocks on a full queue.
+            while not received_all:
+                received_all = self.chunks.get() in (_DONE, _ABORT)
+        finally:
+            self._done.set()
+
+    def put(self, chunk):
+        self.chunks.put(chunk)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.chunks.put(_DONE)
+
+    def result(self):
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self._result
+
+    def cancel(self):
+        """
+        Stops the upload without completing it; chunks still queued are
+        dropped. Returns the file metadata if the upload had already been
+        completed on Drive (the caller has to delete the file).
+        """
+        self._aborted.set()
+        if not self._closed:
+            self._closed = True
+            self.chunks.put(_ABORT)
+        self._done.wait()
+        return self._result
+
+
+class DriveUploadHandler(FileUploadHandler):
+    """
+    Streams the `file` field of a multipart upload to Drive. Progress is
+    stored in the cache under the client's X-Upload-ID header, if given.
+    """
+    chunk_size = 256 * 1024
+    field_name = 'file'
+
+    def __init__(self, request=None, fields=FILE_FIELDS):
+        super().__init__(request)
+        self.fields = fields
+        self.active = False
+        self.progress_key = None
+        user = getattr(request, 'user', None)
+        upload_id = request.META.get('HTTP_X_UPLOAD_ID') if request is not None else None
+        if upload_id and user is not None and user.is_authenticated:
+            self.progress_key = progress_key(user.id, upload_id)
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.active = field_name == self.field_name
+        if not self.active:
+            return
+
+        self.writer = blob_cache.CacheWriter()
+        self.sender = None
+        self.claimed_duplicate = Material.find_by_content(self.request.META.get('HTTP_X_CONTENT_SHA256', '').lower())
+        if self.claimed_duplicate is None:
+            upload_class = fake_drive.ResumableUpload if settings.DRIVE_BACKEND == 'fake' else ResumableUpload
+            self.sender = _DriveSender(
+                upload_class(file_name, fields=self.fields, on_progress=self._report_progress)
+            )
+        # The other handlers would only create an (unused) temp file for it.
+        raise StopFutureHandlers()
+
+    def _report_progress(self, uploaded, total):
+        if self.progress_key:
+            cache.set(self.progress_key, {'uploaded': uploaded, 'total': total}, timeout=3600)
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data  # let the next handler deal with other fields
+        self.writer.write(raw_data)
+        if self.sender is not None:
+            self.sender.put(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        self.active = False
+
+        # Trust the client's hash only if the content really matches it.
+        duplicate = self.claimed_duplicate
+        if duplicate is None or duplicate.content_sha256 != self.writer.sha256:
+            duplicate = Material.find_by_content(self.writer.sha256)
+
+        if self.sender is not None:
+            if duplicate is None:
+                self.sender.close()
+            else:
+                # Nothing of a duplicate should be kept on Drive.
+                metadata = self.sender.cancel()
+                if metadata:
+                    _delete_discarded(metadata['id'])
+                self.sender = None
+
+        return DriveUploadedFile(
+            self.writer,
+            self.sender,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra,
+            duplicate_of=duplicate,
+        )
+
+    def upload_interrupted(self):
+        if self.active:
+            if self.sender is not None:
+                metadata = self.sender.cancel()
+                if metadata:
+                    _delete_discarded(metadata['id'])
+            self.writer.discard()
+            self.active = False
@@ -1,10 +1,14 @@
 # materials/urls.py
 
 from django.urls import path
-from .views import UploadMaterialView, MaterialListView, DeleteMaterialView
+from .views import UploadMaterialView, BulkUploadMaterialView, MaterialListView, MaterialSearchView, DeleteMaterialView, PdfCacheStatsView, UploadProgressView
 
 urlpatterns = [
     path('', UploadMaterialView.as_view(), name='upload-material'),
+     path('bulk/', BulkUploadMaterialView.as_view(), name='bulk-upload-materials'),
      path('list/', MaterialListView.as_view(), name='list-materials'),
+     path('search/', MaterialSearchView.as_view(), name='search-materials'),
      path('delete/<int:material_id>/', DeleteMaterialView.as_view(), name='delete-material'),
+     path('progress/<str:upload_id>/', UploadProgressView.as_view(), name='upload-progress'),
+     path('cache-stats/', PdfCacheStatsView.as_view(), name='pdf-cache-stats'),
 ]
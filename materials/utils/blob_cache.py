@@ -0,0 +1,237 @@
+"""
+Content-addressed on-disk cache of material PDFs.
+
+Files are stored as `<drive_file_id>.<sha256>.pdf` under PDF_CACHE_DIR, so
+every consumer (analysis, quiz generation, ...) reads the same local copy
+instead of downloading the PDF from Drive again. The cache is capped at
+PDF_CACHE_MAX_BYTES (uploads still being staged as `.part` files count
+too); the least recently used files are evicted first.
+"""
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+from . import fake_drive
+
+CHUNK_SIZE = 1024 * 1024
+
+COUNTERS = ('hits', 'misses', 'evictions', 'bytes_downloaded')
+
+
+def _counter_key(name):
+    return f"pdf-cache:{name}"
+
+
+def _count(key, amount=1):
+    # Kept in the Django cache so the web and worker processes add up to one
+    # set of numbers (with a shared CACHES backend; LocMemCache is per process).
+    cache_key = _counter_key(key)
+    cache.add(cache_key, 0, timeout=None)
+    try:
+        cache.incr(cache_key, amount)
+    except ValueError:
+        cache.set(cache_key, amount, timeout=None)  # expired between add() and incr()
+
+
+def stats():
+    """Returns the hit/miss counters plus the current cache size (staged uploads included)."""
+    counts = cache.get_many([_counter_key(name) for name in COUNTERS])
+    data = {name: counts.get(_counter_key(name), 0) for name in COUNTERS}
+    lookups = data['hits'] + data['misses']
+    data['hit_ratio'] = round(data['hits'] / lookups, 3) if lookups else 0.0
+    files = list(_entries())
+    staged = list(_staged())
+    data['files'] = len(files)
+    data['staged_files'] = len(staged)
+    data['bytes'] = sum(entry.stat().st_size for entry in files + staged)
+    data['max_bytes'] = settings.PDF_CACHE_MAX_BYTES
+    return data
+
+
+def _cache_dir():
+    path = Path(settings.PDF_CACHE_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _entries():
+    return (entry for entry in os.scandir(_cache_dir()) if entry.name.endswith('.pdf'))
+
+
+def _staged():
+    """Files still being written (CacheWriter), or left behind by an aborted one."""
+    return (entry for entry in os.scandir(_cache_dir()) if entry.name.endswith('.part'))
+
+
+def lookup(drive_file_id):
+    """
+    Returns the path of the cached PDF for a Drive file, or None.
+    A hit marks the file as recently used.
+    """
+    for path in _cache_dir().glob(f"{drive_file_id}.*.pdf"):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another process in the meantime.
+            continue
+        return path
+    return None
+
+
+class CacheWriter:
+    """
+    Writes a PDF into the cache incrementally, hashing it on the way. Used
+    when the content arrives in pieces before its Drive file id is known
+    (e.g. while an upload is still being received).
+    """
+    def __init__(self):
+        self._digest = hashlib.sha256()
+        self.size = 0
+        fd, self.tmp_path = tempfile.mkstemp(dir=_cache_dir(), suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+
+    def write(self, chunk):
+        self._digest.update(chunk)
+        self.size += len(chunk)
+        self._file.write(chunk)
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    def open_staged(self):
+        """Returns a new read handle on the (uncommitted) data written so far."""
+        self._file.flush()
+        return open(self.tmp_path, 'rb')
+
+    def commit(self, drive_file_id):
+        """Moves the data to its content-addressed name. Returns the final path."""
+        self._file.close()
+        if self.size == 0:
+            self.discard()
+            raise ValueError(f"Refusing to cache an empty file for {drive_file_id}.")
+
+        path = _cache_dir() / f"{drive_file_id}.{self.sha256}.pdf"
+        os.replace(self.tmp_path, path)
+
+        # Drop any older content cached for the same Drive file.
+        for stale in _cache_dir().glob(f"{drive_file_id}.*.pdf"):
+            if stale != path:
+                stale.unlink(missing_ok=True)
+
+        _evict(keep=path)
+        return path
+
+    def discard(self):
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def _store(drive_file_id, chunks):
+    """
+    Writes chunks to a temp file while hashing them, then atomically moves it
+    to its content-addressed name. Returns the final path.
+    """
+    writer = CacheWriter()
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+    except BaseException:
+        writer.discard()
+        raise
+    return writer.commit(drive_file_id)
+
+
+def _iter_source(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        yield bytes(source)
+        return
+    with open(source, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def put(drive_file_id, source):
+    """
+    Caches a PDF we already have locally. `source` is bytes or a path.
+    Returns the path of the cached file.
+    """
+    return _store(drive_file_id, _iter_source(source))
+
+
+def _evict(keep=None):
+    """
+    Deletes the least recently used PDFs until the cache fits in
+    PDF_CACHE_MAX_BYTES. Staged files count toward the limit; those older
+    than PDF_CACHE_STAGED_MAX_AGE were abandoned and are deleted.
+    """
+    total = 0
+    stale_before = time.time() - settings.PDF_CACHE_STAGED_MAX_AGE
+    for entry in _staged():
+        try:
+            info = entry.stat()
+            if info.st_mtime < stale_before:
+                os.remove(entry.path)
+            else:
+                total += info.st_size
+        except FileNotFoundError:
+            pass  # committed or discarded in the meantime
+
+    entries = []
+    for entry in _entries():
+        info = entry.stat()
+        entries.append((info.st_mtime, info.st_size, entry.path))
+    entries.sort(reverse=True)
+
+    for mtime, size, path in entries:
+        total += size
+        if total > settings.PDF_CACHE_MAX_BYTES and Path(path) != keep:
+            try:
+                os.remove(path)
+                _count('evictions')
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def fetch(material):
+    """
+    Returns the local path of a material's PDF, downloading it from
+    `material.download_url` into the cache on a miss.
+    """
+    path = lookup(material.drive_file_id)
+    if path is not None:
+        _count('hits')
+        return path
+
+    _count('misses')
+    if settings.DRIVE_BACKEND == 'fake':
+        return _store(material.drive_file_id, fake_drive.download(material.drive_file_id))
+    if not material.download_url:
+        raise FileNotFoundError(f"Material '{material.title}' has no download URL.")
+
+    with requests.get(material.download_url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+
+        def chunks():
+            for chunk in response.iter_content(CHUNK_SIZE):
+                _count('bytes_downloaded', len(chunk))
+                yield chunk
+
+        return _store(material.drive_file_id, chunks())
+
+
+def invalidate(drive_file_id):
+    """Removes every cached copy of a Drive file."""
+    for path in _cache_dir().glob(f"{drive_file_id}.*.pdf"):
+        path.unlink(missing_ok=True)
@@ -1,10 +1,17 @@
 import os
+import threading
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import AuthorizedSession, Request
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.http import MediaFileUpload, MediaIoBaseUpload
 from googleapiclient.errors import HttpError
+from django.conf import settings
 from dotenv import load_dotenv
 
+from backend.circuit_breaker import protect
+from . import fake_drive
+
 load_dotenv()
 
 SCOPES = ['https://www.googleapis.com/auth/drive']
@@ -13,54 +20,130 @@ CLIENT_SECRET = os.environ.get('CLIENT_SECRET')
 REFRESH_TOKEN = os.environ.get('REFRESH_TOKEN')
 PARENT_ID = os.environ.get('PARENT_FOLDER')
 
+# Requested when a file is created, so the links don't need a second call.
+FILE_FIELDS = 'id, webViewLink, webContentLink'
+
+_credentials = None
+_credentials_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_credentials():
+    """
+    Returns the process-wide OAuth credentials, refreshing the access token
+    only when it has expired. The lock keeps concurrent requests from all
+    refreshing it at once.
+    """
+    global _credentials
+    with _credentials_lock:
+        if _credentials is None:
+            _credentials = Credentials.from_authorized_user_info(
+                info={
+                    'client_id': CLIENT_ID,
+                    'client_secret': CLIENT_SECRET,
+                    'refresh_token': REFRESH_TOKEN,
+                    'token_uri': 'https://oauth2.googleapis.com/token'
+                },
+                scopes=SCOPES
+            )
+        if not _credentials.valid:
+            _credentials.refresh(Request())
+        return _credentials
+
+def get_authorized_session():
+    """
+    A requests session that adds (and refreshes) the OAuth token, for Drive
+    calls made over plain HTTP such as resumable uploads.
+    """
+    return AuthorizedSession(get_credentials())
+
 def get_drive_service():
-    creds = Credentials.from_authorized_user_info(
-        info={
-            'client_id': CLIENT_ID,
-            'client_secret': CLIENT_SECRET,
-            'refresh_token': REFRESH_TOKEN,
-            'token_uri': 'https://oauth2.googleapis.com/token'
-        },
-        scopes=SCOPES
-    )
+    """
+    Returns this thread's Drive client, building it on first use. The client
+    is built from the discovery document bundled with googleapiclient (no
+    network fetch) and shares the process-wide credentials. Its HTTP
+    transport is not thread-safe, hence one client per thread.
+    """
+    service = getattr(_local, 'service', None)
+    if service is not None:
+        return service
+
     try:
-        return build('drive', 'v3', credentials=creds)
-    except HttpError as error:
+        creds = get_credentials()
+        service = build('drive', 'v3', credentials=creds, static_discovery=True, cache_discovery=False)
+    except (HttpError, RefreshError) as error:
         print(f'Google Drive error: {error}')
         return None
+    _local.service = service
+    return service
 
-def upload_file_to_drive(file_path, filename):
+@protect('drive')
+def upload_file_to_drive(source, filename):
+    """
+    Uploads a PDF to Drive. `source` is either a path on disk or a readable
+    binary file object (e.g. an in-memory upload). Returns the new file's
+    metadata (FILE_FIELDS), or None if the upload failed.
+    """
+    if settings.DRIVE_BACKEND == 'fake':
+        return fake_drive.upload(source, filename)
     service = get_drive_service()
     if not service:
         return None
 
     try:
         file_metadata = {'name': filename, 'parents': [PARENT_ID]}
-        media = MediaFileUpload(file_path, mimetype='application/pdf')
-        file = service.files().create(
+        if isinstance(source, (str, os.PathLike)):
+            media = MediaFileUpload(source, mimetype='application/pdf')
+        else:
+            media = MediaIoBaseUpload(source, mimetype='application/pdf')
+        return service.files().create(
             body=file_metadata,
             media_body=media,
-            fields='id'
+            fields=FILE_FIELDS
         ).execute()
-        return file.get('id')
     except HttpError as error:
         print(f'Upload error: {error}')
         return None
 
-def generate_public_url(file_id):
+@protect('drive')
+def generate_public_url(file_id, metadata=None):
+    """
+    Makes the file readable by anyone and returns its view/download links.
+    Pass the metadata returned by the upload to skip fetching the links;
+    otherwise the permission grant and the fetch go out as one batch request.
+    """
+    if settings.DRIVE_BACKEND == 'fake':
+        return fake_drive.public_urls(file_id)
     service = get_drive_service()
     if not service:
         return None
 
+    permission = service.permissions().create(
+        fileId=file_id,
+        body={'role': 'reader', 'type': 'anyone'}
+    )
+
     try:
-        service.permissions().create(
-            fileId=file_id,
-            body={'role': 'reader', 'type': 'anyone'}
-        ).execute()
-        file = service.files().get(
-            fileId=file_id,
-            fields='webViewLink, webContentLink'
-        ).execute()
+        if metadata and 'webViewLink' in metadata:
+            permission.execute()
+            file = metadata
+        else:
+            responses = {}
+
+            def collect(request_id, response, exception):
+                responses[request_id] = (response, exception)
+
+            batch = service.new_batch_http_request(callback=collect)
+            batch.add(permission, request_id='permission')
+            batch.add(service.files().get(fileId=file_id, fields='webViewLink, webContentLink'), request_id='file')
+            batch.execute()
+
+            for request_id in ('permission', 'file'):
+                error = responses[request_id][1]
+                if error is not None:
+                    raise error
+            file = responses['file'][0]
+
         return {
             'view_url': file.get('webViewLink'),
             'download_url': file.get('webContentLink')
@@ -71,10 +154,13 @@ def generate_public_url(file_id):
 
 
 
+@protect('drive')
 def delete_file_from_drive(file_id):
     """
     Permanently deletes a file from Google Drive.
     """
+    if settings.DRIVE_BACKEND == 'fake':
+        return fake_drive.delete(file_id)
     service = get_drive_service()
     if not service:
         # If the service fails to initialize, raise an exception
@@ -0,0 +1,121 @@
+"""
+An in-process stand-in for Google Drive (DRIVE_BACKEND = 'fake'), for
+local runs and benchmarks without Google credentials.
+
+Files are kept on disk under FAKE_DRIVE_DIR as `<file id>.pdf`. The
+functions mirror what drive_api does with Drive (upload, public links,
+delete, download) and ResumableUpload mirrors the streamed uploader.
+Every call waits FAKE_DRIVE_LATENCY seconds, like a round trip to Drive.
+"""
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _dir():
+    path = Path(settings.FAKE_DRIVE_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _path(file_id):
+    return _dir() / f"{file_id}.pdf"
+
+
+def _round_trip():
+    if settings.FAKE_DRIVE_LATENCY:
+        time.sleep(settings.FAKE_DRIVE_LATENCY)
+
+
+def _metadata(file_id, name):
+    return {
+        'id': file_id,
+        'name': name,
+        'webViewLink': f"https://drive.fake.local/file/d/{file_id}/view",
+        'webContentLink': f"https://drive.fake.local/uc?id={file_id}&export=download",
+    }
+
+
+def upload(source, filename):
+    """Stores `source` (a path or a binary file object) and returns its metadata."""
+    _round_trip()
+    file_id = f"fake-{uuid.uuid4().hex}"
+    tmp = _dir() / f"{file_id}.part"
+    if isinstance(source, (str, os.PathLike)):
+        shutil.copyfile(source, tmp)
+    else:
+        with open(tmp, 'wb') as f:
+            shutil.copyfileobj(source, f, CHUNK_SIZE)
+    os.replace(tmp, _path(file_id))
+    return _metadata(file_id, filename)
+
+
+def public_urls(file_id):
+    _round_trip()
+    if not _path(file_id).exists():
+        return None
+    metadata = _metadata(file_id, None)
+    return {'view_url': metadata['webViewLink'], 'download_url': metadata['webContentLink']}
+
+
+def delete(file_id):
+    _round_trip()
+    _path(file_id).unlink(missing_ok=True)
+    return True
+
+
+def download(file_id):
+    """Yields the file's content in chunks. Raises FileNotFoundError if it does not exist."""
+    _round_trip()
+    with open(_path(file_id), 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+class ResumableUpload:
+    """Same interface as resumable_upload.ResumableUpload; the content goes to a local file."""
+
+    def __init__(self, filename, mimetype='application/pdf', fields='id', on_progress=None, **kwargs):
+        self.filename = filename
+        self.on_progress = on_progress
+        self.file_id = None
+        self.offset = 0
+        self.total = None
+        self.result = None
+        self._file = None
+
+    def start(self):
+        _round_trip()
+        self.file_id = f"fake-{uuid.uuid4().hex}"
+        self._file = open(_dir() / f"{self.file_id}.part", 'wb')
+        return self.file_id
+
+    def write(self, data):
+        self._file.write(data)
+        self.offset += len(data)
+        if self.on_progress:
+            self.on_progress(self.offset, None)
+
+    def finish(self):
+        _round_trip()
+        self._file.close()
+        os.replace(_dir() / f"{self.file_id}.part", _path(self.file_id))
+        self.total = self.offset
+        if self.on_progress:
+            self.on_progress(self.offset, self.total)
+        self.result = _metadata(self.file_id, self.filename)
+        return self.result
+
+    def abort(self):
+        if self._file is not None and self.result is None:
+            self._file.close()
+            (_dir() / f"{self.file_id}.part").unlink(missing_ok=True)
@@ -0,0 +1,135 @@
+"""
+A local stand-in for Drive's resumable upload endpoint, for trying uploads
+without Google credentials:
+
+    server = FakeDriveServer(drop_every=3)    # cut every 3rd chunk short
+    server.start()
+    upload = ResumableUpload('notes.pdf', session=requests.Session(), upload_url=server.upload_url)
+
+It implements the parts of the protocol the uploader uses: opening a
+session, chunk PUTs answered with 308 + Range, status queries
+(`bytes */total`), completion with the file metadata, and DELETE.
+"""
+import itertools
+import json
+import re
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Session:
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self.data = bytearray()
+        self.file_id = None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'FakeDrive/1.0'
+
+    def log_message(self, *args):
+        pass  # keep test output quiet
+
+    def _reply(self, code, body=None, headers=None):
+        payload = json.dumps(body).encode() if body is not None else b''
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        if body is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _session(self):
+        match = re.search(r'upload_id=([\w-]+)', self.path)
+        return self.server.sessions.get(match.group(1)) if match else None
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        metadata = json.loads(self.rfile.read(length) or b'{}')
+        upload_id = uuid.uuid4().hex
+        self.server.sessions[upload_id] = _Session(metadata)
+        host, port = self.server.server_address[:2]
+        self._reply(200, headers={'Location': f"http://{host}:{port}/upload?upload_id={upload_id}"})
+
+    def do_DELETE(self):
+        session = self._session()
+        if session is None:
+            return self._reply(404, {'error': 'No such upload session'})
+        self.server.sessions.pop(re.search(r'upload_id=([\w-]+)', self.path).group(1))
+        self._reply(499)
+
+    def do_PUT(self):
+        session = self._session()
+        if session is None:
+            return self._reply(404, {'error': 'No such upload session'})
+
+        length = int(self.headers.get('Content-Length', 0))
+        match = re.match(r'bytes (\d+)-(\d+)/(\d+|\*)', self.headers.get('Content-Range', ''))
+        if match and self.server.should_drop():
+            # Store only half of the chunk and hang up, like a flaky connection.
+            start = int(match.group(1))
+            body = self.rfile.read(length // 2)
+            if start == len(session.data):
+                session.data += body
+            self.close_connection = True
+            self.connection.shutdown(2)
+            return
+
+        body = self.rfile.read(length)
+        if match:
+            start, total = int(match.group(1)), match.group(3)
+            if start != len(session.data):
+                return self._reply(400, {'error': f"Expected offset {len(session.data)}, got {start}"})
+            session.data += body
+        else:
+            total = (re.match(r'bytes \*/(\d+|\*)', self.headers.get('Content-Range', '')) or [None, '*'])[1]
+
+        if total != '*' and len(session.data) == int(total):
+            if session.file_id is None:
+                session.file_id = f"fake-{next(self.server.ids)}"
+                self.server.files[session.file_id] = bytes(session.data)
+            return self._reply(200, {'id': session.file_id, 'name': session.metadata.get('name')})
+
+        headers = {'Range': f"bytes=0-{len(session.data) - 1}"} if session.data else {}
+        self._reply(308, headers=headers)
+
+
+class FakeDriveServer(ThreadingHTTPServer):
+    """
+    Serves on localhost in a background thread. Completed uploads are kept
+    in `files` ({file_id: bytes}). With `drop_every=n`, every n-th chunk
+    PUT is cut off half way through.
+    """
+    daemon_threads = True
+
+    def __init__(self, port=0, drop_every=0):
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.sessions = {}
+        self.files = {}
+        self.ids = itertools.count(1)
+        self.drop_every = drop_every
+        self.dropped = 0
+        self._puts = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def upload_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/upload/drive/v3/files"
+
+    def should_drop(self):
+        with self._lock:
+            drop = bool(self.drop_every) and next(self._puts) % self.drop_every == 0
+            self.dropped += drop
+            return drop
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
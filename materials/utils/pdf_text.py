@@ -0,0 +1,363 @@
+"""
+PDF text extraction.
+
+Text is extracted with a pluggable backend (PDF_TEXT_BACKEND, pypdfium2 by
+default). Pages for which it returns nothing usable are extracted again
+with PDF_TEXT_FALLBACK_BACKEND (pdfplumber). Large documents are split
+into page ranges and extracted by a pool of worker processes, and very
+large files can be streamed page by page with iter_pages().
+"""
+import gc
+import io
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import pdfplumber
+import pypdfium2
+from django.conf import settings
+
+# A page is treated as garbled when more than this share of its characters
+# are replacement/control/private-use characters.
+GARBLED_RATIO = 0.1
+
+
+class Extractor:
+    """
+    Base class of the extraction backends. Subclasses implement open(),
+    which returns a document handle with page_count and page_text(number);
+    pages are loaded one at a time and released right after.
+    """
+    name = None
+
+    def open(self, source):
+        raise NotImplementedError
+
+    def page_count(self, source):
+        with self.open(source) as document:
+            return document.page_count
+
+    def extract(self, source, page_numbers):
+        with self.open(source) as document:
+            return [document.page_text(number) for number in page_numbers]
+
+
+class _PdfiumDocument:
+    def __init__(self, source, lock):
+        # PDFium reads paths, bytes and file objects with readinto(); other
+        # buffers such as a memory map are read into memory first.
+        if not isinstance(source, (str, os.PathLike, bytes)) and not hasattr(source, 'readinto'):
+            source = io.BytesIO(source.read())
+        self._lock = lock
+        with lock:
+            self._pdf = pypdfium2.PdfDocument(source)
+            self.page_count = len(self._pdf)
+
+    def page_text(self, number):
+        with self._lock:
+            page = self._pdf[number - 1]
+            textpage = page.get_textpage()
+            try:
+                return textpage.get_text_bounded().replace('\r\n', '\n')
+            finally:
+                textpage.close()
+                page.close()
+
+    def close(self):
+        with self._lock:
+            self._pdf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PdfiumExtractor(Extractor):
+    """Plain text straight from PDFium, without any layout analysis."""
+    name = 'pypdfium2'
+
+    # PDFium is not thread-safe; calls within one process are serialized.
+    # (Worker processes of the extraction pool each have their own lock.)
+    _lock = threading.Lock()
+
+    def open(self, source):
+        return _PdfiumDocument(source, self._lock)
+
+
+class _PdfplumberDocument:
+    def __init__(self, source):
+        self._pdf = pdfplumber.open(source)
+        self.page_count = len(self._pdf.pages)
+
+    def page_text(self, number):
+        page = self._pdf.pages[number - 1]
+        try:
+            return page.extract_text() or ""
+        finally:
+            # Drop the page's parsed objects and layout caches straight away.
+            page.close()
+
+    def close(self):
+        self._pdf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PdfplumberExtractor(Extractor):
+    """pdfplumber's layout-aware extraction. Slower, but copes with more PDFs."""
+    name = 'pdfplumber'
+
+    def open(self, source):
+        return _PdfplumberDocument(source)
+
+
+EXTRACTORS = {
+    extractor.name: extractor
+    for extractor in (PdfiumExtractor(), PdfplumberExtractor())
+}
+
+
+def get_extractor(name):
+    try:
+        return EXTRACTORS[name]
+    except KeyError:
+        raise ValueError(f"Unknown PDF text backend '{name}'. Choose from: {', '.join(EXTRACTORS)}")
+
+
+class ExtractionMemoryError(Exception):
+    """Raised by iter_pages() when the process exceeds its memory ceiling."""
+
+
+@dataclass
+class ExtractedText:
+    pages: list                       # one string per page, page number = index + 1
+    backend: str                      # e.g. 'pypdfium2' or 'pypdfium2+pdfplumber'
+    fallback_pages: list = field(default_factory=list)  # pages re-extracted by the fallback
+
+
+def looks_garbled(text):
+    """True for pages with no text or mostly unreadable characters."""
+    if not text.strip():
+        return True
+    bad = sum(
+        1 for char in text
+        if char == '\ufffd' or (unicodedata.category(char) in ('Cc', 'Co', 'Cs') and char not in '\n\t')
+    )
+    return bad / len(text) > GARBLED_RATIO
+
+
+def _rewind(source):
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return source
+
+
+def _extract_with_fallback(source, page_numbers, backend, fallback):
+    """
+    Extracts the given pages with `backend`, re-extracting the ones that come
+    back empty or garbled with `fallback`. Returns [(text, used_fallback), ...].
+    """
+    primary = get_extractor(backend)
+    pages = primary.extract(_rewind(source), page_numbers)
+
+    retry = [number for number, text in zip(page_numbers, pages) if looks_garbled(text)]
+    replacements = {}
+    if retry and fallback and fallback != backend:
+        retried = get_extractor(fallback).extract(_rewind(source), retry)
+        replacements = {
+            number: text for number, text in zip(retry, retried)
+            if text.strip() and not looks_garbled(text)
+        }
+
+    return [
+        (replacements[number], True) if number in replacements else (text, False)
+        for number, text in zip(page_numbers, pages)
+    ]
+
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers):
+    """
+    Returns a process pool shared by every extraction in this process, so
+    concurrent uploads/jobs cannot start more than `workers` processes.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # 'spawn' keeps the children independent of the (threaded) Django process.
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+            _pool_workers = workers
+        return _pool
+
+
+def _extract_range(path, start, end, backend, fallback):
+    """Runs in a worker process: opens the PDF itself and extracts pages start+1..end."""
+    return _extract_with_fallback(path, range(start + 1, end + 1), backend, fallback)
+
+
+def _extract_parallel(path, page_count, workers, backend, fallback):
+    # A few ranges per worker keeps the processes busy when pages vary in cost.
+    range_count = min(page_count, workers * 4)
+    size = math.ceil(page_count / range_count)
+    ranges = [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+    pool = _get_pool(workers)
+    futures = [pool.submit(_extract_range, path, start, end, backend, fallback) for start, end in ranges]
+
+    results = []
+    for future in futures:
+        results.extend(future.result())
+    return results
+
+
+def extract_pages(source, workers=None, backend=None, fallback=None):
+    """
+    Extract the plain text of every page of a PDF.
+
+    `source` may be raw bytes, a path on disk or a readable file object.
+    Returns an ExtractedText whose `pages` hold one string per page (empty
+    for pages without text), so list index + 1 is the page number.
+
+    Documents with at least PDF_PARALLEL_MIN_PAGES pages are split into page
+    ranges and extracted by a pool of `workers` processes (defaults to
+    PDF_EXTRACTION_WORKERS); each process opens the file on its own.
+    """
+    if workers is None:
+        workers = settings.PDF_EXTRACTION_WORKERS
+    backend = backend or settings.PDF_TEXT_BACKEND
+    fallback = settings.PDF_TEXT_FALLBACK_BACKEND if fallback is None else fallback
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    page_count = get_extractor(backend).page_count(_rewind(source))
+
+    if workers <= 1 or page_count < settings.PDF_PARALLEL_MIN_PAGES:
+        results = _extract_with_fallback(source, range(1, page_count + 1), backend, fallback)
+    elif isinstance(source, (str, os.PathLike)):
+        results = _extract_parallel(os.fspath(source), page_count, workers, backend, fallback)
+    else:
+        # Worker processes need a path to open, so spill in-memory PDFs to disk.
+        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
+            shutil.copyfileobj(_rewind(source), tmp)
+        try:
+            results = _extract_parallel(tmp.name, page_count, workers, backend, fallback)
+        finally:
+            os.remove(tmp.name)
+
+    fallback_pages = [number for number, (_, used_fallback) in enumerate(results, start=1) if used_fallback]
+    return ExtractedText(
+        pages=[text for text, _ in results],
+        backend=backend_label(backend, fallback, bool(fallback_pages)),
+        fallback_pages=fallback_pages,
+    )
+
+
+def backend_label(backend, fallback, used_fallback):
+    return f"{backend}+{fallback}" if used_fallback else backend
+
+
+def _current_rss_mb():
+    """Resident set size of this process, or None where /proc is unavailable."""
+    try:
+        with open('/proc/self/statm') as statm:
+            resident_pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def iter_pages(source, backend=None, fallback=None, max_rss_mb=None):
+    """
+    Streaming extraction for very large PDFs.
+
+    Yields (page_number, text, used_fallback) one page at a time. Only the
+    current page is loaded; its objects are released before the next one is
+    read, so memory stays flat however long the document is. If the process
+    grows beyond `max_rss_mb` (PDF_STREAM_MAX_RSS_MB) even after a garbage
+    collection, ExtractionMemoryError is raised instead of carrying on.
+    """
+    backend = backend or settings.PDF_TEXT_BACKEND
+    fallback = settings.PDF_TEXT_FALLBACK_BACKEND if fallback is None else fallback
+    max_rss_mb = settings.PDF_STREAM_MAX_RSS_MB if max_rss_mb is None else max_rss_mb
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    fallback_document = None
+    with get_extractor(backend).open(_rewind(source)) as document:
+        try:
+            for number in range(1, document.page_count + 1):
+                text = document.page_text(number)
+                used_fallback = False
+
+                if looks_garbled(text) and fallback and fallback != backend:
+                    if fallback_document is None:
+                        # A second handle on the same stream would share its position.
+                        fallback_source = source if isinstance(source, (str, os.PathLike)) else _copy_stream(source)
+                        fallback_document = get_extractor(fallback).open(fallback_source)
+                    retried = fallback_document.page_text(number)
+                    if retried.strip() and not looks_garbled(retried):
+                        text, used_fallback = retried, True
+
+                yield number, text, used_fallback
+
+                if max_rss_mb:
+                    _check_memory(max_rss_mb, number)
+        finally:
+            if fallback_document is not None:
+                fallback_document.close()
+
+
+def _copy_stream(source):
+    copy = tempfile.TemporaryFile()
+    shutil.copyfileobj(_rewind(source), copy)
+    copy.seek(0)
+    return copy
+
+
+def _check_memory(max_rss_mb, page_number):
+    rss = _current_rss_mb()
+    if rss is None or rss <= max_rss_mb:
+        return
+    gc.collect()
+    rss = _current_rss_mb()
+    if rss > max_rss_mb:
+        raise ExtractionMemoryError(
+            f"Extraction stopped at page {page_number}: process uses {rss:.0f} MB "
+            f"(limit {max_rss_mb} MB)."
+        )
+
+
+def join_pages(pages):
+    """Joins per-page text into one document, skipping empty pages."""
+    return "\n".join(text for text in pages if text)
+
+
+def extract_text(source, workers=None):
+    """
+    Extract the text of a whole PDF as a single string.
+    Pages are collected in a list and joined once at the end.
+    """
+    return join_pages(extract_pages(source, workers=workers).pages)
@@ -0,0 +1,190 @@
+"""
+Chunked, resumable uploads to Google Drive over plain HTTP.
+
+Implements Drive's resumable upload protocol: a session is opened with the
+file metadata, then the content is PUT in chunks (multiples of 256 KiB)
+with a Content-Range header. Drive acknowledges each chunk with a 308 and
+the byte range it has stored so far. After a network error the session is
+queried and the upload carries on from the last acknowledged byte instead
+of starting over.
+"""
+import json
+import re
+import time
+
+import requests
+from django.conf import settings
+
+from .drive_api import PARENT_ID, get_authorized_session
+
+CHUNK_ALIGNMENT = 256 * 1024
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ResumableUploadError(Exception):
+    """The upload could not be completed (session lost or retries exhausted)."""
+
+
+class ResumableUpload:
+    """
+    Feed the file in with write() as it arrives, then call finish().
+
+        upload = ResumableUpload('notes.pdf')
+        upload.start()
+        for chunk in chunks:
+            upload.write(chunk)
+        metadata = upload.finish()   # {'id': ..., ...}
+
+    Only one chunk (`chunk_size` bytes) is buffered at a time. `on_progress`
+    is called with (bytes_acknowledged, total_or_None) after every chunk.
+    """
+
+    def __init__(self, filename, mimetype='application/pdf', session=None, upload_url=None,
+                 chunk_size=None, fields='id', on_progress=None, max_retries=None):
+        chunk_size = chunk_size or settings.DRIVE_UPLOAD_CHUNK_SIZE
+        if chunk_size % CHUNK_ALIGNMENT:
+            raise ValueError(f"chunk_size must be a multiple of {CHUNK_ALIGNMENT} bytes.")
+
+        self.filename = filename
+        self.mimetype = mimetype
+        self.session = session
+        self.upload_url = upload_url or settings.DRIVE_UPLOAD_URL
+        self.chunk_size = chunk_size
+        self.fields = fields
+        self.on_progress = on_progress
+        self.max_retries = settings.DRIVE_UPLOAD_MAX_RETRIES if max_retries is None else max_retries
+
+        self.session_uri = None
+        self.offset = 0          # bytes acknowledged by Drive
+        self.total = None        # known once finish() is called
+        self._buffer = bytearray()
+        self.result = None
+
+    def start(self):
+        """Opens the upload session and returns its URI."""
+        if self.session is None:
+            self.session = get_authorized_session()
+
+        metadata = {'name': self.filename}
+        if PARENT_ID:
+            metadata['parents'] = [PARENT_ID]
+
+        response = self.session.post(
+            self.upload_url,
+            params={'uploadType': 'resumable', 'fields': self.fields},
+            data=json.dumps(metadata),
+            headers={
+                'Content-Type': 'application/json; charset=UTF-8',
+                'X-Upload-Content-Type': self.mimetype,
+            },
+            timeout=settings.DRIVE_UPLOAD_TIMEOUT,
+        )
+        if response.status_code != 200 or 'Location' not in response.headers:
+            raise ResumableUploadError(
+                f"Could not start upload session ({response.status_code}): {response.text[:200]}"
+            )
+        self.session_uri = response.headers['Location']
+        return self.session_uri
+
+    def write(self, data):
+        """Buffers data and sends every full chunk."""
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            self._send(self.chunk_size, total=None)
+
+    def finish(self):
+        """Sends the remaining bytes and returns the created file's metadata."""
+        self.total = self.offset + len(self._buffer)
+        while self.result is None:
+            self._send(len(self._buffer), total=self.total)
+        return self.result
+
+    def abort(self):
+        """Cancels the session; Drive discards whatever was uploaded."""
+        if self.session_uri and self.result is None:
+            try:
+                self.session.delete(self.session_uri, timeout=settings.DRIVE_UPLOAD_TIMEOUT)
+            except requests.RequestException:
+                pass
+        self._buffer.clear()
+
+    def _send(self, length, total):
+        """
+        PUTs the first `length` buffered bytes, retrying from the last
+        acknowledged offset on network errors and 5xx/429 responses.
+        """
+        chunk_end = self.offset + length
+        attempt = 0
+        while True:
+            chunk = bytes(self._buffer[:chunk_end - self.offset])
+            end = self.offset + len(chunk) - 1
+            size = '*' if total is None else str(total)
+            content_range = f"bytes {self.offset}-{end}/{size}" if chunk else f"bytes */{size}"
+
+            try:
+                response = self.session.put(
+                    self.session_uri,
+                    data=chunk,
+                    headers={'Content-Range': content_range},
+                    timeout=settings.DRIVE_UPLOAD_TIMEOUT,
+                )
+            except requests.RequestException as e:
+                response, error = None, e
+            else:
+                error = None
+                if response.status_code in (200, 201):
+                    self._acknowledge(total if total is not None else end + 1)
+                    self.result = response.json()
+                    return
+                if response.status_code == 308:
+                    self._acknowledge(self._acknowledged_end(response))
+                    return
+                if response.status_code in (404, 410):
+                    raise ResumableUploadError("Upload session expired; the upload has to be restarted.")
+                if response.status_code not in RETRYABLE_STATUSES:
+                    raise ResumableUploadError(
+                        f"Drive rejected chunk {content_range} ({response.status_code}): {response.text[:200]}"
+                    )
+
+            attempt += 1
+            if attempt > self.max_retries:
+                raise ResumableUploadError(f"Giving up on chunk {content_range} after {attempt} attempts: {error or response.status_code}")
+            time.sleep(min(2 ** attempt, 30) * 0.5)
+            self._resync(total)
+            if self.result is not None or (total is None and self.offset >= chunk_end):
+                return
+
+    def _resync(self, total):
+        """Asks Drive how much of the file it has and drops those bytes from the buffer."""
+        size = '*' if total is None else str(total)
+        try:
+            response = self.session.put(
+                self.session_uri,
+                data=b'',
+                headers={'Content-Range': f"bytes */{size}"},
+                timeout=settings.DRIVE_UPLOAD_TIMEOUT,
+            )
+        except requests.RequestException:
+            return
+        if response.status_code in (200, 201):
+            self._acknowledge(total if total is not None else self.offset)
+            self.result = response.json()
+        elif response.status_code == 308:
+            self._acknowledge(self._acknowledged_end(response))
+        elif response.status_code in (404, 410):
+            raise ResumableUploadError("Upload session expired; the upload has to be restarted.")
+
+    def _acknowledged_end(self, response):
+        """Parses `Range: bytes=0-N` (absent when nothing is stored yet)."""
+        match = re.match(r'bytes=0-(\d+)', response.headers.get('Range', ''))
+        return int(match.group(1)) + 1 if match else 0
+
+    def _acknowledge(self, acknowledged):
+        if acknowledged < self.offset:
+            raise ResumableUploadError(
+                f"Drive lost data: it has {acknowledged} bytes but had confirmed {self.offset}."
+            )
+        del self._buffer[:acknowledged - self.offset]
+        self.offset = acknowledged
+        if self.on_progress:
+            self.on_progress(self.offset, self.total)
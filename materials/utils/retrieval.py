@@ -0,0 +1,246 @@
+"""
+Per-material BM25 index over paragraph-sized passages.
+
+The index is built from the stored page text (text_store) whenever it is
+saved, and written to RETRIEVAL_INDEX_DIR/<material_id>.npz as a small set
+of NumPy arrays: the sorted vocabulary, postings in CSR form (passage ids
+and term frequencies per term) and, for every passage, its page and
+character offsets. Passage text is not duplicated; it is read back from
+text_store for the passages a query returns. The passages' search vectors
+(vector_index) are written alongside, in the same order.
+
+    for passage in top_passages(material, "binary search trees", k=5, token_budget=2000):
+        passage.page, passage.score, passage.text
+"""
+import math
+import os
+import re
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from . import text_store, vector_index
+
+K1 = 1.5
+B = 0.75
+
+# Loaded indexes kept in memory, least recently used dropped first.
+LOADED_INDEX_LIMIT = 16
+
+TOKEN_RE = re.compile(r'[^\W_]{2,}')
+STOPWORDS = frozenset(
+    "the and for are but not you all any can had her was one our out has have this that with from "
+    "they will what when which who how its into than then them these those there their been were "
+    "also more such only other some each may use used using over very".split()
+)
+# Rough token estimate, as in llm.gateway.
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class Passage:
+    page: int
+    start: int      # character offsets within the page text
+    end: int
+    score: float
+    text: str = ''
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def split_passages(page_text, max_chars=None):
+    """
+    Splits a page into passages of at most about `max_chars` characters,
+    breaking at blank lines (paragraphs) where possible, else at line ends.
+    Returns [(start, end), ...] character offsets.
+    """
+    max_chars = max_chars or settings.RETRIEVAL_PASSAGE_CHARS
+    spans = []
+    start = end = 0
+    for match in re.finditer(r'[^\n]*(?:\n|$)', page_text):
+        line_start, line_end = match.span()
+        if line_start == line_end:
+            break
+        is_break = not match.group().strip()
+        if end > start and (line_end - start > max_chars or (is_break and end - start >= max_chars // 2)):
+            spans.append((start, end))
+            start = line_start
+        end = line_end
+    if page_text[start:end].strip():
+        spans.append((start, end))
+    return spans
+
+
+def _index_dir():
+    path = Path(settings.RETRIEVAL_INDEX_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _index_path(material_id):
+    return _index_dir() / f"{material_id}.npz"
+
+
+def build_index(material, pages=None):
+    """
+    (Re)builds the BM25 index of a material from `pages` ([(number, text)])
+    or, by default, its stored text. Returns the number of passages.
+    """
+    if pages is None:
+        pages = text_store.read_pages(material)
+
+    passage_pages, passage_starts, passage_ends, lengths, passage_counts = [], [], [], [], []
+    postings = {}  # term -> ([passage ids], [term frequencies])
+    for number, text in pages:
+        for start, end in split_passages(text):
+            counts = Counter(tokenize(text[start:end]))
+            if not counts:
+                continue
+            passage_id = len(passage_pages)
+            passage_pages.append(number)
+            passage_starts.append(start)
+            passage_ends.append(end)
+            lengths.append(sum(counts.values()))
+            passage_counts.append(counts)
+            for term, tf in counts.items():
+                ids, tfs = postings.setdefault(term, ([], []))
+                ids.append(passage_id)
+                tfs.append(tf)
+
+    terms = sorted(postings)
+    term_ptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    for i, term in enumerate(terms):
+        term_ptr[i + 1] = term_ptr[i] + len(postings[term][0])
+    doc_ids = np.fromiter((pid for term in terms for pid in postings[term][0]), dtype=np.int32, count=int(term_ptr[-1]))
+    tfs = np.fromiter((tf for term in terms for tf in postings[term][1]), dtype=np.float32, count=int(term_ptr[-1]))
+
+    # Written to a temp file and renamed, so readers never see half an index.
+    fd, tmp_path = tempfile.mkstemp(dir=_index_dir(), suffix='.npz.part')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(
+            f,
+            terms=np.array(terms, dtype=str),
+            term_ptr=term_ptr,
+            doc_ids=doc_ids,
+            tfs=tfs,
+            doc_len=np.array(lengths, dtype=np.float32),
+            page=np.array(passage_pages, dtype=np.int32),
+            start=np.array(passage_starts, dtype=np.int32),
+            end=np.array(passage_ends, dtype=np.int32),
+        )
+    os.replace(tmp_path, _index_path(material.id))
+    _forget_loaded(material.id)
+    vector_index.write(material.id, passage_counts)
+    return len(passage_pages)
+
+
+def delete_index(material_id):
+    _forget_loaded(material_id)
+    vector_index.delete(material_id)
+    try:
+        os.remove(_index_path(material_id))
+    except FileNotFoundError:
+        pass
+
+
+_loaded = OrderedDict()
+_loaded_lock = threading.Lock()
+
+
+def _forget_loaded(material_id):
+    with _loaded_lock:
+        _loaded.pop(material_id, None)
+
+
+def load_index(material):
+    """
+    Returns the material's index arrays (see build_index), building the index
+    if there is none. None if the material has no text to index.
+    """
+    path = _index_path(material.id)
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        if not build_index(material):
+            return None
+        mtime = path.stat().st_mtime
+
+    with _loaded_lock:
+        cached = _loaded.get(material.id)
+        if cached is not None and cached[0] == mtime:
+            _loaded.move_to_end(material.id)
+            return cached[1]
+
+    with np.load(path, allow_pickle=False) as data:
+        index = {name: data[name] for name in data.files}
+    index['avg_len'] = float(index['doc_len'].mean()) if len(index['doc_len']) else 0.0
+
+    with _loaded_lock:
+        _loaded[material.id] = (mtime, index)
+        _loaded.move_to_end(material.id)
+        while len(_loaded) > LOADED_INDEX_LIMIT:
+            _loaded.popitem(last=False)
+    return index
+
+
+def score(index, query):
+    """BM25 score of every passage for `query` (a float32 array)."""
+    doc_len = index['doc_len']
+    scores = np.zeros(len(doc_len), dtype=np.float32)
+    terms = index['terms']
+    if not len(terms):
+        return scores
+
+    norm = K1 * (1 - B + B * doc_len / (index['avg_len'] or 1.0))
+    for term in set(tokenize(query)):
+        i = int(np.searchsorted(terms, term))
+        if i >= len(terms) or terms[i] != term:
+            continue
+        lo, hi = index['term_ptr'][i], index['term_ptr'][i + 1]
+        ids, tf = index['doc_ids'][lo:hi], index['tfs'][lo:hi]
+        df = hi - lo
+        idf = math.log(1 + (len(doc_len) - df + 0.5) / (df + 0.5))
+        scores[ids] += idf * tf * (K1 + 1) / (tf + norm[ids])
+    return scores
+
+
+def top_passages(material, query, k=5, token_budget=None):
+    """
+    The up to `k` passages most relevant to `query`, best first, stopping
+    before `token_budget` (estimated) tokens would be exceeded. Returns
+    Passage objects with their text filled in.
+    """
+    index = load_index(material)
+    if index is None:
+        return []
+
+    scores = score(index, query)
+    candidates = np.flatnonzero(scores > 0)
+    if not len(candidates):
+        return []
+    if len(candidates) > k:
+        candidates = candidates[np.argpartition(scores[candidates], -k)[-k:]]
+    ranked = candidates[np.argsort(-scores[candidates], kind='stable')]
+
+    passages = [
+        Passage(int(index['page'][i]), int(index['start'][i]), int(index['end'][i]), float(scores[i]))
+        for i in ranked
+    ]
+    page_text = dict(text_store.read_pages(material, numbers={p.page for p in passages}))
+
+    selected, used = [], 0
+    for passage in passages:
+        passage.text = page_text.get(passage.page, '')[passage.start:passage.end].strip()
+        cost = len(passage.text) // CHARS_PER_TOKEN + 1
+        if token_budget is not None and used + cost > token_budget:
+            break
+        selected.append(passage)
+        used += cost
+    return selected
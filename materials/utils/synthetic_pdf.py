@@ -0,0 +1,65 @@
+"""
+Generates plain-text PDFs of arbitrary length for benchmarks.
+
+The output is deterministic for a given seed and uses only the standard
+Helvetica font, so no PDF-writing library is needed.
+"""
+import random
+
+WORDS = (
+    "algorithm analysis array binary cache compiler complexity concurrency data "
+    "database distributed entropy function graph hash heap index inference kernel "
+    "latency matrix memory network node normalization optimization pipeline pointer "
+    "probability process protocol query queue recursion regression scheduling "
+    "search semaphore sorting stack statistics storage thread throughput transaction "
+    "tree variable vector"
+).split()
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _page_lines(rng, page_number, lines_per_page):
+    lines = [f"Chapter {page_number // 10 + 1}.{page_number % 10}: {rng.choice(WORDS).title()} {rng.choice(WORDS).title()}"]
+    for _ in range(lines_per_page - 1):
+        lines.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 14))))
+    return lines
+
+
+def make_pdf(page_count, lines_per_page=45, seed=0):
+    """Returns the bytes of a `page_count`-page PDF filled with pseudo-random prose."""
+    rng = random.Random(seed)
+    objects = [
+        b"<</Type/Catalog/Pages 2 0 R>>",
+        None,  # page tree, filled in once the page object numbers are known
+        b"<</Type/Font/Subtype/Type1/BaseFont/Helvetica>>",
+    ]
+    page_refs = []
+    for number in range(1, page_count + 1):
+        lines = _page_lines(rng, number, lines_per_page)
+        stream = "BT /F1 10 Tf 50 770 Td 15 TL " + " ".join(f"({_escape(line)}) '" for line in lines) + " ET"
+        stream = stream.encode('latin-1')
+        objects.append(b"<</Length %d>>stream\n%s\nendstream" % (len(stream), stream))
+        content_ref = len(objects)
+        objects.append(
+            b"<</Type/Page/Parent 2 0 R/MediaBox[0 0 612 792]"
+            b"/Resources<</Font<</F1 3 0 R>>>>/Contents %d 0 R>>" % content_ref
+        )
+        page_refs.append(len(objects))
+
+    kids = " ".join(f"{ref} 0 R" for ref in page_refs).encode()
+    objects[1] = b"<</Type/Pages/Kids[%s]/Count %d>>" % (kids, page_count)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<</Size %d/Root 1 0 R>>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(out)
@@ -0,0 +1,167 @@
+"""
+Per-page storage of extracted PDF text (MaterialText / MaterialTextPage).
+
+Text is extracted once, compressed page by page with zlib and written to
+the database. Later consumers read it back from here instead of running
+pdfplumber again, and can ask for just a range of pages. Very large PDFs
+are streamed into the store page by page. Saving the text also (re)builds
+the material's retrieval index.
+"""
+import hashlib
+import os
+import zlib
+
+from django.conf import settings
+from django.db import transaction
+
+from ..models import Material, MaterialText, MaterialTextPage
+from . import blob_cache, retrieval
+from .pdf_text import backend_label, extract_pages, iter_pages, join_pages
+
+COMPRESSION_LEVEL = 6
+WRITE_BATCH_SIZE = 50
+
+
+def page_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _page_row(material_text, number, text):
+    return MaterialTextPage(
+        material_text=material_text,
+        page_number=number,
+        content=zlib.compress(text.encode('utf-8'), COMPRESSION_LEVEL),
+        content_sha256=page_hash(text),
+        char_count=len(text),
+    )
+
+
+def save_page_stream(material, pages, backend, fallback):
+    """
+    Stores pages as they are produced by pdf_text.iter_pages(), writing them
+    in batches so the whole document is never held in memory.
+    `pages` yields (page_number, text, used_fallback) tuples.
+    """
+    with transaction.atomic():
+        MaterialText.objects.filter(material=material).delete()
+        material_text = MaterialText.objects.create(material=material, page_count=0, backend=backend)
+
+        batch = []
+        page_count = char_count = fallback_count = 0
+        for number, text, used_fallback in pages:
+            batch.append(_page_row(material_text, number, text))
+            page_count += 1
+            char_count += len(text)
+            fallback_count += used_fallback
+            if len(batch) >= WRITE_BATCH_SIZE:
+                MaterialTextPage.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            MaterialTextPage.objects.bulk_create(batch)
+
+        material_text.page_count = page_count
+        material_text.char_count = char_count
+        material_text.fallback_page_count = fallback_count
+        material_text.backend = backend_label(backend, fallback, fallback_count > 0)
+        material_text.save()
+
+    _build_index(material)
+    return material_text
+
+
+def save_pages(material, extracted):
+    """
+    Stores the per-page text of a material, replacing anything stored before.
+    `extracted` is the ExtractedText returned by pdf_text.extract_pages().
+    """
+    pages = extracted.pages
+    with transaction.atomic():
+        MaterialText.objects.filter(material=material).delete()
+        material_text = MaterialText.objects.create(
+            material=material,
+            page_count=len(pages),
+            char_count=sum(len(text) for text in pages),
+            backend=extracted.backend,
+            fallback_page_count=len(extracted.fallback_pages),
+        )
+        MaterialTextPage.objects.bulk_create(
+            [_page_row(material_text, number, text) for number, text in enumerate(pages, start=1)],
+            batch_size=WRITE_BATCH_SIZE,
+        )
+
+    _build_index(material, list(enumerate(pages, start=1)))
+    return material_text
+
+
+def has_text(material):
+    return MaterialText.objects.filter(material=material).exists()
+
+
+def _build_index(material, pages=None):
+    try:
+        retrieval.build_index(material, pages)
+    except Exception as e:
+        # Retrieval builds the index on first use if this failed.
+        print(f"Could not build the retrieval index for material {material.id}: {e}")
+
+
+def read_pages(material, start=None, end=None, numbers=None):
+    """
+    Returns [(page_number, text), ...] for the stored pages of a material,
+    optionally limited to pages start..end (inclusive, 1-based) or to the
+    given page `numbers`. Only the requested pages are fetched and
+    decompressed.
+    """
+    rows = MaterialTextPage.objects.filter(material_text__material=material)
+    if numbers is not None:
+        rows = rows.filter(page_number__in=numbers)
+    if start is not None:
+        rows = rows.filter(page_number__gte=start)
+    if end is not None:
+        rows = rows.filter(page_number__lte=end)
+
+    return [
+        (number, zlib.decompress(bytes(content)).decode('utf-8'))
+        for number, content in rows.order_by('page_number').values_list('page_number', 'content')
+    ]
+
+
+def read_text(material, start=None, end=None):
+    """Same as read_pages(), joined into one string."""
+    return join_pages(text for _, text in read_pages(material, start, end))
+
+
+def page_hashes(material):
+    """Returns {page_number: sha256} without decompressing any text."""
+    return dict(
+        MaterialTextPage.objects.filter(material_text__material=material)
+        .values_list('page_number', 'content_sha256')
+    )
+
+
+def ensure_pages(material):
+    """
+    Makes sure the text of a material is stored, extracting it from the
+    (cached) PDF the first time. Returns the MaterialText row.
+    """
+    material_text = MaterialText.objects.filter(material=material).first()
+    if material_text is not None:
+        return material_text
+
+    with transaction.atomic():
+        # Requests that need the text at the same time wait here for the
+        # first one, then find its text instead of extracting it again.
+        Material.objects.select_for_update().only('pk').get(pk=material.pk)
+        material_text = MaterialText.objects.filter(material=material).first()
+        if material_text is not None:
+            return material_text
+
+        # Pass the cached file's path so extraction can open it directly.
+        path = blob_cache.fetch(material)
+        if os.path.getsize(path) >= settings.PDF_STREAM_THRESHOLD_BYTES:
+            # Very large files are streamed page by page with bounded memory.
+            backend = settings.PDF_TEXT_BACKEND
+            fallback = settings.PDF_TEXT_FALLBACK_BACKEND
+            return save_page_stream(material, iter_pages(path, backend, fallback), backend, fallback)
+
+        return save_pages(material, extract_pages(path))
@@ -0,0 +1,140 @@
+"""
+Vector index for searching across materials.
+
+Every passage of the retrieval index (see retrieval.py, same passage order)
+gets a hashed TF-IDF vector: tokens are hashed into SEARCH_VECTOR_DIM signed
+buckets, term frequencies are dampened with 1 + log(tf), weighted by the
+material's IDF per bucket and L2-normalized. The vectors are stored as a
+float32 matrix in RETRIEVAL_INDEX_DIR/<material_id>.vectors.npy and opened
+memory-mapped, so searching many materials only pages in what it reads.
+Each material's files are rewritten on their own whenever its text is
+saved, and removed with it.
+"""
+import heapq
+import os
+import tempfile
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from . import retrieval, text_store
+
+
+@dataclass
+class SearchHit:
+    material: object
+    page: int
+    score: float
+    snippet: str = ''
+
+
+def _path(material_id, kind):
+    return Path(settings.RETRIEVAL_INDEX_DIR) / f"{material_id}.{kind}.npy"
+
+
+def _bucket(token, dim):
+    """Stable (process-independent) bucket and sign for a token."""
+    h = zlib.crc32(token.encode('utf-8'))
+    return h % dim, 1.0 if (h >> 31) & 1 else -1.0
+
+
+def _hashed_tf(counts_list, dim):
+    matrix = np.zeros((len(counts_list), dim), dtype=np.float32)
+    buckets = {}
+    for row, counts in enumerate(counts_list):
+        for token, tf in counts.items():
+            if token not in buckets:
+                buckets[token] = _bucket(token, dim)
+            column, sign = buckets[token]
+            matrix[row, column] += sign * (1.0 + np.log(tf))
+    return matrix
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _save(path, array):
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.npy.part')
+    with os.fdopen(fd, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def write(material_id, passage_counts):
+    """Builds and stores the vectors of a material's passages (list of Counters)."""
+    dim = settings.SEARCH_VECTOR_DIM
+    tf = _hashed_tf(passage_counts, dim)
+    df = np.count_nonzero(tf, axis=0)
+    idf = (np.log((1 + len(passage_counts)) / (1 + df)) + 1).astype(np.float32)
+    _save(_path(material_id, 'idf'), idf)
+    _save(_path(material_id, 'vectors'), _normalize(tf * idf).astype(np.float32))
+
+
+def delete(material_id):
+    for kind in ('vectors', 'idf'):
+        try:
+            os.remove(_path(material_id, kind))
+        except FileNotFoundError:
+            pass
+
+
+def _open(material):
+    """Returns (vectors, idf) memory-mapped, building the index if it is missing."""
+    vectors_path = _path(material.id, 'vectors')
+    if not vectors_path.exists():
+        if not text_store.has_text(material) or not retrieval.build_index(material):
+            return None, None
+    vectors = np.load(vectors_path, mmap_mode='r')
+    if vectors.shape[1] != settings.SEARCH_VECTOR_DIM:
+        # SEARCH_VECTOR_DIM was changed since this index was built.
+        retrieval.build_index(material)
+        vectors = np.load(vectors_path, mmap_mode='r')
+    return vectors, np.load(_path(material.id, 'idf'))
+
+
+def _query_vector(tokens, idf):
+    query = _hashed_tf([{token: tokens.count(token) for token in set(tokens)}], len(idf))[0]
+    return _normalize(query * idf)
+
+
+def search(materials, query, k=10):
+    """
+    Cosine similarity search over the passages of `materials` (the caller
+    filters them by access). Returns the `k` best SearchHits across all of
+    them, best first, with a snippet of each passage.
+    """
+    tokens = retrieval.tokenize(query)
+    if not tokens:
+        return []
+
+    best = []  # min-heap of (score, order, material, passage index)
+    order = 0
+    for material in materials:
+        vectors, idf = _open(material)
+        if vectors is None or not len(vectors):
+            continue
+        scores = vectors @ _query_vector(tokens, idf)
+        top = np.argpartition(scores, -k)[-k:] if len(scores) > k else np.arange(len(scores))
+        for i in top:
+            if scores[i] <= 0:
+                continue
+            entry = (float(scores[i]), order, material, int(i))
+            order += 1
+            if len(best) < k:
+                heapq.heappush(best, entry)
+            elif entry > best[0]:
+                heapq.heapreplace(best, entry)
+
+    hits = []
+    for score, _, material, i in sorted(best, reverse=True):
+        index = retrieval.load_index(material)
+        start, end, page = int(index['start'][i]), int(index['end'][i]), int(index['page'][i])
+        text = dict(text_store.read_pages(material, numbers=[page])).get(page, '')
+        hits.append(SearchHit(material, page, round(score, 4), text[start:end].strip()[:settings.SEARCH_SNIPPET_CHARS]))
+    return hits
@@ -1,44 +1,100 @@
-import os
-import tempfile
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.parsers import MultiPartParser
 from rest_framework import status
+from django.conf import settings
+from django.core.cache import cache
 from django.db import transaction
+from backend import circuit_breaker
 from .models import Material, MaterialAccess
+from .upload_handlers import DriveUploadHandler, DriveUploadedFile, progress_key
+from .utils import blob_cache, retrieval, text_store, vector_index
 from .utils.drive_api import upload_file_to_drive, generate_public_url, delete_file_from_drive
-from topic_analysis.analysis_service import analyze_material
+from .utils.pdf_text import extract_pages
+from jobs.queue import enqueue, enqueue_many
+
+
+def _local_pdf_source(uploaded_file):
+    """
+    Returns the uploaded PDF as something we can read without copying it again:
+    Django's temp file path for large uploads, or the in-memory bytes.
+    """
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        return uploaded_file.temporary_file_path()
+    uploaded_file.seek(0)
+    return uploaded_file.read()
+
+
+def _sha256_of(source):
+    """SHA-256 of a PDF given as a path or bytes (see _local_pdf_source)."""
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return hashlib.file_digest(f, 'sha256').hexdigest()
+    return hashlib.sha256(source).hexdigest()
+
+
+def _extract_pages_or_none(source, size):
+    if size >= settings.PDF_STREAM_THRESHOLD_BYTES:
+        # Too big to extract in the request; the analysis job streams it
+        # page by page from the local cache instead.
+        return None
+    try:
+        return extract_pages(source)
+    except Exception as e:
+        # The analysis job falls back to extracting from the cached/Drive copy.
+        print(f"Local text extraction failed, analysis will extract it again: {e}")
+        return None
+
 
 class UploadMaterialView(APIView):
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser]
 
     def post(self, request):
+        # Drive is failing: answer 503 before the file is received
+        circuit_breaker.check('drive')
+
+        # Stream the file to Drive (and the local cache) while it is being received
+        request.upload_handlers.insert(0, DriveUploadHandler(request))
+
         uploaded_file = request.FILES.get('file')
         subject = request.data.get('subject')  # Get subject from frontend/form
 
         if not uploaded_file:
             return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
         if not subject:
+            if isinstance(uploaded_file, DriveUploadedFile):
+                uploaded_file.discard()
             return Response({'error': 'Subject is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Save file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            for chunk in uploaded_file.chunks():
-                tmp.write(chunk)
-            tmp_path = tmp.name
+        if isinstance(uploaded_file, DriveUploadedFile):
+            content_sha256 = uploaded_file.sha256
+            duplicate = uploaded_file.duplicate_of
+        else:
+            content_sha256 = _sha256_of(_local_pdf_source(uploaded_file))
+            duplicate = Material.find_by_content(content_sha256)
 
-        # Upload to Google Drive
-        drive_file_id = upload_file_to_drive(tmp_path, uploaded_file.name)
-        os.remove(tmp_path)
+        # Someone already uploaded this exact file: share it, no upload or analysis
+        if duplicate:
+            return self._reuse_material(request, uploaded_file, duplicate)
 
-        if not drive_file_id:
+        if isinstance(uploaded_file, DriveUploadedFile):
+            drive_file, extracted = self._finish_streamed_upload(uploaded_file)
+        else:
+            drive_file, extracted = self._upload_received_file(uploaded_file)
+
+        if not drive_file:
+            circuit_breaker.check('drive')  # 503 if this failure opened the breaker
             return Response({'error': 'Google Drive upload failed'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        drive_file_id = drive_file['id']
 
-        # Generate public URLs
-        public_urls = generate_public_url(drive_file_id)
+        # Generate public URLs (the links already came back with the upload)
+        public_urls = generate_public_url(drive_file_id, drive_file) or {}
         view_url = public_urls.get('view_url')
         download_url = public_urls.get('download_url')
 
@@ -48,30 +104,232 @@ class UploadMaterialView(APIView):
             subject=subject,
             drive_file_id=drive_file_id,
             view_url=view_url,
-            download_url=download_url
+            download_url=download_url,
+            content_sha256=content_sha256,
         )
         MaterialAccess.objects.create(user=request.user, material=material)
 
+        # Store the text we extracted so no later consumer has to parse the PDF
+        if extracted:
+            text_store.save_pages(material, extracted)
 
-        # --- DIRECTLY TRIGGERING ANALYSIS ---
-        # WARNING: This will block the request and may cause a timeout on the server.
-        # This is NOT recommended for production use. A background task queue
-        # like Celery is the appropriate solution.
-        print("--- Starting analysis directly after upload... ---")
-        analyze_material(material.id)
-        print("--- Direct analysis finished. ---")
-        # --- END OF DIRECT CALL ---
-
-
+        # Analysis runs in a background worker (`manage.py run_worker`)
+        job = enqueue('analyze_material', {'material_id': material.id}, user=request.user)
 
         return Response({
-            'message': 'File uploaded successfully',
+            'message': 'File uploaded successfully. Analysis has been queued.',
             'material_id': material.id,
             'drive_file_id': drive_file_id,
             'subject': subject,
             'view_url': view_url,
-            'download_url': download_url
-        }, status=status.HTTP_201_CREATED)
+            'download_url': download_url,
+            'job_id': job.id,
+        }, status=status.HTTP_202_ACCEPTED)
+
+    def _reuse_material(self, request, uploaded_file, material):
+        """Gives the user access to an existing material with the same content."""
+        if isinstance(uploaded_file, DriveUploadedFile):
+            uploaded_file.cancel_drive_upload()
+            if blob_cache.lookup(material.drive_file_id):
+                uploaded_file.discard()
+            else:
+                # Same bytes, so the upload can stand in for the cached copy
+                try:
+                    uploaded_file.commit_to_cache(material.drive_file_id)
+                except Exception as e:
+                    print(f"Could not cache uploaded PDF {material.drive_file_id}: {e}")
+                    uploaded_file.discard()
+
+        MaterialAccess.objects.get_or_create(user=request.user, material=material)
+
+        return Response({
+            'message': 'This file was already uploaded; it has been added to your materials.',
+            'material_id': material.id,
+            'drive_file_id': material.drive_file_id,
+            'subject': material.subject,
+            'view_url': material.view_url,
+            'download_url': material.download_url,
+            'duplicate': True,
+        }, status=status.HTTP_200_OK)
+
+    def _finish_streamed_upload(self, uploaded_file):
+        """
+        The upload handler has already sent (most of) the file to Drive.
+        Extract the text from the staged local copy while the last chunks
+        go out, then keep that copy in the PDF cache.
+        """
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            text_future = pool.submit(
+                _extract_pages_or_none, uploaded_file.temporary_file_path(), uploaded_file.size
+            )
+            try:
+                drive_file = uploaded_file.drive_result()
+            except Exception as e:
+                print(f"Resumable upload to Drive failed: {e}")
+                drive_file = None
+            extracted = text_future.result()
+
+        if not drive_file:
+            uploaded_file.discard()
+            return None, None
+
+        try:
+            uploaded_file.commit_to_cache(drive_file['id'])
+        except Exception as e:
+            print(f"Could not cache uploaded PDF {drive_file['id']}: {e}")
+            uploaded_file.writer.discard()
+        return drive_file, extracted
+
+    def _upload_received_file(self, uploaded_file):
+        """Fallback for files received by Django's default upload handlers."""
+        # Upload to Google Drive and extract the text at the same time,
+        # both straight from the upload we already have.
+        source = _local_pdf_source(uploaded_file)
+        drive_source = source if isinstance(source, str) else io.BytesIO(source)
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            upload_future = pool.submit(upload_file_to_drive, drive_source, uploaded_file.name)
+            text_future = pool.submit(_extract_pages_or_none, source, uploaded_file.size)
+            drive_file = upload_future.result()
+            extracted = text_future.result()
+
+        if drive_file:
+            # Keep a local copy so quiz generation never has to fetch it from Drive
+            try:
+                blob_cache.put(drive_file['id'], source)
+            except Exception as e:
+                print(f"Could not cache uploaded PDF {drive_file['id']}: {e}")
+        return drive_file, extracted
+
+
+def _upload_one(uploaded_file):
+    """
+    Uploads one file of a bulk request to Drive and caches it locally.
+    Runs on a pool thread; returns (drive metadata or None, public urls).
+    """
+    source = _local_pdf_source(uploaded_file)
+    drive_source = source if isinstance(source, str) else io.BytesIO(source)
+    drive_file = upload_file_to_drive(drive_source, uploaded_file.name)
+    if not drive_file:
+        return None, {}
+
+    try:
+        blob_cache.put(drive_file['id'], source)
+    except Exception as e:
+        print(f"Could not cache uploaded PDF {drive_file['id']}: {e}")
+    return drive_file, generate_public_url(drive_file['id'], drive_file) or {}
+
+
+class BulkUploadMaterialView(APIView):
+    """
+    Uploads many PDFs (the `files` field) under one subject in a single
+    request. Files are sent to Drive concurrently, at most
+    BULK_UPLOAD_CONCURRENCY at a time, and all analyses are queued together.
+    Returns one result per file, in request order.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        circuit_breaker.check('drive')
+        files = request.FILES.getlist('files')
+        subject = request.data.get('subject')
+
+        if not files:
+            return Response({'error': 'No files provided'}, status=status.HTTP_400_BAD_REQUEST)
+        if not subject:
+            return Response({'error': 'Subject is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(files) > settings.BULK_UPLOAD_MAX_FILES:
+            return Response(
+                {'error': f'At most {settings.BULK_UPLOAD_MAX_FILES} files can be uploaded at once'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        hashes = [_sha256_of(_local_pdf_source(f)) for f in files]
+        existing = {
+            material.content_sha256: material
+            for material in Material.objects.filter(content_sha256__in=set(hashes)).order_by('-id')
+        }
+
+        # Upload each distinct new file once; repeats within the request share it
+        to_upload = {}
+        for uploaded_file, sha in zip(files, hashes):
+            if sha not in existing and sha not in to_upload:
+                to_upload[sha] = uploaded_file
+
+        uploaded = {}
+        if to_upload:
+            with ThreadPoolExecutor(max_workers=min(settings.BULK_UPLOAD_CONCURRENCY, len(to_upload))) as pool:
+                futures = {sha: pool.submit(_upload_one, f) for sha, f in to_upload.items()}
+                for sha, future in futures.items():
+                    try:
+                        uploaded[sha] = future.result()
+                    except Exception as e:
+                        print(f"Bulk upload of {to_upload[sha].name} failed: {e}")
+                        uploaded[sha] = (None, {})
+
+        new_materials = [
+            Material(
+                title=to_upload[sha].name,
+                subject=subject,
+                drive_file_id=drive_file['id'],
+                view_url=urls.get('view_url'),
+                download_url=urls.get('download_url'),
+                content_sha256=sha,
+            )
+            for sha, (drive_file, urls) in uploaded.items() if drive_file
+        ]
+        with transaction.atomic():
+            created = Material.objects.bulk_create(new_materials)
+            materials = {**existing, **{m.content_sha256: m for m in created}}
+            MaterialAccess.objects.bulk_create(
+                [MaterialAccess(user=request.user, material=m) for m in materials.values()],
+                ignore_conflicts=True,
+            )
+            jobs = enqueue_many(
+                'analyze_material',
+                [{'material_id': m.id} for m in created],
+                user=request.user,
+            )
+        job_ids = {m.id: job.id for m, job in zip(created, jobs)}
+
+        results = []
+        seen = set(existing)
+        for uploaded_file, sha in zip(files, hashes):
+            material = materials.get(sha)
+            if material is None:
+                results.append({'file': uploaded_file.name, 'status': 'failed', 'error': 'Google Drive upload failed'})
+                continue
+            results.append({
+                'file': uploaded_file.name,
+                'status': 'duplicate' if sha in seen else 'uploaded',
+                'material_id': material.id,
+                'drive_file_id': material.drive_file_id,
+                'view_url': material.view_url,
+                'download_url': material.download_url,
+                'job_id': job_ids.pop(material.id, None),
+            })
+            seen.add(sha)
+
+        failed = sum(1 for result in results if result['status'] == 'failed')
+        return Response({
+            'message': f'{len(results) - failed} of {len(results)} files uploaded. Analysis has been queued.',
+            'subject': subject,
+            'results': results,
+        }, status=status.HTTP_207_MULTI_STATUS if failed else status.HTTP_202_ACCEPTED)
+
+
+class UploadProgressView(APIView):
+    """
+    Reports how many bytes of an upload Drive has acknowledged. The client
+    picks an id and sends it as the X-Upload-ID header of the upload request.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, upload_id, *args, **kwargs):
+        progress = cache.get(progress_key(request.user.id, upload_id))
+        if progress is None:
+            return Response({'error': 'Unknown upload.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(progress, status=status.HTTP_200_OK)
 
 
 
@@ -99,6 +357,40 @@ class MaterialListView(APIView):
         return Response(data)
 
 
+class MaterialSearchView(APIView):
+    """
+    Searches the text of every material the user has access to.
+    GET ?q=<query>&k=<max results>
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'Query parameter "q" is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            k = min(max(int(request.query_params.get('k', 10)), 1), settings.SEARCH_MAX_RESULTS)
+        except ValueError:
+            return Response({'error': '"k" must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        materials = Material.objects.filter(materialaccess__user=request.user).distinct()
+        hits = vector_index.search(materials, query, k=k)
+        return Response({
+            'query': query,
+            'results': [
+                {
+                    'material_id': hit.material.id,
+                    'title': hit.material.title,
+                    'page': hit.page,
+                    'score': hit.score,
+                    'snippet': hit.snippet,
+                    'view_url': hit.material.view_url,
+                }
+                for hit in hits
+            ],
+        })
+
+
 
 class DeleteMaterialView(APIView):
     """
@@ -120,7 +412,15 @@ class DeleteMaterialView(APIView):
                     status=status.HTTP_403_FORBIDDEN
                 )
 
+            # Materials are shared between everyone who uploaded the same file;
+            # while others still have it, only this user's access is removed.
+            if MaterialAccess.objects.filter(material=material).exclude(user=user).exists():
+                MaterialAccess.objects.filter(user=user, material=material).delete()
+                return Response(status=status.HTTP_204_NO_CONTENT)
+
             drive_id = material.drive_file_id
+            if drive_id:
+                circuit_breaker.check('drive')  # 503 + Retry-After while Drive is failing
 
             # 3. Use a database transaction to ensure data consistency.
             # This means if the Drive delete fails, the database won't be changed.
@@ -129,6 +429,8 @@ class DeleteMaterialView(APIView):
                 if drive_id:
                     try:
                         delete_file_from_drive(drive_id)
+                    except circuit_breaker.CircuitOpenError:
+                        raise
                     except Exception as e:
                         # If the drive delete fails, roll back the transaction
                         # and return an error.
@@ -141,6 +443,10 @@ class DeleteMaterialView(APIView):
                 #    delete the material from the database.
                 material.delete()
 
+            if drive_id:
+                blob_cache.invalidate(drive_id)
+            retrieval.delete_index(material_id)
+
             # 6. Return a "No Content" response
             return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -149,8 +455,22 @@ class DeleteMaterialView(APIView):
                 {"error": "Material not found."},
                 status=status.HTTP_404_NOT_FOUND
             )
+        except circuit_breaker.CircuitOpenError:
+            raise  # DRF answers 503 with Retry-After
         except Exception as e:
             return Response(
                 {"error": f"An unexpected error occurred: {str(e)}"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
\ No newline at end of file
+            )
+
+
+class PdfCacheStatsView(APIView):
+    """
+    Reports hit/miss counters and disk usage of the local PDF cache (staff only).
+    The counters are kept in the Django cache: they cover every process only
+    when CACHES is a shared backend (e.g. Redis), not the default LocMemCache.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(blob_cache.stats(), status=status.HTTP_200_OK)
@@ -0,0 +1,38 @@
+"""
+What a generated question must look like before it is saved as a QuizQuestion.
+"""
+import re
+
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+
+from llm.validation import ItemValidator
+
+OPTION_MAX_LENGTH = 255
+
+
+class QuestionSchema(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True, coerce_numbers_to_str=True)
+
+    question_text: str = Field(min_length=1)
+    option_a: str = Field(min_length=1)
+    option_b: str = Field(min_length=1)
+    option_c: str = Field(min_length=1)
+    option_d: str = Field(min_length=1)
+    correct_option: str
+
+    @field_validator('option_a', 'option_b', 'option_c', 'option_d')
+    @classmethod
+    def fit_option(cls, value):
+        return value[:OPTION_MAX_LENGTH]
+
+    @field_validator('correct_option')
+    @classmethod
+    def option_letter(cls, value):
+        # "a", "B)", "Option C", "(D)" -> the letter
+        match = re.fullmatch(r'(?:option\s*)?\(?([a-d])\)?[.):]?', value.strip(), re.IGNORECASE)
+        if not match:
+            raise ValueError("must be one of A, B, C or D")
+        return match.group(1).upper()
+
+
+QUESTIONS = ItemValidator(QuestionSchema, 'question')
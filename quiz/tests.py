@@ -1,3 +1,90 @@
-from django.test import TestCase
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+
+from llm import fake
+from materials.models import Material
+from materials.tests import FakeBackendsMixin
+from materials.utils.retrieval import Passage
+from topic_analysis.models import Topic
+
+from .models import QuizQuestion
+from .utils.question_generator import generate_questions_with_gemini
+from .views import topic_context
+
+
+@override_settings(QUIZ_CONTEXT_MARGIN_PAGES=1, QUIZ_CONTEXT_MAX_CHARS=100_000)
+class TopicContextTests(FakeBackendsMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.login()
+        response = self.upload(pages=7)
+        self.material = Material.objects.get(id=response.data['material_id'])
+
+    def topic(self, start=None, end=None, name='Sorting'):
+        return Topic.objects.create(
+            material=self.material, topic_name=name, difficulty_score=5, difficulty_class='medium',
+            summary='About sorting.', sequence_number=Topic.objects.count() + 1, start_page=start, end_page=end,
+        )
+
+    def headings(self, text):
+        return [page for page in range(1, 8) if f"Chapter 1.{page}:" in text]
+
+    def test_context_is_the_page_span_plus_a_margin(self):
+        self.assertEqual(self.headings(topic_context(self.topic(3, 4))), [2, 3, 4, 5])
+        self.assertEqual(self.headings(topic_context(self.topic(1, 1))), [1, 2])
+
+    def test_margin_is_dropped_first_when_over_the_limit(self):
+        topic = self.topic(3, 4)
+        with_margin = topic_context(topic)
+        with override_settings(QUIZ_CONTEXT_MARGIN_PAGES=0):
+            span_only = topic_context(topic)
+        with override_settings(QUIZ_CONTEXT_MAX_CHARS=len(span_only) + 10):
+            self.assertEqual(self.headings(topic_context(topic)), [3, 4])
+        self.assertGreater(len(with_margin), len(span_only))
+
+    def test_topic_without_a_span_uses_the_best_passages_in_page_order(self):
+        passages = [Passage(5, 0, 10, 2.0, 'from page five'), Passage(2, 0, 10, 1.0, 'from page two')]
+        with mock.patch('quiz.views.retrieval.top_passages', return_value=passages) as top:
+            context = topic_context(self.topic())
+        self.assertEqual(context, 'from page two\nfrom page five')
+        self.assertIn('Sorting', top.call_args.args[1])
+
+    def test_questions_are_generated_from_the_topic_pages_only(self):
+        self.addCleanup(setattr, fake, 'responder', fake.answer)
+        prompts = []
+
+        def responder(model, prompt):
+            prompts.append(prompt)
+            return fake.answer(model, prompt)
+        fake.responder = responder
+
+        topic = self.topic(6, 6)
+        response = self.client.post(f'/api/quiz/generate/{topic.id}/')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.headings(prompts[0]), [5, 6, 7])
+        self.assertEqual(QuizQuestion.objects.filter(topic=topic).count(), response.data['questions_created'])
+
+
+class QuestionGeneratorTests(FakeBackendsMixin, TestCase):
+
+    def test_rejected_questions_are_asked_for_again(self):
+        self.addCleanup(setattr, fake, 'responder', fake.answer)
+        question = {'question_text': 'Q?', 'option_a': 'a', 'option_b': 'b', 'option_c': 'c', 'option_d': 'd'}
+        answers = iter([
+            json.dumps([{**question, 'correct_option': 'A'}, {**question, 'correct_option': 'Z'}]),
+            json.dumps([{**question, 'correct_option': 'b)'}]),
+        ])
+        prompts = []
+
+        def responder(model, prompt):
+            prompts.append(prompt)
+            return next(answers)
+        fake.responder = responder
+
+        questions = generate_questions_with_gemini('Sorting', 'study text', num_questions=2)
+        self.assertEqual([q['correct_option'] for q in questions], ['A', 'B'])
+        self.assertEqual(len(prompts), 2)
+        self.assertIn('Return ONLY 1 new questions', prompts[1])
@@ -1,22 +1,16 @@
 # quiz/utils/pdf_utils.py
 
-import pdfplumber
-import io # ✅ Import io
+from materials.utils.pdf_text import extract_text
 
-# ✅ Change 'pdf_path' to 'pdf_bytes'
-def extract_text_from_pdf(pdf_bytes):
+
+def extract_text_from_pdf(pdf_source):
     """
-    Extract readable text from PDF bytes using pdfplumber.
+    Extract readable text from a PDF using pdfplumber.
+    `pdf_source` may be bytes, a path or a binary file object.
     Returns the combined text of all pages.
     """
-    text = ""
     try:
-        # ✅ Use io.BytesIO() to read the bytes
-        with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
+        return extract_text(pdf_source).strip()
     except Exception as e:
         print(f"[ERROR] Failed to extract PDF text: {e}")
-    return text.strip()
\ No newline at end of file
+        return ""
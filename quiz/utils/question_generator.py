@@ -1,10 +1,6 @@
-import google.generativeai as genai
-import json
-import os
-
-# Configure Gemini API
-genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
-model = genai.GenerativeModel("models/gemini-pro-latest")
+from llm.gateway import LLMError, INTERACTIVE
+from llm.json_stream import generate_items
+from quiz.schemas import QUESTIONS
 
 
 def generate_questions_with_gemini(topic_title, pdf_text, num_questions=5):
@@ -40,15 +36,22 @@ def generate_questions_with_gemini(topic_title, pdf_text, num_questions=5):
     ]
     """
 
+    questions = []
+
+    def keep_valid(items):
+        # Rejected questions count as missing and are asked for again
+        valid, _ = QUESTIONS.validate(items)
+        questions.extend(q.model_dump() for q in valid)
+
+    def missing_questions(items, complete):
+        missing = num_questions - len(questions)
+        if missing <= 0:
+            return None
+        asked = "\n".join(f"- {q['question_text']}" for q in questions)
+        return f"{prompt}\n    Already generated (do not repeat):\n{asked}\n\n    Return ONLY {missing} new questions."
+
     try:
-        response = model.generate_content(prompt)
-        text_output = response.text.strip()
-        # Attempt to load JSON
-        questions = json.loads(text_output)
-        return questions
-    except json.JSONDecodeError:
-        print("[ERROR] Gemini returned invalid JSON")
-        return None
-    except Exception as e:
+        generate_items(prompt, priority=INTERACTIVE, missing_prompt=missing_questions, on_items=keep_valid, cache=False, task='quiz')
+    except LLMError as e:
         print(f"[ERROR] Gemini request failed: {e}")
-        return None
+    return questions or None
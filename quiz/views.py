@@ -1,3 +1,5 @@
+import logging
+
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
@@ -5,14 +7,44 @@ from rest_framework import status
 from django.conf import settings
  
 from topic_analysis.models import Topic
+from materials.utils import retrieval, text_store
+from materials.utils.pdf_text import join_pages
 from .models import QuizQuestion,QuizResult
-from .utils.pdf_utils import extract_text_from_pdf
-import google.generativeai as genai
-import json, os
+from .schemas import QUESTIONS
+from backend.circuit_breaker import retry_after_headers
+from llm.gateway import LLMError, INTERACTIVE
+from llm.json_stream import generate_items
+
+logger = logging.getLogger(__name__)
+
+QUESTIONS_PER_TOPIC = 10
 
-# Configure Gemini
-genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
-model = genai.GenerativeModel('models/gemini-pro-latest')
+
+def topic_context(topic):
+    """
+    The study material to generate a topic's questions from: its page span
+    plus QUIZ_CONTEXT_MARGIN_PAGES on either side. For topics analyzed
+    before page spans were recorded, the passages that best match the topic
+    name (BM25). Capped at QUIZ_CONTEXT_MAX_CHARS; the margins are dropped first.
+    """
+    limit = settings.QUIZ_CONTEXT_MAX_CHARS
+    if not topic.start_page:
+        passages = retrieval.top_passages(
+            topic.material, f"{topic.topic_name} {topic.summary}",
+            k=settings.QUIZ_CONTEXT_PASSAGES, token_budget=limit // 4,
+        )
+        # Keep the document's order, it reads better than score order.
+        passages.sort(key=lambda p: (p.page, p.start))
+        text = "\n".join(p.text for p in passages) or text_store.read_text(topic.material)
+        return text[:limit]
+
+    start, end = topic.start_page, topic.end_page or topic.start_page
+    margin = settings.QUIZ_CONTEXT_MARGIN_PAGES
+    pages = text_store.read_pages(topic.material, max(1, start - margin), end + margin)
+
+    span = join_pages(text for number, text in pages if start <= number <= end)
+    with_margin = join_pages(text for _, text in pages)
+    return (with_margin if len(with_margin) <= limit else span)[:limit]
 
 
 class GenerateQuestionsView(APIView):
@@ -29,27 +61,24 @@ class GenerateQuestionsView(APIView):
         if not pdf_url:
             return Response({'error': 'PDF URL not found for this topic'}, status=status.HTTP_404_NOT_FOUND)
 
-        # Download PDF content
+        # Read the stored text (extracted from the cached PDF the first time):
+        # just the topic's pages plus a margin when analysis recorded them
         try:
-            import requests
-            response = requests.get(pdf_url)
-            response.raise_for_status()
-            pdf_bytes = response.content
+            text_store.ensure_pages(topic.material)
+            pdf_text = topic_context(topic)
         except Exception as e:
             return Response({'error': f'Failed to download PDF: {e}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # Extract PDF text
-        pdf_text = extract_text_from_pdf(pdf_bytes)
         topic_title = topic.topic_name
 
         # Create prompt for Gemini
         prompt = f"""
 You are a quiz generator.
 
-Generate 10 multiple choice questions (A–D) about the topic "{topic_title}".
+Generate {QUESTIONS_PER_TOPIC} multiple choice questions (A–D) about the topic "{topic_title}".
 Use the following study material for context.
 
-{pdf_text[:12000]}
+{pdf_text}
 
 Return the output strictly as JSON in this format:
 [
@@ -63,41 +92,35 @@ Return the output strictly as JSON in this format:
   }}
 ]
 """
-
-        # Generate questions using Gemini
+        questions = []
+
+        def save_questions(items):
+            # Saved as the questions arrive, so a cut-off answer keeps what it had;
+            # rejected questions count as missing and are asked for again
+            valid, _ = QUESTIONS.validate(items)
+            QuizQuestion.objects.bulk_create([QuizQuestion(topic=topic, **q.model_dump()) for q in valid])
+            questions.extend(q.model_dump() for q in valid)
+
+        def missing_questions(items, complete):
+            missing = QUESTIONS_PER_TOPIC - len(questions)
+            if missing <= 0:
+                return None
+            asked = "\n".join(f"- {q['question_text']}" for q in questions)
+            return f"{prompt}\nThese questions were already generated:\n{asked}\n\nReturn ONLY {missing} new questions, in the same JSON format."
+
+        # Generate questions using Gemini (interactive: the user is waiting)
         try:
-            response = model.generate_content(prompt)
-            output_text = response.text.strip()
-
-            # Remove ```json and ``` markers
-            if output_text.startswith("```json"):
-                output_text = output_text[len("```json"):].strip()
-            if output_text.startswith("```"):
-                output_text = output_text[3:].strip()
-            if output_text.endswith("```"):
-                output_text = output_text[:-3].strip()
-
-            # Parse JSON
-            questions = json.loads(output_text)
-        except json.JSONDecodeError:
-            return Response({
-                "error": "Gemini returned invalid JSON",
-                "raw_output": output_text
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            # Not cached: asking again should give a fresh set of questions
+            generate_items(prompt, priority=INTERACTIVE, missing_prompt=missing_questions, on_items=save_questions, cache=False, task='quiz')
+        except LLMError as e:
+            if not questions:
+                return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers=retry_after_headers(e))
+            logger.warning("Quiz generation stopped early, keeping %d questions: %s", len(questions), e)
         except Exception as e:
             return Response({"error": f"Failed to generate questions: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # Save questions to DB
-        for q in questions:
-            QuizQuestion.objects.create(
-                topic=topic,
-                question_text=q.get("question_text"),
-                option_a=q.get("option_a"),
-                option_b=q.get("option_b"),
-                option_c=q.get("option_c"),
-                option_d=q.get("option_d"),
-                correct_option=q.get("correct_option"),
-            )
+        if not questions:
+            return Response({"error": "Gemini returned no usable questions"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         return Response({
             "topic": topic_title,
@@ -0,0 +1,49 @@
+"""
+What a study plan day from the LLM must look like before its TimeSlotTasks are saved.
+"""
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+
+from llm.validation import ItemValidator
+
+
+class SlotSchema(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True, coerce_numbers_to_str=True)
+
+    duration: str = Field(min_length=1)
+    subject: str = Field(min_length=1)
+    topics: str = Field(min_length=1)
+    notes: str = ''
+
+    @field_validator('duration', mode='before')
+    @classmethod
+    def hours(cls, value):
+        # 2 -> "2 hours"
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return f"{value:g} hour" + ('' if value == 1 else 's')
+        return value
+
+    @field_validator('topics', mode='before')
+    @classmethod
+    def join_topics(cls, value):
+        # ["Variables", "Data Types"] -> "Variables, Data Types"
+        if isinstance(value, list):
+            return ', '.join(str(topic) for topic in value)
+        return value
+
+    @field_validator('duration')
+    @classmethod
+    def fit_duration(cls, value):
+        return value[:100]
+
+    @field_validator('subject')
+    @classmethod
+    def fit_subject(cls, value):
+        return value[:255]
+
+
+class PlanDaySchema(BaseModel):
+    day: int = Field(ge=1)
+    tasks: list[SlotSchema] = Field(min_length=1)
+
+
+PLAN_DAYS = ItemValidator(PlanDaySchema, 'study plan day')
@@ -1,25 +1,69 @@
 # timetable/views.py
 
-import os
-import json
+import logging
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
-import google.generativeai as genai
 from collections import defaultdict
+from django.db import transaction
+
+from backend.circuit_breaker import retry_after_headers
+from llm.gateway import LLMError, INTERACTIVE
+from llm.json_stream import generate_items
 
 from materials.models import Material
 # ✅ Import the updated TimeSlotTask model
 from .models import StudyPlanRequest, StudyPlan, TimeSlotTask
 from topic_analysis.models import Topic 
+from .schemas import PLAN_DAYS
+
+logger = logging.getLogger(__name__)
+
+
+def _stream_plan(prompt, total_days, task, on_day=None):
+    """
+    Streams the plan's days from Gemini, calling `on_day(day)` for each new
+    valid day as soon as it arrives. Days missing from the answer (cut off
+    or broken) are asked for again. Returns {day number: day}; raises
+    LLMError if not a single day arrived.
+    """
+    days = {}
+
+    def add_days(items):
+        valid, _ = PLAN_DAYS.validate(items)
+        for day in valid:
+            # Days outside the plan or already received are ignored; rejected days are asked for again
+            if day.day > total_days or day.day in days:
+                continue
+            days[day.day] = day
+            if on_day:
+                on_day(day)
 
-# --- Gemini API Setup (unchanged) ---
-GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    print("⚠️ Warning: GEMINI_API_KEY not set.")
-else:
-    genai.configure(api_key=GEMINI_API_KEY)
+    def missing_days(items, complete):
+        missing = [str(n) for n in range(1, total_days + 1) if n not in days]
+        if not missing:
+            return None
+        return (
+            f"{prompt}\nThe plan for the other days is already done. "
+            f"Return ONLY the plan for day(s) {', '.join(missing)}, in the same JSON format."
+        )
+
+    try:
+        generate_items(prompt, priority=INTERACTIVE, missing_prompt=missing_days, on_items=add_days, task=task)
+    except LLMError as e:
+        if not days:
+            raise
+        logger.warning("Study plan generation stopped early, keeping %d days: %s", len(days), e)
+    return days
+
+
+def _day_tasks(plan, day):
+    return [TimeSlotTask(study_plan=plan, day=day.day, **slot.model_dump()) for slot in day.tasks]
+
+
+def _plan_json(days):
+    return {"study_plan": [days[n].model_dump() for n in sorted(days)]}
 
 
 # --- StudyPlanDetailView (✅ MODIFIED) ---
@@ -158,60 +202,35 @@ Here are the student's materials and the specific topics to cover:
 **Crucial:** The "topics" field must contain **only the topic names**.
 """
 
-            # 5️⃣ Call Gemini API (unchanged)
-            model = genai.GenerativeModel('models/gemini-pro-latest') 
-            response = model.generate_content(prompt)
-            result_text = (
-                response.text.strip()
-                .replace("```json", "")
-                .replace("```", "")
-                .strip()
-            )
+            # 5️⃣ Call Gemini through the shared gateway, saving each day as it arrives
+            plan = None
 
-            # 6️⃣ Parse JSON (unchanged)
-            try:
-                plan_json = json.loads(result_text)
-            except json.JSONDecodeError:
+            def save_day(day):
+                nonlocal plan
+                if plan is None:
+                    plan_request = StudyPlanRequest.objects.create(
+                        user=request.user,
+                        total_days=total_days,
+                        hours_per_day=hours_per_day
+                    )
+                    plan_request.materials.set(materials)
+                    plan = StudyPlan.objects.create(request=plan_request)
+                TimeSlotTask.objects.bulk_create(_day_tasks(plan, day))
+
+            plan_json = _plan_json(_stream_plan(prompt, total_days, 'plan', on_day=save_day))
+
+            # 6️⃣ Nothing usable came back
+            if not plan_json["study_plan"]:
                 print("--- GEMINI FAILED TO RETURN VALID JSON ---")
-                print(result_text)
-                print("------------------------------------------")
                 return Response(
-                    {"error": "Failed to generate study plan. The AI returned an invalid format.", "raw_response": result_text},
+                    {"error": "Failed to generate study plan. The AI returned an invalid format."},
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR
                 )
 
-            # 7️⃣ [✅ NEW SAVING LOGIC]
-            plan_request = StudyPlanRequest.objects.create(
-                user=request.user,
-                total_days=total_days,
-                hours_per_day=hours_per_day
-            )
-            plan_request.materials.set(materials)
-            study_plan = StudyPlan.objects.create(request=plan_request)
-
-            tasks_to_create = []
-            for day_data in plan_json.get("study_plan", []):
-                day_number = day_data.get("day")
-                if not day_number:
-                    continue
-                
-                for slot_data in day_data.get("tasks", []):
-                    tasks_to_create.append(
-                        TimeSlotTask(
-                            study_plan=study_plan,
-                            day=day_number,
-                            # ✅ Use duration
-                            duration=slot_data.get("duration", "N/A"),
-                            subject=slot_data.get("subject", "N/A"),
-                            topics=slot_data.get("topics", ""),
-                            notes=slot_data.get("notes", "")
-                        )
-                    )
-            
-            TimeSlotTask.objects.bulk_create(tasks_to_create)
-
             return Response(plan_json, status=200)
 
+        except LLMError as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers=retry_after_headers(e))
         except Exception as e:
             return Response({"error": str(e)}, status=500)
 
@@ -323,49 +342,27 @@ You should also increase focus on any related topics. Allocate more time (longer
 }}
 """
             
-            # 8️⃣ Call Gemini API
-            model = genai.GenerativeModel('models/gemini-pro-latest')
-            response = model.generate_content(prompt)
-            result_text = (
-                response.text.strip()
-                .replace("```json", "")
-                .replace("```", "")
-                .strip()
-            )
+            # 8️⃣ Call Gemini through the shared gateway; the new days are kept
+            # in memory until the whole plan is there
+            days = _stream_plan(prompt, total_days, 'plan-update')
 
-            # 9️⃣ Parse JSON
-            try:
-                plan_json = json.loads(result_text)
-            except json.JSONDecodeError:
+            # 9️⃣ The plan is incomplete: the old one is kept
+            if len(days) < total_days:
                 return Response(
-                    {"error": "AI returned invalid JSON.", "raw_response": result_text},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                    {"error": f"The AI returned {len(days)} of the {total_days} days. Your current plan was kept, please try again."},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE
                 )
 
-            # 1️⃣0️⃣ Delete the OLD tasks and save the NEW tasks
-            latest_plan.time_slot_tasks.all().delete() # Delete old plan slots
-
-            tasks_to_create = []
-            for day_data in plan_json.get("study_plan", []):
-                day_number = day_data.get("day")
-                if not day_number: continue
-                
-                for slot_data in day_data.get("tasks", []):
-                    tasks_to_create.append(
-                        TimeSlotTask(
-                            study_plan=latest_plan, # Link to the *same* plan
-                            day=day_number,
-                            duration=slot_data.get("duration", "N/A"),
-                            subject=slot_data.get("subject", "N/A"),
-                            topics=slot_data.get("topics", ""),
-                            notes=slot_data.get("notes", "")
-                        )
-                    )
-            
-            TimeSlotTask.objects.bulk_create(tasks_to_create)
+            # 1️⃣0️⃣ Delete the OLD tasks and save the NEW tasks, together
+            with transaction.atomic():
+                latest_plan.time_slot_tasks.all().delete()
+                TimeSlotTask.objects.bulk_create([task for n in sorted(days) for task in _day_tasks(latest_plan, days[n])])
+            plan_json = _plan_json(days)
 
             # 1️⃣1️⃣ Return the new plan
             return Response(plan_json, status=status.HTTP_200_OK)
 
+        except LLMError as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers=retry_after_headers(e))
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
@@ -1,28 +1,33 @@
-import os
+import hashlib
 import requests
-import pdfplumber
-import json
-from io import BytesIO
-import google.generativeai as genai
+from concurrent.futures import ThreadPoolExecutor
 
 from django.conf import settings
-from .models import Topic
+from django.db import connection, transaction
+from django.db.models import F
+from llm.gateway import LLMError, BACKGROUND
+from llm.json_stream import generate_items
+from .chunking import Chunk, clamp_pages, merge_topics, normalize_topic_name, split_pages
+from .models import AnalyzedSection, Topic
+from .schemas import TOPICS
 from materials.models import Material
+from materials.utils import text_store
+from materials.utils.pdf_text import ExtractionMemoryError, join_pages
+
+# Added to sequence numbers while topics are renumbered (see save_topics).
+RENUMBER_OFFSET = 100000
+
 
 def call_llm_for_analysis(text_content: str) -> list:
     """
     Calls the Google Gemini API to analyze the text content of a PDF.
+    Returns the list of topics (dicts) found in it, checked against
+    TopicSchema; topics that do not fit are left out.
+    Raises LLMError if the API cannot be reached (the job retries later).
     """
     print("--- CALLING GOOGLE GEMINI API ---")
-    try:
-        # Configure the API key from Django settings
-        genai.configure(api_key=os.environ.get('GEMINI_API_KEY'))
-
-        # Use the updated model name: 'gemini-1.5-flash'
-        model = genai.GenerativeModel('models/gemini-pro-latest')
-
-        # This is the detailed prompt that instructs the AI
-        prompt = f"""
+    # This is the detailed prompt that instructs the AI
+    prompt = f"""
         Analyze the following text content extracted from an educational PDF document.
         Your task is to identify the main topics discussed, evaluate their difficulty,
         and provide a brief summary for each.
@@ -31,6 +36,8 @@ def call_llm_for_analysis(text_content: str) -> list:
         include any introductory text, explanations, or markdown formatting like ```json.
         The JSON array should be the only thing in your response.
 
+        Each page of the text starts with a marker like [Page 12].
+
         Each object in the array should represent a single topic and must have the
         following structure:
         {{
@@ -38,7 +45,9 @@ def call_llm_for_analysis(text_content: str) -> list:
           "difficulty_score": A float between 1.0 and 10.0,
           "difficulty_class": A string which is one of "easy", "medium", or "hard",
           "summary": "A concise, 2-3 sentence summary of the topic's content.",
-          "sequence_number": An integer representing the order in which the topics appear.
+          "sequence_number": An integer representing the order in which the topics appear,
+          "start_page": The number of the page (from the markers) where the topic starts,
+          "end_page": The number of the page where the topic ends.
         }}
 
         Here is the text content to analyze:
@@ -47,99 +56,212 @@ def call_llm_for_analysis(text_content: str) -> list:
         ---
         """
 
-        response = model.generate_content(prompt)
-        
-        # Add detailed logging to see the exact response from the API
-        print("--- RAW API Response Text ---")
-        print(response.text)
-        print("--- End of RAW API Response ---")
-
-        # Clean the response to ensure it's just the JSON part
-        cleaned_text = response.text.strip().replace("```json", "").replace("```", "").strip()
-        
-        return json.loads(cleaned_text)
-
-    except json.JSONDecodeError as e:
-        print(f"Error decoding JSON from API response: {e}")
-        return []
-    except Exception as e:
-        print(f"An error occurred while calling the Gemini API: {e}")
-        return []
+    def missing_topics(topics, complete):
+        # Only a cut-off answer is missing topics; ask for the ones after the last we got.
+        if complete:
+            return None
+        names = ', '.join(f'"{t.get("topic_name")}"' for t in topics if isinstance(t, dict))
+        return (
+            f"{prompt}\n"
+            f"Your previous answer was cut off. It already covered these topics: {names or 'none'}.\n"
+            f"Return ONLY the remaining topics, as a JSON array in the same format, continuing the sequence numbers."
+        )
+
+    # Analysis runs in a background job, so quiz requests go first
+    topics = generate_items(prompt, priority=BACKGROUND, missing_prompt=missing_topics, task='analysis')
+    valid, rejects = TOPICS.validate(topics)
+    print(f"--- Gemini returned {len(valid)} topics ({len(rejects)} rejected) ---")
+    # Stored as JSON in AnalyzedSection, so the scores become strings here.
+    return [topic.model_dump(mode='json') for topic in valid]
+
+
+def _analyze_chunk(text):
+    try:
+        return call_llm_for_analysis(text)
+    finally:
+        # The LLM cache uses the database from this pool thread.
+        connection.close()
+
+
+def section_hash(page_hashes, start, end):
+    """Hash of pages start..end from their stored hashes; changes when any of them changes or moves."""
+    digest = hashlib.sha256()
+    for number in range(start, end + 1):
+        digest.update(f"{number}:{page_hashes.get(number, '')}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def analyze_sections(material, pages):
+    """
+    Returns [(chunk, sha256, topics), ...] for the material's sections, in
+    page order.
+
+    Sections of the last analysis whose pages are all unchanged (compared
+    by the stored page hashes) keep their page range and topics. Only the
+    pages outside them are split into new sections of about
+    ANALYSIS_CHUNK_TOKENS tokens and sent to the LLM,
+    ANALYSIS_PARALLEL_CHUNKS at a time, so editing a page re-analyzes just
+    the section it was in.
+    """
+    page_hashes = text_store.page_hashes(material)
+    kept, covered = [], set()
+    for section in AnalyzedSection.objects.filter(material=material):
+        if section.content_sha256 == section_hash(page_hashes, section.start_page, section.end_page):
+            kept.append((Chunk(section.start_page, section.end_page, ''), section.content_sha256, section.topics))
+            covered.update(range(section.start_page, section.end_page + 1))
+
+    # Runs of consecutive pages that are not in a kept section.
+    runs, previous = [], None
+    for number, text in pages:
+        if number in covered:
+            continue
+        if previous is None or number != previous + 1:
+            runs.append([])
+        runs[-1].append((number, text))
+        previous = number
+    chunks = [chunk for run in runs for chunk in split_pages(run, settings.ANALYSIS_CHUNK_TOKENS)]
+    print(f"{len(kept) + len(chunks)} sections, {len(chunks)} changed since the last analysis")
+
+    results = [None] * len(chunks)
+    if chunks:
+        with ThreadPoolExecutor(max_workers=max(1, min(settings.ANALYSIS_PARALLEL_CHUNKS, len(chunks)))) as pool:
+            for i, topics in enumerate(pool.map(_analyze_chunk, (chunk.text for chunk in chunks))):
+                results[i] = clamp_pages(topics, chunks[i])
+
+    failed = [f"{c.start_page}-{c.end_page}" for c, topics in zip(chunks, results) if not topics]
+    if failed:
+        # Sections that did succeed are cached, so the retry only redoes these.
+        raise AnalysisError(f"LLM analysis returned no topics for pages {', '.join(failed)}.")
+    analyzed = [
+        (chunk, section_hash(page_hashes, chunk.start_page, chunk.end_page), topics)
+        for chunk, topics in zip(chunks, results)
+    ]
+    # sorted() is stable, so the parts of a split page stay in order.
+    return sorted(kept + analyzed, key=lambda section: section[0].start_page)
 
-def analyze_material(material_id: int):
+
+def save_topics(material, topic_data_list):
+    """
+    Upserts the material's topics, matched by normalized name, so existing
+    Topic rows (and their quiz questions and results) keep their ids.
+    Topics no longer found in the material are deleted; items that do not
+    fit TopicSchema are skipped.
+    """
+    existing = {normalize_topic_name(t.topic_name): t for t in Topic.objects.filter(material=material)}
+    to_update, to_create, seen = [], [], set()
+
+    valid, _ = TOPICS.validate(topic_data_list)
+    for data in valid:
+        key = normalize_topic_name(data.topic_name)
+        topic = existing.get(key)
+        if topic is None:
+            topic = Topic(material=material)
+            to_create.append(topic)
+        elif key not in seen:
+            to_update.append(topic)
+        else:
+            continue
+        seen.add(key)
+
+        topic.topic_name = data.topic_name
+        topic.difficulty_score = data.difficulty_score
+        topic.difficulty_class = data.difficulty_class
+        topic.summary = data.summary
+        topic.sequence_number = data.sequence_number
+        topic.start_page = data.start_page
+        topic.end_page = data.end_page
+
+    stale = [topic.id for key, topic in existing.items() if key not in seen]
+    if stale:
+        Topic.objects.filter(id__in=stale).delete()
+    if to_update:
+        # Move the kept topics out of the way first: (material, sequence_number) is unique.
+        Topic.objects.filter(id__in=[t.id for t in to_update]).update(sequence_number=F('sequence_number') + RENUMBER_OFFSET)
+        Topic.objects.bulk_update(
+            to_update,
+            ['topic_name', 'difficulty_score', 'difficulty_class', 'summary', 'sequence_number', 'start_page', 'end_page']
+        )
+    if to_create:
+        Topic.objects.bulk_create(to_create)
+    return len(to_create), len(to_update), len(stale)
+
+
+class AnalysisError(Exception):
+    """
+    Raised when a material cannot be analyzed.
+
+    `retryable` is False for failures that will not go away on a second
+    attempt (missing material, PDF without extractable text).
+    """
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def analyze_material(material_id: int, on_stage=None):
     """
     The main service function to download, parse, and analyze a material.
+
+    The text is read from the material's stored pages; it is only extracted
+    from the PDF when nothing has been stored yet (e.g. a failed extraction
+    at upload time). `on_stage` is called with the name of each step as it
+    starts so that a background job can report progress.
+    Raises `AnalysisError` on failure.
     """
+    def stage(name):
+        if on_stage:
+            on_stage(name)
+
     try:
         material = Material.objects.get(pk=material_id)
     except Material.DoesNotExist:
-        print(f"Error: Material with ID {material_id} not found.")
-        return
-
-    if not material.download_url:
-        print(f"Error: Material '{material.title}' has no download URL.")
-        return
+        raise AnalysisError(f"Material with ID {material_id} not found.", retryable=False)
 
     print(f"Starting analysis for: {material.title}")
 
-    # Step 1: Download the PDF content
+    # Step 1 & 2: Get the text (extracting it from the cached PDF the first time)
+    stage('extract')
     try:
-        response = requests.get(material.download_url)
-        response.raise_for_status()
-        pdf_content = response.content
-        print("PDF downloaded successfully.")
-    except requests.exceptions.RequestException as e:
-        print(f"Error downloading PDF from {material.download_url}: {e}")
-        return
-
-    # Step 2: Extract text from the PDF
-    full_text = ""
-    try:
-        with pdfplumber.open(BytesIO(pdf_content)) as pdf:
-            for page in pdf.pages:
-                text = page.extract_text()
-                if text:
-                    full_text += text + "\n"
-        print(f"Text extracted successfully. Total characters: {len(full_text)}")
+        text_store.ensure_pages(material)
+        pages = text_store.read_pages(material)
+        full_text = join_pages(text for _, text in pages)
+        print(f"Text loaded successfully. Total characters: {len(full_text)}")
+    except (requests.exceptions.RequestException, FileNotFoundError) as e:
+        raise AnalysisError(f"Error downloading PDF from {material.download_url}: {e}") from e
+    except ExtractionMemoryError as e:
+        raise AnalysisError(str(e), retryable=False) from e
     except Exception as e:
-        print(f"Error extracting text from PDF for material ID {material_id}: {e}")
-        return
+        raise AnalysisError(f"Error extracting text from PDF for material ID {material_id}: {e}") from e
 
     if not full_text.strip():
-        print("Extracted text is empty. Aborting analysis.")
-        return
+        raise AnalysisError("Extracted text is empty. Aborting analysis.", retryable=False)
 
-    # Step 3: Send the text to the LLM for analysis
-    topic_data_list = call_llm_for_analysis(full_text)
+    # Step 3: Send the changed sections of the text to the LLM
+    stage('llm')
+    try:
+        sections = analyze_sections(material, pages)
+    except LLMError as e:
+        raise AnalysisError(f"LLM analysis failed: {e}", retryable=e.retryable) from e
 
+    topic_data_list = merge_topics([topics for _, _, topics in sections])
     if not topic_data_list:
-        print("LLM analysis did not return any topics.")
-        return
-
-    # Step 4: Clear old analysis results
-    Topic.objects.filter(material=material).delete()
-    print(f"Cleared old topic entries for '{material.title}'.")
-
-    # Step 5: Create and save new Topic objects
-    topics_to_create = []
-    for data in topic_data_list:
-        if not all(k in data for k in ['topic_name', 'difficulty_score', 'difficulty_class', 'summary', 'sequence_number']):
-            print(f"Skipping malformed topic data from LLM: {data}")
-            continue
-            
-        topics_to_create.append(
-            Topic(
+        raise AnalysisError("LLM analysis did not return any topics.")
+
+    # Step 4: Update the topics in place and remember what each section contained
+    stage('save')
+    with transaction.atomic():
+        created, updated, deleted = save_topics(material, topic_data_list)
+        AnalyzedSection.objects.filter(material=material).delete()
+        AnalyzedSection.objects.bulk_create([
+            AnalyzedSection(
                 material=material,
-                topic_name=data['topic_name'],
-                difficulty_score=data['difficulty_score'],
-                difficulty_class=data['difficulty_class'].lower(),
-                summary=data['summary'],
-                sequence_number=data['sequence_number']
+                start_page=chunk.start_page,
+                end_page=chunk.end_page,
+                content_sha256=sha,
+                topics=topics,
             )
-        )
-    
-    if topics_to_create:
-        Topic.objects.bulk_create(topics_to_create)
-        print(f"Successfully saved {len(topics_to_create)} new topics for '{material.title}'.")
+            for chunk, sha, topics in sections
+        ])
+    print(f"Saved topics for '{material.title}': {created} new, {updated} updated, {deleted} removed.")
 
     print(f"Analysis complete for: {material.title}")
@@ -0,0 +1,177 @@
+"""
+Splitting a material's text into prompt-sized chunks, and merging the topics
+found in each chunk back into one list.
+
+Chunks follow page boundaries. A single page that is over the budget on its
+own is split before its headings (or, failing that, its paragraphs). Every
+page starts with a "[Page N]" marker so the LLM can say where topics are.
+"""
+import re
+from dataclasses import dataclass
+
+from llm.gateway import estimate_tokens
+
+# Lines that look like the start of a section: "3.2 Sorting", "Chapter 4", "UNIT II ..."
+HEADING_RE = re.compile(
+    r'^\s*(?:(?i:chapter|unit|section|module|part)\b.*|\d+(?:\.\d+)*\.?\s+\S.*|[A-Z][A-Z0-9 ,:&-]{3,})$'
+)
+
+DIFFICULTY_CLASSES = (('easy', 4.0), ('medium', 7.0), ('hard', None))
+
+
+@dataclass
+class Chunk:
+    start_page: int
+    end_page: int
+    text: str
+
+
+def page_marker(number):
+    return f"[Page {number}]"
+
+
+def _split_page(text, token_budget):
+    """Splits one oversized page before headings, then paragraphs, then lines."""
+    lines = text.split('\n')
+    boundaries = [i for i, line in enumerate(lines) if i and HEADING_RE.match(line)]
+    if not boundaries:
+        boundaries = [i for i, line in enumerate(lines) if i and not line.strip()]
+    if not boundaries:
+        boundaries = list(range(1, len(lines)))
+
+    sections, start = [], 0
+    for boundary in boundaries + [len(lines)]:
+        sections.append('\n'.join(lines[start:boundary]))
+        start = boundary
+
+    parts, current = [], ''
+    for section in sections:
+        candidate = f"{current}\n{section}" if current else section
+        if current and estimate_tokens(candidate) > token_budget:
+            parts.append(current)
+            current = section
+        else:
+            current = candidate
+    if current:
+        parts.append(current)
+    return parts
+
+
+def split_pages(pages, token_budget):
+    """
+    Groups [(page_number, text), ...] into Chunks of at most about
+    `token_budget` tokens each.
+    """
+    chunks = []
+    start, texts, tokens = None, [], 0
+
+    def flush(end):
+        nonlocal start, texts, tokens
+        if texts:
+            chunks.append(Chunk(start, end, '\n'.join(texts)))
+        start, texts, tokens = None, [], 0
+
+    previous = None
+    for number, text in pages:
+        if not text.strip():
+            continue
+        page_tokens = estimate_tokens(text)
+
+        if page_tokens > token_budget:
+            flush(previous)
+            for part in _split_page(text, token_budget):
+                chunks.append(Chunk(number, number, f"{page_marker(number)}\n{part}"))
+        else:
+            if texts and tokens + page_tokens > token_budget:
+                flush(previous)
+            if start is None:
+                start = number
+            texts.append(f"{page_marker(number)}\n{text}")
+            tokens += page_tokens
+        previous = number
+
+    flush(previous)
+    return chunks
+
+
+def normalize_topic_name(name):
+    """'  Binary Search-Trees ' -> 'binary search trees'"""
+    return ' '.join(re.sub(r'[^\w\s]', ' ', name.lower()).split())
+
+
+def difficulty_class(score):
+    for label, upper in DIFFICULTY_CLASSES:
+        if upper is None or score < upper:
+            return label
+
+
+def clamp_pages(topics, chunk):
+    """
+    Makes every topic's start_page/end_page integers inside the chunk's
+    page range, defaulting to the whole chunk when the LLM gave none.
+    """
+    for topic in topics:
+        if not isinstance(topic, dict):
+            continue
+        start = _as_number(topic.get('start_page'), chunk.start_page)
+        end = _as_number(topic.get('end_page'), start)
+        start = int(min(max(start, chunk.start_page), chunk.end_page))
+        end = int(min(max(end, start), chunk.end_page))
+        topic['start_page'], topic['end_page'] = start, end
+    return topics
+
+
+def merge_topics(chunk_results):
+    """
+    Merges the topic lists of consecutive chunks into one.
+
+    Topics with the same normalized name are combined: their difficulty
+    scores are averaged, the class is derived again from that score, the
+    first (earliest) summary is kept and the page span covers all of them.
+    `sequence_number` is reassigned in document order: by chunk, then by
+    the order within the chunk.
+    """
+    merged = {}
+    for chunk_index, topics in enumerate(chunk_results):
+        topics = [topic for topic in topics if isinstance(topic, dict)]
+        ordered = sorted(enumerate(topics), key=lambda item: (_as_number(item[1].get('sequence_number'), item[0]), item[0]))
+        for position, (_, topic) in enumerate(ordered):
+            key = normalize_topic_name(str(topic.get('topic_name', '')))
+            if not key:
+                continue
+            score = _as_number(topic.get('difficulty_score'), None)
+            if key not in merged:
+                merged[key] = {
+                    **topic,
+                    'order': (chunk_index, position),
+                    'scores': [score] if score is not None else [],
+                }
+            else:
+                if score is not None:
+                    merged[key]['scores'].append(score)
+                _widen_span(merged[key], topic)
+
+    result = []
+    for sequence_number, topic in enumerate(sorted(merged.values(), key=lambda t: t['order']), start=1):
+        scores = topic.pop('scores')
+        topic.pop('order')
+        if scores:
+            topic['difficulty_score'] = round(sum(scores) / len(scores), 1)
+            topic['difficulty_class'] = difficulty_class(topic['difficulty_score'])
+        topic['sequence_number'] = sequence_number
+        result.append(topic)
+    return result
+
+
+def _widen_span(merged, topic):
+    for field, pick in (('start_page', min), ('end_page', max)):
+        values = [v for v in (merged.get(field), topic.get(field)) if isinstance(v, int)]
+        if values:
+            merged[field] = pick(values)
+
+
+def _as_number(value, default):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.24 on 2026-10-18 11:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0005_material_content_sha256'),
+        ('topic_analysis', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyzedSection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_page', models.PositiveIntegerField()),
+                ('end_page', models.PositiveIntegerField()),
+                ('content_sha256', models.CharField(max_length=64)),
+                ('topics', models.JSONField(help_text="The LLM's topic list for this section.")),
+                ('analyzed_at', models.DateTimeField(auto_now=True)),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='analyzed_sections', to='materials.material')),
+            ],
+            options={
+                'ordering': ['start_page', 'id'],
+                'indexes': [models.Index(fields=['material', 'content_sha256'], name='topic_analy_materia_7b41dd_idx')],
+            },
+        ),
+    ]
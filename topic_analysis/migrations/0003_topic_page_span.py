@@ -0,0 +1,23 @@
+# Generated by Django 4.2.24 on 2026-10-18 11:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('topic_analysis', '0002_analyzedsection'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='topic',
+            name='end_page',
+            field=models.PositiveIntegerField(blank=True, help_text='Last PDF page covering this topic.', null=True),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='start_page',
+            field=models.PositiveIntegerField(blank=True, help_text='First PDF page covering this topic (1-based).', null=True),
+        ),
+    ]
@@ -36,6 +36,14 @@ class Topic(models.Model):
     sequence_number = models.PositiveIntegerField(
         help_text="The order in which the topic appears in the material."
     )
+    start_page = models.PositiveIntegerField(
+        null=True, blank=True,
+        help_text="First PDF page covering this topic (1-based)."
+    )
+    end_page = models.PositiveIntegerField(
+        null=True, blank=True,
+        help_text="Last PDF page covering this topic."
+    )
 
     class Meta:
         # Order topics by their sequence number by default
@@ -45,3 +53,29 @@ class Topic(models.Model):
 
     def __str__(self):
         return f"{self.sequence_number}. {self.topic_name} ({self.get_difficulty_class_display()}) for '{self.material.title}'"
+
+
+class AnalyzedSection(models.Model):
+    """
+    A section (chunk of pages) of a Material as it was last sent to the LLM,
+    with the topics found in it. `content_sha256` covers the hashes of its
+    pages; re-analysis keeps the sections whose pages are unchanged, with
+    their page range and topics, and only sends the other pages.
+    """
+    material = models.ForeignKey(
+        Material,
+        related_name='analyzed_sections',
+        on_delete=models.CASCADE
+    )
+    start_page = models.PositiveIntegerField()
+    end_page = models.PositiveIntegerField()
+    content_sha256 = models.CharField(max_length=64)
+    topics = models.JSONField(help_text="The LLM's topic list for this section.")
+    analyzed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['start_page', 'id']
+        indexes = [models.Index(fields=['material', 'content_sha256'])]
+
+    def __str__(self):
+        return f"Pages {self.start_page}-{self.end_page} of '{self.material.title}'"
@@ -0,0 +1,60 @@
+"""
+What a topic from the LLM must look like before it is saved as a Topic.
+"""
+from decimal import Decimal
+from typing import Optional
+
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+
+from llm.validation import ItemValidator
+from .chunking import difficulty_class
+
+DIFFICULTY_CLASSES = ('easy', 'medium', 'hard')
+
+
+class TopicSchema(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    topic_name: str = Field(min_length=1)
+    difficulty_score: Decimal
+    difficulty_class: Optional[str] = None
+    summary: str = Field(min_length=1)
+    sequence_number: int
+    start_page: Optional[int] = None
+    end_page: Optional[int] = None
+
+    @field_validator('topic_name')
+    @classmethod
+    def fit_name(cls, value):
+        return value[:255]
+
+    @field_validator('difficulty_score')
+    @classmethod
+    def clamp_score(cls, value):
+        return min(max(value, Decimal(1)), Decimal(10)).quantize(Decimal('0.01'))
+
+    @field_validator('sequence_number')
+    @classmethod
+    def positive_sequence(cls, value):
+        return max(value, 1)
+
+    @field_validator('start_page', 'end_page', mode='wrap')
+    @classmethod
+    def page_or_none(cls, value, handler):
+        # A page the LLM got wrong only loses the span, not the topic.
+        try:
+            page = handler(value)
+        except ValueError:
+            return None
+        return page if page is not None and page >= 1 else None
+
+    @model_validator(mode='after')
+    def check_class(self):
+        label = (self.difficulty_class or '').lower()
+        self.difficulty_class = label if label in DIFFICULTY_CLASSES else difficulty_class(float(self.difficulty_score))
+        if self.start_page and self.end_page and self.end_page < self.start_page:
+            self.end_page = self.start_page
+        return self
+
+
+TOPICS = ItemValidator(TopicSchema, 'topic')
@@ -0,0 +1,15 @@
+from jobs.queue import PermanentJobError, register
+from .analysis_service import AnalysisError, analyze_material
+
+
+@register('analyze_material')
+def run_analysis_task(job):
+    """
+    Background job wrapper around `analyze_material`.
+    """
+    try:
+        analyze_material(job.payload['material_id'], on_stage=job.set_stage)
+    except AnalysisError as e:
+        if not e.retryable:
+            raise PermanentJobError(str(e)) from e
+        raise
@@ -1,3 +1,170 @@
-from django.test import TestCase
+import zlib
+from unittest import mock
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+
+from llm import fake
+from llm.gateway import estimate_tokens
+from materials.models import Material, MaterialTextPage
+from materials.tests import FakeBackendsMixin
+from materials.utils import text_store
+from quiz.models import QuizQuestion
+
+from . import analysis_service
+from .analysis_service import analyze_material, save_topics
+from .chunking import Chunk, clamp_pages, merge_topics, split_pages
+from .models import AnalyzedSection, Topic
+
+
+def words(count):
+    return ' '.join(['word'] * count)
+
+
+def topic(name, score, sequence, start=None, end=None, summary='Summary.'):
+    return {
+        'topic_name': name, 'difficulty_score': score, 'difficulty_class': 'medium',
+        'summary': summary, 'sequence_number': sequence, 'start_page': start, 'end_page': end,
+    }
+
+
+class ChunkingTests(TestCase):
+
+    def test_pages_are_grouped_within_the_budget(self):
+        pages = [(1, words(20)), (2, words(20)), (3, ' '), (4, words(20))]  # ~26 tokens a page
+        chunks = split_pages(pages, token_budget=60)
+        self.assertEqual([(c.start_page, c.end_page) for c in chunks], [(1, 2), (4, 4)])
+        self.assertTrue(chunks[0].text.startswith('[Page 1]\n'))
+        self.assertIn('\n[Page 2]\n', chunks[0].text)
+        self.assertNotIn('[Page 3]', ''.join(c.text for c in chunks))  # blank pages are skipped
+
+    def test_an_oversized_page_is_split_before_its_headings(self):
+        text = f"1. Arrays\n{words(40)}\n2. Linked Lists\n{words(40)}"
+        chunks = split_pages([(5, text)], token_budget=60)
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual({(c.start_page, c.end_page) for c in chunks}, {(5, 5)})
+        self.assertTrue(chunks[1].text.startswith('[Page 5]\n2. Linked Lists'))
+
+    def test_pages_are_clamped_to_the_chunk(self):
+        topics = clamp_pages(
+            [topic('A', 5, 1, start=1, end=99), topic('B', 5, 2), topic('C', 5, 3, start='7', end='x')],
+            Chunk(4, 8, ''),
+        )
+        self.assertEqual([(t['start_page'], t['end_page']) for t in topics], [(4, 8), (4, 4), (7, 7)])
+
+    def test_topics_repeated_across_chunks_are_merged(self):
+        merged = merge_topics([
+            [topic('Sorting', 4, 2, 1, 2, summary='First.'), topic('Binary Search', 8, 1, 1, 1)],
+            [topic('binary-search', 9, 1, 3, 4, summary='Later.'), topic('Graphs', 2, 2, 4, 4)],
+        ])
+        self.assertEqual([t['topic_name'] for t in merged], ['Binary Search', 'Sorting', 'Graphs'])
+        self.assertEqual([t['sequence_number'] for t in merged], [1, 2, 3])
+        binary_search = merged[0]
+        self.assertEqual(binary_search['difficulty_score'], 8.5)
+        self.assertEqual(binary_search['difficulty_class'], 'hard')
+        self.assertEqual((binary_search['start_page'], binary_search['end_page']), (1, 4))
+        self.assertEqual(merged[1]['summary'], 'First.')
+
+
+class MapReduceAnalysisTests(FakeBackendsMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(setattr, fake, 'responder', fake.answer)
+        self.prompts = []
+
+        def responder(model, prompt):
+            self.prompts.append(prompt)
+            return fake.answer(model, prompt)
+        fake.responder = responder
+
+        self.login()
+        response = self.upload(pages=5)
+        self.material = Material.objects.get(id=response.data['material_id'])
+        pages = text_store.read_pages(self.material)
+        self.page_tokens = max(estimate_tokens(text) for _, text in pages)
+
+    def test_each_chunk_is_analyzed_and_the_topics_merged(self):
+        with override_settings(ANALYSIS_CHUNK_TOKENS=self.page_tokens + 1, ANALYSIS_PARALLEL_CHUNKS=2):
+            analyze_material(self.material.id)
+
+        self.assertEqual(len(self.prompts), 5)  # one page per chunk
+        sections = AnalyzedSection.objects.filter(material=self.material)
+        self.assertEqual([(s.start_page, s.end_page) for s in sections], [(n, n) for n in range(1, 6)])
+
+        topics = list(Topic.objects.filter(material=self.material))
+        self.assertEqual([t.sequence_number for t in topics], list(range(1, len(topics) + 1)))
+        self.assertEqual(len({t.topic_name.lower() for t in topics}), len(topics))
+        for t in topics:
+            self.assertTrue(1 <= t.start_page <= t.end_page <= 5)
+
+    def test_a_text_within_the_budget_is_sent_once(self):
+        with override_settings(ANALYSIS_CHUNK_TOKENS=self.page_tokens * 10):
+            analyze_material(self.material.id)
+        self.assertEqual(len(self.prompts), 1)
+        self.assertIn('[Page 5]', self.prompts[0])
+
+
+class IncrementalAnalysisTests(FakeBackendsMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.login()
+        response = self.upload(pages=4)
+        self.material = Material.objects.get(id=response.data['material_id'])
+        page_tokens = max(estimate_tokens(text) for _, text in text_store.read_pages(self.material))
+        overrides = override_settings(ANALYSIS_CHUNK_TOKENS=page_tokens + 1)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def add_question(self, topic):
+        return QuizQuestion.objects.create(topic=topic, question_text=f"About {topic.topic_name}?", correct_option='A')
+
+    def edit_page(self, number, text):
+        MaterialTextPage.objects.filter(material_text__material=self.material, page_number=number).update(
+            content=zlib.compress(text.encode('utf-8')), content_sha256=text_store.page_hash(text),
+        )
+
+    def test_unchanged_sections_keep_their_topics_and_quizzes(self):
+        analyze_material(self.material.id)
+        before = {t.start_page: t for t in Topic.objects.filter(material=self.material)}
+        questions = {page: self.add_question(t) for page, t in before.items()}
+
+        self.edit_page(4, "Compiler construction: lexers, parsers, grammars, syntax trees, "
+                          "semantic analysis, register allocation and code generation.")
+        analyze_material(self.material.id)
+
+        after = {t.start_page: t for t in Topic.objects.filter(material=self.material)}
+        for page in (1, 2, 3):
+            self.assertEqual(after[page].id, before[page].id)
+            self.assertTrue(QuizQuestion.objects.filter(id=questions[page].id).exists())
+
+        # Page 4 got a new topic; the old one went away with its quiz.
+        self.assertNotEqual(after[4].topic_name, before[4].topic_name)
+        self.assertFalse(Topic.objects.filter(id=before[4].id).exists())
+        self.assertFalse(QuizQuestion.objects.filter(id=questions[4].id).exists())
+
+    def test_only_changed_sections_are_sent_again(self):
+        analyze_material(self.material.id)
+        self.edit_page(2, "Operating systems: processes, threads, scheduling, virtual memory, "
+                          "paging, file systems, interrupts and device drivers.")
+        with mock.patch('topic_analysis.analysis_service.call_llm_for_analysis',
+                        wraps=analysis_service.call_llm_for_analysis) as call:
+            analyze_material(self.material.id)
+        self.assertEqual(call.call_count, 1)
+        self.assertIn('[Page 2]', call.call_args.args[0])
+
+    def test_save_topics_upserts_by_name(self):
+        save_topics(self.material, [topic('Sorting', 3, 1, 1, 1), topic('Graphs', 6, 2, 2, 2)])
+        sorting = Topic.objects.get(material=self.material, topic_name='Sorting')
+        graphs = Topic.objects.get(material=self.material, topic_name='Graphs')
+        kept, dropped = self.add_question(sorting), self.add_question(graphs)
+
+        # Reordered and renamed only in case/punctuation: the sequence numbers swap without a clash.
+        counts = save_topics(self.material, [topic('Hashing', 5, 1, 1, 1), topic('sorting!', 4, 2, 2, 2)])
+        self.assertEqual(counts, (1, 1, 1))
+
+        sorting.refresh_from_db()
+        self.assertEqual((sorting.topic_name, sorting.sequence_number), ('sorting!', 2))
+        self.assertTrue(QuizQuestion.objects.filter(id=kept.id).exists())
+        self.assertFalse(Topic.objects.filter(id=graphs.id).exists())
+        self.assertFalse(QuizQuestion.objects.filter(id=dropped.id).exists())
@@ -2,22 +2,17 @@ from django.http import JsonResponse
 from django.views.decorators.http import require_POST,require_GET
 from django.contrib.auth.decorators import login_required
 from materials.models import Material
-from .analysis_service import analyze_material
+from jobs.queue import enqueue
 from .models import Topic
 
-# For a production setup, you would use a task queue like Celery
-# from .tasks import run_analysis_task
-
 @login_required
 @require_POST
 def trigger_analysis(request, material_id):
     """
     API endpoint to trigger the analysis of a material.
 
-    This view is the entry point for the analysis process.
-    IMPORTANT: For demonstration, it runs the analysis synchronously, which will
-    block the request and can time out for large files. In a production 
-    environment, you should delegate this to a background task runner.
+    The analysis itself runs in a background worker; this view only queues
+    it and returns the job id, which can be polled at /api/jobs/<job_id>/.
     """
     try:
         # A real implementation should include an authorization check, e.g.,
@@ -25,21 +20,13 @@ def trigger_analysis(request, material_id):
         Material.objects.get(pk=material_id)
     except Material.DoesNotExist:
         return JsonResponse({'status': 'error', 'message': 'Material not found.'}, status=404)
-    
-    # --- PRODUCTION APPROACH (using Celery) ---
-    # 1. Define a task in a `tasks.py` file: `@shared_task def run_analysis_task(material_id): analyze_material(material_id)`
-    # 2. Call the task here: `run_analysis_task.delay(material_id)`
-    # 3. Return an immediate response: `return JsonResponse({'status': 'queued', 'message': 'Analysis has been started.'})`
-    
-    # --- DEMONSTRATION APPROACH (Synchronous) ---
-    try:
-        analyze_material(material_id)
-        message = f'Analysis for material {material_id} completed successfully.'
-        return JsonResponse({'status': 'success', 'message': message})
-    except Exception as e:
-        # In a real app, you would log this exception.
-        print(f"An error occurred during analysis: {e}")
-        return JsonResponse({'status': 'error', 'message': 'An unexpected error occurred during analysis.'}, status=500)
+
+    job = enqueue('analyze_material', {'material_id': material_id}, user=request.user)
+    return JsonResponse({
+        'status': 'queued',
+        'message': f'Analysis for material {material_id} has been queued.',
+        'job_id': job.id,
+    }, status=202)
 
 
 @require_GET
@@ -62,7 +49,9 @@ def get_material_topics(request, material_id):
             'difficulty_score': float(topic.difficulty_score),
             'difficulty_class': topic.difficulty_class,
             'summary': topic.summary,
-            'sequence_number': topic.sequence_number
+            'sequence_number': topic.sequence_number,
+            'start_page': topic.start_page,
+            'end_page': topic.end_page,
         }
         for topic in topics
     ]